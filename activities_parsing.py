@@ -1,4 +1,5 @@
 from datetime import datetime
+from strava_client import get_client
 
 def extract_activity_summary(activity: dict) -> dict:
     def fmt_pace(speed_mps):
@@ -93,8 +94,6 @@ def format_activity_for_prompt(summary: dict) -> str:
     return "\n".join(lines)
 
 
-import requests
-
 def update_activity_by_id(access_token: str, activity_id: int, description: str = None, name: str = None):
     """
     Uses the Strava API to update an activity's fields using the updateActivityById operation.
@@ -108,11 +107,7 @@ def update_activity_by_id(access_token: str, activity_id: int, description: str
     Returns:
         dict: The updated activity object from the Strava API.
     """
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}"
-    headers = {
-        "Authorization": f"Bearer {access_token}",
-        "Content-Type": "application/json"
-    }
+    url = f"activities/{activity_id}"
 
     payload = {}
     if description:
@@ -120,7 +115,7 @@ def update_activity_by_id(access_token: str, activity_id: int, description: str
     if name:
         payload["name"] = name[:100]  # Strava name limit
 
-    response = requests.put(url, headers=headers, json=payload)
+    response = get_client().put(url, access_token=access_token, json=payload)
 
     if response.status_code == 200:
         print('DONE')
@@ -144,15 +139,12 @@ def post_activity_comment(access_token: str, activity_id: int, comment_text: str
     Returns:
         dict: The API response containing the created comment object.
     """
-    url = f"https://www.strava.com/api/v3/activities/{activity_id}/comments"
-    headers = {
-        "Authorization": f"Bearer {access_token}"
-    }
+    url = f"activities/{activity_id}/comments"
     payload = {
         "text": comment_text[:512]  # Safeguard for comment length
     }
 
-    response = requests.post(url, headers=headers, data=payload)
+    response = get_client().post(url, access_token=access_token, data=payload)
 
     if response.status_code == 201:
         return response.json()
@@ -0,0 +1,100 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Tuple
+
+PERIOD_WEEK = 'week'
+PERIOD_MONTH = 'month'
+PERIODS = (PERIOD_WEEK, PERIOD_MONTH)
+# Aggregated columns of activity_rollups and the activity field each one sums
+METRICS = {
+    'count': None,
+    'distance': 'distance',
+    'moving_time': 'moving_time',
+    'elevation_gain': 'total_elevation_gain'
+}
+# Activity columns needed to compute rollups
+ACTIVITY_COLUMNS = ['start_date_local', 'sport_type', 'distance', 'moving_time', 'total_elevation_gain']
+
+
+def period_start(start_date_local: str, period: str) -> str:
+    """First day (ISO date) of the week (Monday) or month containing an activity"""
+    day = datetime.fromisoformat(start_date_local[:10]).date()
+    if period == PERIOD_WEEK:
+        day -= timedelta(days=day.weekday())
+    else:
+        day = day.replace(day=1)
+    return day.isoformat()
+
+
+def rollup_deltas(activities: Iterable[Dict], sign: int = 1) -> Dict[Tuple[str, str, str], Dict[str, float]]:
+    """
+    Per (period, period_start, sport_type) sums of a set of activity rows.
+
+    sign=-1 gives the amounts to take back when the rows are deleted or replaced.
+    """
+    deltas = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for activity in activities:
+        sport_type = activity.get('sport_type') or 'Unknown'
+        for period in PERIODS:
+            totals = deltas[(period, period_start(activity['start_date_local'], period), sport_type)]
+            for metric, field in METRICS.items():
+                totals[metric] += sign * (1 if field is None else (activity.get(field) or 0))
+    return dict(deltas)
+
+
+def merge_deltas(*deltas: Dict) -> Dict:
+    merged = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for delta in deltas:
+        for key, totals in delta.items():
+            for metric, value in totals.items():
+                merged[key][metric] += value
+    return dict(merged)
+
+
+def deltas_to_rows(deltas: Dict) -> List[Dict]:
+    """Deltas as the JSON rows of the apply_rollup_deltas function (migrations/0002_apply_rollup_deltas.sql)"""
+    return [
+        {'period': period, 'period_start': start, 'sport_type': sport_type, **totals}
+        for (period, start, sport_type), totals in deltas.items()
+    ]
+
+
+def apply_deltas(athlete_id: str, stored_rows: List[Dict], deltas: Dict) -> Tuple[List[Dict], List[Tuple[str, str, str]]]:
+    """
+    Add deltas to the stored rollup rows they touch.
+
+    Returns:
+        tuple: Rows to upsert, and keys whose count dropped to zero (to delete).
+    """
+    stored = {(row['period'], row['period_start'], row['sport_type']): row for row in stored_rows}
+    now = datetime.now().isoformat()
+    upserts, emptied = [], []
+    for key, totals in deltas.items():
+        current = stored.get(key, {})
+        row = {metric: (current.get(metric) or 0) + value for metric, value in totals.items()}
+        if row['count'] <= 0:
+            if current:
+                emptied.append(key)
+            continue
+        period, start, sport_type = key
+        row.update({'athlete_id': athlete_id, 'period': period, 'period_start': start, 'sport_type': sport_type, 'updated_at': now})
+        upserts.append(row)
+    return upserts, emptied
+
+
+def totals_by_sport(rows: List[Dict]) -> Dict[str, Dict[str, float]]:
+    """Collapse rollup rows of one period type into all-time totals per sport_type"""
+    totals = defaultdict(lambda: dict.fromkeys(METRICS, 0))
+    for row in rows:
+        for metric in METRICS:
+            totals[row['sport_type']][metric] += row.get(metric) or 0
+    return dict(totals)
+
+
+def period_floor(period: str, periods_back: int, today: date = None) -> str:
+    """Start of the period periods_back periods before the current one"""
+    today = today or date.today()
+    if period == PERIOD_WEEK:
+        return (today - timedelta(days=today.weekday(), weeks=periods_back)).isoformat()
+    month_index = today.year * 12 + today.month - 1 - periods_back
+    return date(month_index // 12, month_index % 12 + 1, 1).isoformat()
@@ -0,0 +1,248 @@
+from collections import OrderedDict
+import io
+import os
+import shutil
+import threading
+from typing import Dict, List, Optional
+import numpy as np
+
+# Strava stream keys we keep, with the narrowest dtype that holds their range
+STREAM_DTYPES = {
+    'time': np.int32,               # seconds since start, can exceed int16 on long activities
+    'distance': np.float32,         # meters
+    'heartrate': np.int16,          # bpm
+    'altitude': np.float32,         # meters
+    'velocity_smooth': np.float32,  # m/s
+    'cadence': np.int16,            # rpm (half of steps/min for runs)
+    'watts': np.int16
+}
+STREAM_TYPES = list(STREAM_DTYPES)
+
+DEFAULT_STREAM_CACHE_DIR = os.path.join(".cache", "streams")
+DEFAULT_STREAM_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def to_stream_arrays(streams: Dict) -> Dict[str, np.ndarray]:
+    """
+    Convert a Strava streams response (key_by_type=true) into typed arrays.
+
+    Missing samples become 0 for integer streams and NaN for float streams.
+    Stream types not listed in STREAM_DTYPES are dropped.
+    """
+    arrays = {}
+    for name, dtype in STREAM_DTYPES.items():
+        stream = streams.get(name)
+        if not stream or not stream.get('data'):
+            continue
+        data = stream['data']
+        if None in data:
+            fill = 0 if np.issubdtype(dtype, np.integer) else np.nan
+            data = [fill if value is None else value for value in data]
+        arrays[name] = np.asarray(data, dtype=dtype)
+    return arrays
+
+
+def encode_streams(arrays: Dict[str, np.ndarray]) -> Dict:
+    """Pack typed arrays into a compressed npz blob (raw bytes, stored in a bytea column)"""
+    buffer = io.BytesIO()
+    np.savez_compressed(buffer, **arrays)
+    return {
+        'stream_types': list(arrays),
+        'sample_count': max((len(array) for array in arrays.values()), default=0),
+        'data': buffer.getvalue()
+    }
+
+
+def decode_streams(encoded: Dict) -> Dict[str, np.ndarray]:
+    """Unpack a blob produced by encode_streams"""
+    with np.load(io.BytesIO(encoded['data']), allow_pickle=False) as archive:
+        return {name: archive[name] for name in archive.files}
+
+
+class ActivityStreams:
+    """
+    Streams of one activity read lazily from the local cache.
+
+    Each stream is a memory-mapped .npy file that is only opened when accessed,
+    so holding many of these costs no memory until their samples are read.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._arrays: Dict[str, np.ndarray] = {}
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.npy")
+
+    def keys(self) -> List[str]:
+        return [name for name in STREAM_TYPES if os.path.exists(self._path(name))]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._arrays or os.path.exists(self._path(name))
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        if name not in self._arrays:
+            if not os.path.exists(self._path(name)):
+                raise KeyError(name)
+            self._arrays[name] = np.load(self._path(name), mmap_mode='r', allow_pickle=False)
+        return self._arrays[name]
+
+    def get(self, name: str, default=None) -> Optional[np.ndarray]:
+        return self[name] if name in self else default
+
+    def __len__(self) -> int:
+        """Number of samples"""
+        names = self.keys()
+        return len(self[names[0]]) if names else 0
+
+
+class StreamCache:
+    """
+    Local on-disk cache of activity streams, one uncompressed .npy file per stream.
+
+    Activities are evicted least-recently-used first once the cache holds more than max_bytes.
+    Recency is the modification time of an activity's directory, touched on every hit, so a
+    restarted process picks up the order left by the previous one.
+    """
+
+    def __init__(self, directory: str = DEFAULT_STREAM_CACHE_DIR, max_bytes: int = DEFAULT_STREAM_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # Activity directory -> size in bytes, least recently used first; scanned from disk on first use
+        self._sizes: Optional[OrderedDict] = None
+
+    def _activity_dir(self, athlete_id: str, activity_id) -> str:
+        return os.path.join(self.directory, str(athlete_id), str(activity_id))
+
+    @staticmethod
+    def _dir_size(directory: str) -> int:
+        with os.scandir(directory) as entries:
+            return sum(entry.stat().st_size for entry in entries if entry.is_file())
+
+    def _load_sizes(self) -> OrderedDict:
+        if self._sizes is None:
+            found = []
+            if os.path.isdir(self.directory):
+                for athlete in os.scandir(self.directory):
+                    if not athlete.is_dir():
+                        continue
+                    for activity in os.scandir(athlete.path):
+                        if activity.is_dir():
+                            found.append((activity.stat().st_mtime, activity.path, self._dir_size(activity.path)))
+            self._sizes = OrderedDict((path, size) for _, path, size in sorted(found))
+        return self._sizes
+
+    def get(self, athlete_id: str, activity_id) -> Optional[ActivityStreams]:
+        directory = self._activity_dir(athlete_id, activity_id)
+        if not os.path.isdir(directory):
+            return None
+        with self._lock:
+            sizes = self._load_sizes()
+            if directory in sizes:
+                sizes.move_to_end(directory)
+            try:
+                os.utime(directory)
+            except OSError:
+                pass
+        return ActivityStreams(directory)
+
+    def put(self, athlete_id: str, activity_id, arrays: Dict[str, np.ndarray]) -> ActivityStreams:
+        directory = self._activity_dir(athlete_id, activity_id)
+        os.makedirs(directory, exist_ok=True)
+        for name, array in arrays.items():
+            path = os.path.join(directory, f"{name}.npy")
+            # Write then rename, so a concurrent reader never maps a half-written file
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            with open(tmp_path, 'wb') as f:
+                np.save(f, array, allow_pickle=False)
+            os.replace(tmp_path, path)
+        with self._lock:
+            sizes = self._load_sizes()
+            sizes[directory] = self._dir_size(directory)
+            sizes.move_to_end(directory)
+            self._evict(sizes)
+        return ActivityStreams(directory)
+
+    def _evict(self, sizes: OrderedDict) -> None:
+        """Remove the least recently used activities until the cache fits in max_bytes, keeping the newest one"""
+        total = sum(sizes.values())
+        while total > self.max_bytes and len(sizes) > 1:
+            directory, size = sizes.popitem(last=False)
+            # Arrays already mapped by a reader stay valid after the files are unlinked
+            shutil.rmtree(directory, ignore_errors=True)
+            total -= size
+
+    def remove(self, athlete_id: str, activity_id) -> None:
+        directory = self._activity_dir(athlete_id, activity_id)
+        with self._lock:
+            if self._sizes is not None:
+                self._sizes.pop(directory, None)
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def size(self) -> int:
+        """Bytes held by the cache as seen by this process"""
+        with self._lock:
+            return sum(self._load_sizes().values())
+
+
+stream_cache = StreamCache()
+
+
+def load_activity_streams(storage, athlete_id: str, activity_id, fetch=None) -> Optional[ActivityStreams]:
+    """
+    Get the streams of an activity from the local cache, then Supabase, then Strava.
+
+    Args:
+        storage: Storage instance holding the compressed copies.
+        athlete_id (str): Owner of the activity.
+        activity_id: Strava activity ID.
+        fetch (callable, optional): Returns the Strava streams response for the activity,
+            called only when neither cache has it. The result is saved to both caches.
+
+    Returns:
+        ActivityStreams: Lazily loaded streams, or None if they are not available.
+    """
+    streams = stream_cache.get(athlete_id, activity_id)
+    if streams is not None:
+        return streams
+
+    encoded = storage.get_activity_streams(athlete_id, activity_id)
+    if encoded:
+        return stream_cache.put(athlete_id, activity_id, decode_streams(encoded))
+
+    if fetch is None:
+        return None
+    arrays = to_stream_arrays(fetch())
+    if not arrays:
+        return None
+    storage.save_activity_streams(athlete_id, activity_id, encode_streams(arrays))
+    return stream_cache.put(athlete_id, activity_id, arrays)
+
+
+def describe_streams(streams) -> str:
+    """Prompt section with what the summary fields miss: drift and variability over the activity"""
+    lines = []
+    heartrate = streams.get('heartrate')
+    velocity = streams.get('velocity_smooth')
+    if heartrate is not None and len(heartrate) >= 2:
+        half = len(heartrate) // 2
+        first_hr = float(np.mean(heartrate[:half]))
+        second_hr = float(np.mean(heartrate[half:]))
+        lines.append(f"- Heart rate 1st half / 2nd half: {first_hr:.0f} / {second_hr:.0f} bpm")
+        if velocity is not None and len(velocity) == len(heartrate) and first_hr and second_hr:
+            # Aerobic decoupling: how much the speed per heartbeat dropped in the second half
+            first_ratio = float(np.mean(velocity[:half])) / first_hr
+            second_ratio = float(np.mean(velocity[half:])) / second_hr
+            if first_ratio:
+                lines.append(f"- Aerobic decoupling: {(first_ratio - second_ratio) / first_ratio * 100:.1f}%")
+    if velocity is not None and len(velocity):
+        moving = velocity[velocity > 0.5]
+        if len(moving):
+            lines.append(f"- Speed variability (CV): {float(np.std(moving) / np.mean(moving)) * 100:.0f}%")
+    watts = streams.get('watts')
+    if watts is not None and len(watts):
+        lines.append(f"- Power p50 / p95: {np.percentile(watts, 50):.0f} / {np.percentile(watts, 95):.0f} W")
+    if not lines:
+        return ""
+    return "**📈 Streams:**\n" + "\n".join(lines)
@@ -0,0 +1,108 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+from activities_parsing import extract_activity_summary, format_activity_for_prompt
+from strava_api import get_activities, STRAVA_MAX_PER_PAGE
+from strava_client import StravaRateLimitError, PRIORITY_INTERACTIVE, PRIORITY_BACKGROUND
+from strava_async import backfill_activity_details
+
+# Number of most recent activities whose full payload and streams are fetched when they were only stored from a summary
+DETAIL_BACKFILL_COUNT = 10
+
+
+def _start_epoch(activity: Dict) -> int:
+    """Convert the UTC start_date of a Strava activity to epoch seconds"""
+    return int(datetime.fromisoformat(activity['start_date'].replace('Z', '+00:00')).timestamp())
+
+
+def _fetch_page(access_token: str, priority: int, **params) -> Optional[List[Dict]]:
+    """Get a page of activities, None when the sync has to stop (budget shed, error payload)"""
+    try:
+        activities = get_activities(access_token, priority=priority, **params)
+    except StravaRateLimitError as e:
+        # The cursors only cover stored pages, the next sync picks up from there
+        print(f"Activity sync paused: {e}")
+        return None
+    if not isinstance(activities, list):
+        # Strava returns an error object instead of a list (expired token, rate limit...)
+        print(f"Activity sync stopped: {activities}")
+        return None
+    return activities
+
+
+def _store_new_activities(storage, athlete_id: str, activities: List[Dict]) -> List:
+    """Store the activities of a page that are not stored yet, returns their IDs"""
+    # Activities already pushed by the webhook have a richer (detail based) summary, keep it
+    existing_ids = storage.get_existing_activity_ids(athlete_id, [activity['id'] for activity in activities])
+    new_activities = [activity for activity in activities if str(activity['id']) not in existing_ids]
+    if new_activities:
+        storage.add_activities(athlete_id, [
+            (activity, format_activity_for_prompt(extract_activity_summary(activity)))
+            for activity in new_activities
+        ])
+    return [activity['id'] for activity in new_activities]
+
+
+def sync_activities(storage, access_token: str, athlete_id: str, per_page: int = STRAVA_MAX_PER_PAGE, max_pages: Optional[int] = None,
+                    detail_count: int = DETAIL_BACKFILL_COUNT) -> int:
+    """
+    Ingest the activities started after the athlete's stored cursor, then the older history.
+
+    A first sync (no cursor) fetches the newest page with interactive priority, since it is what
+    a new athlete sees first, and records both its newest start (the cursor) and its oldest one
+    (the history cursor). Later syncs page forward from the cursor: Strava returns activities in
+    ascending start order when `after` is set, so the cursor is advanced after every page, and
+    the first of those pages is interactive too. The older history is then walked backwards one
+    page at a time with `before`, as background work shed first when the app-wide Strava budget
+    runs low; the history cursor is saved after every page so an interrupted backfill resumes
+    where it stopped.
+
+    Then, the full payloads of the most recent `detail_count` activities still stored from a
+    summary are fetched concurrently so their stored summaries include splits and segment
+    efforts, along with their sample streams; this is decided from the stored rows, so a sync
+    interrupted before this step catches up on a later one. Streams of older activities cost one
+    request each and are rarely viewed, they are fetched when an activity is opened
+    (see activity_streams.load_activity_streams).
+
+    Returns:
+        int: The number of activities ingested (already stored ones are skipped).
+    """
+    cursor = storage.get_sync_cursor(athlete_id)
+    ingested_ids = []
+    page = 1
+    if cursor is None:
+        activities = _fetch_page(access_token, PRIORITY_INTERACTIVE, page=1, per_page=per_page)
+        if activities:
+            ingested_ids.extend(_store_new_activities(storage, athlete_id, activities))
+            starts = [_start_epoch(activity) for activity in activities]
+            storage.save_sync_cursor(athlete_id, max(starts))
+            storage.save_history_cursor(athlete_id, min(starts) if len(activities) == per_page else None)
+    else:
+        while max_pages is None or page <= max_pages:
+            priority = PRIORITY_INTERACTIVE if page == 1 else PRIORITY_BACKGROUND
+            activities = _fetch_page(access_token, priority, after=cursor, page=page, per_page=per_page)
+            if not activities:
+                break
+            ingested_ids.extend(_store_new_activities(storage, athlete_id, activities))
+            storage.save_sync_cursor(athlete_id, max(_start_epoch(activity) for activity in activities))
+            if len(activities) < per_page:
+                break
+            page += 1
+
+    history_before = storage.get_history_cursor(athlete_id)
+    while history_before is not None and (max_pages is None or page < max_pages):
+        page += 1
+        activities = _fetch_page(access_token, PRIORITY_BACKGROUND, before=history_before, per_page=per_page)
+        if activities is None:
+            break
+        ingested_ids.extend(_store_new_activities(storage, athlete_id, activities))
+        # Newest first, so the page ends with its oldest activity; a short page reached the first one
+        history_before = _start_epoch(activities[-1]) if len(activities) == per_page else None
+        storage.save_history_cursor(athlete_id, history_before)
+
+    missing_details = storage.get_activity_ids_without_details(athlete_id, detail_count) if detail_count else []
+    if missing_details:
+        detailed = backfill_activity_details(storage, access_token, athlete_id, missing_details)
+        print(f"Fetched details for {detailed} activities of athlete {athlete_id}")
+
+    print(f"Synced {len(ingested_ids)} new activities for athlete {athlete_id}")
+    return len(ingested_ids)
@@ -0,0 +1,333 @@
+"""
+Offline benchmarks for WildStride hot paths.
+
+Strava, OpenAI and Supabase are replaced by local stand-ins (benchmark_fakes.py), so
+nothing here touches the network.
+
+    python benchmark.py run --suite parsing storage render startup --save baseline.json
+    python benchmark.py run --save current.json
+    python benchmark.py compare baseline.json current.json
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List
+import numpy as np
+from activities_parsing import extract_activity_summary, format_activity_for_prompt
+from benchmark_fakes import (FakeStravaAdapter, install_fake_openai, install_fake_strava, synthetic_activities,
+                             synthetic_activity, use_offline_secrets)
+
+SUITES = ["parsing", "storage", "render", "startup"]
+# (splits, segment efforts) of the synthetic payloads: short run, typical run, long race with many segments
+PAYLOAD_SIZES = [(5, 0), (20, 10), (100, 60)]
+# Relative change above which compare reports a regression
+DEFAULT_TOLERANCE = 0.15
+# Modules imported by the startup suite, each in a fresh interpreter
+STARTUP_MODULES = ["activities_parsing", "storage", "strava_api", "activity_sync", "llm", "jobs"]
+# Libraries whose import alone costs tens to hundreds of milliseconds
+HEAVY_MODULES = ["numpy", "pandas", "altair", "supabase", "postgrest", "openai"]
+
+# Run in a child interpreter: time one import (or the landing page run) after streamlit is loaded,
+# and report which heavy libraries it pulled in
+_STARTUP_PROBE = """
+import importlib, json, sys, time, tomllib, tracemalloc
+import streamlit
+from streamlit import config
+from streamlit.testing.v1 import AppTest
+target, secrets_path, trace_memory = sys.argv[1], sys.argv[2], sys.argv[3] == "1"
+config.set_option("secrets.files", [secrets_path])
+if target == "landing":
+    app = AppTest.from_file("streamlit_app.py", default_timeout=60)
+    with open(secrets_path, "rb") as f:
+        for key, value in tomllib.load(f).items():
+            app.secrets[key] = value
+before = set(sys.modules)
+if trace_memory:
+    tracemalloc.start()
+start = time.perf_counter()
+if target == "landing":
+    app.run()
+    if app.exception:
+        raise SystemExit(app.exception[0].message)
+else:
+    importlib.import_module(target)
+seconds = time.perf_counter() - start
+peak = tracemalloc.get_traced_memory()[1] if trace_memory else 0
+loaded = sorted({name.split(".")[0] for name in set(sys.modules) - before})
+print(json.dumps({"seconds": seconds, "peak": peak, "loaded": loaded}))
+"""
+
+
+def measure(fn: Callable, iterations: int, warmup: int = 1, items: int = 1) -> Dict:
+    """
+    Time `fn` over several calls and measure the peak memory of one extra call.
+
+    Memory is traced in a separate call, tracemalloc would otherwise inflate the timings.
+
+    Args:
+        fn (callable): The operation, called without arguments.
+        iterations (int): Number of timed calls.
+        warmup (int): Untimed calls made first (imports, caches).
+        items (int): Units of work per call, for the throughput.
+
+    Returns:
+        dict: iterations, throughput_per_s, p50_ms, p99_ms and peak_kb.
+    """
+    for _ in range(warmup):
+        fn()
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    latencies = np.array(latencies)
+    return {
+        'iterations': iterations,
+        'throughput_per_s': round(items * iterations / latencies.sum(), 2),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1)
+    }
+
+
+def bench_parsing(iterations: int) -> Dict[str, Dict]:
+    """Summarize and format detailed payloads of several sizes"""
+    results = {}
+    for n_splits, n_segments in PAYLOAD_SIZES:
+        label = f"splits={n_splits},segments={n_segments}"
+        activity = synthetic_activity(1, n_splits=n_splits, n_segments=n_segments)
+        summary = extract_activity_summary(activity)
+        results[f"parsing.extract_activity_summary[{label}]"] = measure(lambda: extract_activity_summary(activity), iterations * 10)
+        results[f"parsing.format_activity_for_prompt[{label}]"] = measure(lambda: format_activity_for_prompt(summary), iterations * 10)
+    return results
+
+
+def bench_storage(iterations: int, directory: str, activity_count: int = 1000) -> Dict[str, Dict]:
+    """Storage query patterns on the SQLite backend"""
+    from sqlite_backend import SQLiteClient
+    from storage import Storage
+
+    storage = Storage(SQLiteClient(f"{directory}/storage_bench.sqlite3"))
+    athlete_id = "4242"
+    activities = [(activity, "summary") for activity in synthetic_activities(activity_count, seed=7)]
+    storage.update_athlete({'id': athlete_id, 'firstname': 'Bench', 'lastname': 'Runner'})
+    storage.update_user_preferences(athlete_id, {'sport_type': 'Run', 'target_distance': 42})
+
+    results = {}
+    batch = 200
+    batches = iter(range(0, activity_count, batch))
+
+    def ingest_batch():
+        # The first pass inserts new activities, later passes upsert existing ones
+        start = next(batches, None)
+        start = 0 if start is None else start
+        storage.add_activities(athlete_id, activities[start:start + batch])
+
+    results[f"storage.add_activities[batch={batch}]"] = measure(ingest_batch, max(activity_count // batch, 1), warmup=0, items=batch)
+
+    def cold_dashboard():
+        storage._cache.clear()
+        storage.load_dashboard(athlete_id)
+
+    results["storage.load_dashboard[cold]"] = measure(cold_dashboard, iterations)
+    results["storage.load_dashboard[warm]"] = measure(lambda: storage.load_dashboard(athlete_id), iterations * 10)
+
+    def walk_history():
+        storage._cache.clear()
+        cursor, pages = None, 0
+        while True:
+            _, cursor = storage.get_activities_page(athlete_id, 50, cursor)
+            pages += 1
+            if cursor is None:
+                return pages
+
+    results[f"storage.get_activities_page[walk {activity_count}]"] = measure(walk_history, iterations, items=activity_count)
+    ids = [activity['id'] for activity, _ in activities[:200]]
+    results["storage.get_existing_activity_ids[200]"] = measure(lambda: storage.get_existing_activity_ids(athlete_id, ids), iterations * 5)
+    results[f"storage.rebuild_rollups[{activity_count}]"] = measure(lambda: storage.rebuild_rollups(athlete_id), iterations)
+    results[f"storage.rebuild_training_load[{activity_count}]"] = measure(lambda: storage.rebuild_training_load(athlete_id), iterations)
+    return results
+
+
+def bench_render(iterations: int, secrets: Dict, activity_count: int = 200) -> Dict[str, Dict]:
+    """Full page runs of streamlit_app.py through AppTest, first login (sync included) and reruns"""
+    from streamlit.testing.v1 import AppTest
+
+    adapter = install_fake_strava(FakeStravaAdapter(activity_count=activity_count))
+    install_fake_openai()
+    logins = itertools.count()
+
+    def new_app(code: str) -> AppTest:
+        app = AppTest.from_file("streamlit_app.py", default_timeout=120)
+        for key, value in secrets.items():
+            app.secrets[key] = value
+        app.query_params["code"] = code
+        return app
+
+    def first_login():
+        # A new athlete each time: token exchange, profile, full activity sync and first paint
+        app = new_app(f"bench-{5000 + next(logins)}").run()
+        if app.exception:
+            raise RuntimeError(app.exception[0].message)
+
+    results = {"render.first_login": measure(first_login, iterations, warmup=1)}
+
+    app = new_app("bench-4242").run()
+    if app.exception:
+        raise RuntimeError(app.exception[0].message)
+
+    def rerun():
+        if app.run().exception:
+            raise RuntimeError(app.exception[0].message)
+
+    results["render.rerun"] = measure(rerun, iterations * 2)
+    results["render.rerun"]['strava_requests_total'] = adapter.requests
+    return results
+
+
+def _probe_startup(target: str, secrets_path: str, trace_memory: bool = False) -> Dict:
+    completed = subprocess.run(
+        [sys.executable, "-c", _STARTUP_PROBE, target, secrets_path, "1" if trace_memory else "0"],
+        cwd=os.path.dirname(os.path.abspath(__file__)), capture_output=True, text=True
+    )
+    if completed.returncode != 0:
+        raise RuntimeError(f"Startup probe for {target} failed: {completed.stderr.strip()[-500:]}")
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def bench_startup(iterations: int, secrets_path: str) -> Dict[str, Dict]:
+    """
+    Cold import time of the app modules and first run of the logged-out landing page.
+
+    Every sample is a fresh interpreter with streamlit already imported, so only the cost of
+    our modules (and the libraries they load) is timed. heavy_modules lists the heavy
+    libraries each one pulled in.
+    """
+    results = {}
+    for target in STARTUP_MODULES + ["landing"]:
+        samples = [_probe_startup(target, secrets_path) for _ in range(iterations)]
+        latencies = np.array([sample['seconds'] for sample in samples])
+        name = "startup.landing_page" if target == "landing" else f"startup.import[{target}]"
+        results[name] = {
+            'iterations': iterations,
+            'throughput_per_s': round(iterations / latencies.sum(), 2),
+            'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 3),
+            'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 3),
+            'peak_kb': round(_probe_startup(target, secrets_path, trace_memory=True)['peak'] / 1024, 1),
+            'heavy_modules': [module for module in HEAVY_MODULES if module in samples[0]['loaded']]
+        }
+    return results
+
+
+def run_suites(suites: List[str], iterations: int) -> Dict:
+    directory = tempfile.mkdtemp(prefix="wildstride-bench-")
+    # Must happen before strava_api, storage or llm read st.secrets
+    secrets = use_offline_secrets(directory)
+
+    results = {}
+    for suite in suites:
+        print(f"Running {suite} benchmarks...", file=sys.stderr)
+        if suite == "parsing":
+            results.update(bench_parsing(iterations))
+        elif suite == "storage":
+            results.update(bench_storage(iterations, directory))
+        elif suite == "render":
+            results.update(bench_render(iterations, secrets))
+        elif suite == "startup":
+            results.update(bench_startup(iterations, os.path.join(directory, "secrets.toml")))
+    return {
+        'meta': {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'iterations': iterations,
+            'suites': suites
+        },
+        'results': results
+    }
+
+
+def print_results(results: Dict[str, Dict]) -> None:
+    print(f"{'benchmark':<58} {'ops/s':>12} {'p50 (ms)':>10} {'p99 (ms)':>10} {'peak (KB)':>10}")
+    for name, result in results.items():
+        heavy = f"  loads {', '.join(result['heavy_modules'])}" if result.get('heavy_modules') else ""
+        print(f"{name:<58} {result['throughput_per_s']:>12.1f} {result['p50_ms']:>10.3f} {result['p99_ms']:>10.3f} {result['peak_kb']:>10.1f}{heavy}")
+
+
+def compare(baseline: Dict, current: Dict, tolerance: float = DEFAULT_TOLERANCE) -> List[str]:
+    """
+    Compare two saved runs benchmark by benchmark.
+
+    Returns:
+        list: Names of benchmarks whose p50 or peak memory grew, or throughput dropped, by more than `tolerance`.
+    """
+    regressions = []
+    print(f"{'benchmark':<58} {'p50':>9} {'p99':>9} {'ops/s':>9} {'peak':>9}")
+    for name, new in current['results'].items():
+        old = baseline['results'].get(name)
+        if old is None:
+            print(f"{name:<58} {'new':>9}")
+            continue
+
+        def change(metric: str) -> float:
+            return (new[metric] - old[metric]) / old[metric] if old[metric] else 0.0
+
+        p50, p99, throughput, peak = change('p50_ms'), change('p99_ms'), change('throughput_per_s'), change('peak_kb')
+        regressed = p50 > tolerance or peak > tolerance or throughput < -tolerance
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<58} {p50:>+9.1%} {p99:>+9.1%} {throughput:>+9.1%} {peak:>+9.1%}{'  REGRESSION' if regressed else ''}")
+    for name in baseline['results'].keys() - current['results'].keys():
+        print(f"{name:<58} {'missing':>9}")
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WildStride offline benchmarks")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="run benchmark suites")
+    run.add_argument("--suite", nargs="+", choices=SUITES, default=SUITES)
+    run.add_argument("--iterations", type=int, default=20)
+    run.add_argument("--save", help="write the results to this JSON file (baseline for compare)")
+
+    compare_parser = commands.add_parser("compare", help="compare two saved runs")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        report = run_suites(args.suite, args.iterations)
+        print_results(report['results'])
+        if args.save:
+            with open(args.save, "w") as f:
+                json.dump(report, f, indent=2)
+            print(f"Saved to {args.save}")
+    elif args.command == "compare":
+        with open(args.baseline) as f:
+            baseline_report = json.load(f)
+        with open(args.current) as f:
+            current_report = json.load(f)
+        failed = compare(baseline_report, current_report, args.tolerance)
+        if failed:
+            print(f"{len(failed)} regression(s) above {args.tolerance:.0%}")
+            sys.exit(1)
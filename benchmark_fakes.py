@@ -0,0 +1,280 @@
+"""
+Local stand-ins for Strava, OpenAI and Supabase used by benchmark.py, so benchmarks run without network access.
+"""
+import json
+import os
+import random
+import re
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import BaseAdapter
+
+SPORT_TYPES = ["Run", "TrailRun", "Ride", "Swim", "Hike", "WeightTraining"]
+FAKE_ATHLETE_ID = 4242
+
+
+def synthetic_activity(activity_id: int, n_splits: int = 10, n_segments: int = 3, rng: random.Random = None) -> Dict:
+    """Build a payload shaped like Strava's detailed activity, with optional fields sometimes missing or null"""
+    rng = rng or random.Random(activity_id)
+    speed = rng.uniform(1.5, 6.0)
+    distance = rng.uniform(2000, 42000)
+    month, day, minute = rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 59)
+    activity = {
+        "id": activity_id,
+        "name": f"Activity {activity_id}",
+        "sport_type": rng.choice(SPORT_TYPES),
+        "start_date": f"2024-{month:02d}-{day:02d}T07:{minute:02d}:00Z",
+        "start_date_local": f"2024-{month:02d}-{day:02d}T08:{minute:02d}:00Z",
+        "description": rng.choice(["", "Easy run", "Intervals 6x800m"]),
+        "distance": round(distance, 1),
+        "moving_time": int(distance / speed),
+        "total_elevation_gain": rng.choice([0, round(rng.uniform(0, 1500), 1)]),
+        "average_speed": round(speed, 3),
+        "max_heartrate": rng.choice([None, float(rng.randint(150, 200))]),
+        "average_cadence": rng.choice([None, round(rng.uniform(70, 95), 1)]),
+        "average_watts": rng.choice([None, round(rng.uniform(150, 350), 1)]),
+        "suffer_score": rng.choice([None, rng.randint(5, 300)]),
+        "calories": round(rng.uniform(100, 3000), 1),
+        "device_name": rng.choice(["Garmin Forerunner 255", "COROS PACE 3"]),
+        "splits_metric": [
+            {
+                "split": i + 1,
+                "distance": round(rng.uniform(990, 1010), 1),
+                "moving_time": rng.randint(180, 480),
+                "elevation_difference": round(rng.uniform(-30, 30), 1),
+                "average_heartrate": round(rng.uniform(120, 185), 1),
+                "average_speed": rng.choice([0, round(rng.uniform(2.0, 5.5), 2)])
+            }
+            for i in range(n_splits)
+        ],
+        "segment_efforts": [
+            {
+                "name": f"Segment {i}",
+                "distance": round(rng.uniform(200, 5000), 1),
+                "average_heartrate": round(rng.uniform(120, 190), 1),
+                "average_watts": round(rng.uniform(100, 400), 1),
+                "average_speed": round(rng.uniform(2.0, 6.0), 3),
+                "segment": {"average_grade": round(rng.uniform(-5, 12), 1)}
+            }
+            for i in range(n_segments)
+        ]
+    }
+    if rng.random() < 0.5:
+        activity["average_heartrate"] = round(rng.uniform(110, 175), 1)
+    return activity
+
+
+def synthetic_activities(count: int, n_splits: int = 10, n_segments: int = 3, seed: int = 0) -> List[Dict]:
+    rng = random.Random(seed)
+    return [synthetic_activity(i, n_splits=n_splits, n_segments=n_segments, rng=rng) for i in range(count)]
+
+
+def synthetic_streams(activity: Dict, resolution: int = 1) -> Dict:
+    """Streams response (key_by_type=true) of an activity at one sample per `resolution` seconds"""
+    rng = random.Random(activity["id"])
+    samples = max(activity["moving_time"] // resolution, 2)
+    speed = activity["average_speed"]
+    data = {
+        "time": [i * resolution for i in range(samples)],
+        "distance": [round(i * resolution * speed, 1) for i in range(samples)],
+        "heartrate": [rng.randint(120, 180) for _ in range(samples)],
+        "altitude": [round(500 + rng.uniform(-5, 5), 1) for _ in range(samples)],
+        "velocity_smooth": [round(speed + rng.uniform(-0.5, 0.5), 2) for _ in range(samples)],
+        "cadence": [rng.randint(80, 92) for _ in range(samples)]
+    }
+    return {key: {"data": values, "series_type": "distance", "original_size": samples, "resolution": "high"}
+            for key, values in data.items()}
+
+
+def _epoch(iso_date: str) -> int:
+    return int(datetime.fromisoformat(iso_date.replace('Z', '+00:00')).timestamp())
+
+
+class FakeStravaAdapter(BaseAdapter):
+    """
+    Transport adapter answering Strava API and OAuth requests from synthetic data.
+
+    Mount it on the StravaClient session (see install_fake_strava). Each athlete owns
+    `activity_count` activities; responses carry rate-limit headers with a large quota so
+    the request scheduler never throttles a benchmark.
+    """
+
+    def __init__(self, activity_count: int = 200, n_splits: int = 10, n_segments: int = 3, latency: float = 0.0):
+        super().__init__()
+        self.activity_count = activity_count
+        self.n_splits = n_splits
+        self.n_segments = n_segments
+        self.latency = latency
+        self.requests = 0
+        self._activities: Dict[int, List[Dict]] = {}
+
+    def athlete_activities(self, athlete_id: int) -> List[Dict]:
+        """Detailed payloads of an athlete, oldest first"""
+        if athlete_id not in self._activities:
+            activities = synthetic_activities(self.activity_count, n_splits=self.n_splits, n_segments=self.n_segments, seed=athlete_id)
+            for activity in activities:
+                activity["id"] = athlete_id * 100000 + activity["id"]
+            self._activities[athlete_id] = sorted(activities, key=lambda activity: activity["start_date"])
+        return self._activities[athlete_id]
+
+    def _athlete_id(self, request) -> int:
+        # Access tokens are "token-<athlete_id>", see _token
+        token = request.headers.get("Authorization", "").rsplit("-", 1)[-1]
+        return int(token) if token.isdigit() else FAKE_ATHLETE_ID
+
+    def _token(self, athlete_id: int) -> Dict:
+        return {
+            "token_type": "Bearer",
+            "access_token": f"token-{athlete_id}",
+            "refresh_token": f"refresh-{athlete_id}",
+            "expires_at": int(time.time()) + 6 * 3600,
+            "athlete": {"id": athlete_id, "firstname": "Bench", "lastname": "Runner"}
+        }
+
+    def _route(self, request) -> tuple:
+        url = urlparse(request.url)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if request.body and request.method == "POST":
+            body = request.body.decode() if isinstance(request.body, bytes) else request.body
+            params.update({key: values[0] for key, values in parse_qs(body).items()})
+        path = url.path.removeprefix("/api/v3")
+
+        if path == "/oauth/token":
+            # Codes and refresh tokens end with the athlete ID, anything else logs in the default athlete
+            match = re.search(r"(\d+)$", params.get("code") or params.get("refresh_token") or "")
+            return 200, self._token(int(match.group(1)) if match else FAKE_ATHLETE_ID)
+
+        athlete_id = self._athlete_id(request)
+        if path == "/athlete":
+            return 200, {"id": athlete_id, "firstname": "Bench", "lastname": "Runner", "city": "Chamonix",
+                         "country": "France", "profile": None}
+        if re.fullmatch(r"/athletes/\d+/stats", path):
+            totals = {"count": self.activity_count, "distance": 1.0e6, "elevation_gain": 2.0e4}
+            return 200, {f"{scope}_{sport}_totals": totals for scope in ("all", "ytd") for sport in ("run", "ride")}
+        if path == "/athlete/activities":
+            page, per_page = int(params.get("page", 1)), int(params.get("per_page", 30))
+            # Like Strava: oldest first with `after`, newest first otherwise
+            activities = self.athlete_activities(athlete_id)
+            if "after" in params:
+                activities = [activity for activity in activities if _epoch(activity["start_date"]) > int(params["after"])]
+            else:
+                before = int(params.get("before", 2 ** 62))
+                activities = [activity for activity in reversed(activities) if _epoch(activity["start_date"]) < before]
+            summaries = [{key: value for key, value in activity.items() if key not in ("splits_metric", "segment_efforts")}
+                         for activity in activities[(page - 1) * per_page:page * per_page]]
+            return 200, summaries
+
+        match = re.fullmatch(r"/activities/(\d+)(/streams)?", path)
+        if match:
+            activity_id = int(match.group(1))
+            owner = self.athlete_activities(activity_id // 100000)
+            activity = next((activity for activity in owner if activity["id"] == activity_id), None)
+            if activity is None:
+                return 404, {"message": "Record Not Found"}
+            if match.group(2):
+                return 200, synthetic_streams(activity)
+            if request.method == "PUT":
+                return 200, dict(activity, **params)
+            return 200, activity
+        if re.fullmatch(r"/activities/\d+/comments", path):
+            return 201, {"text": params.get("text")}
+        return 404, {"message": f"Unknown path {path}"}
+
+    def send(self, request, **kwargs) -> requests.Response:
+        if self.latency:
+            time.sleep(self.latency)
+        self.requests += 1
+        status, body = self._route(request)
+        response = requests.Response()
+        response.status_code = status
+        response._content = json.dumps(body).encode()
+        response.headers["Content-Type"] = "application/json"
+        response.headers["X-RateLimit-Limit"] = "1000000,10000000"
+        response.headers["X-RateLimit-Usage"] = "0,0"
+        response.headers["X-ReadRateLimit-Limit"] = "1000000,10000000"
+        response.headers["X-ReadRateLimit-Usage"] = "0,0"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self) -> None:
+        pass
+
+
+class FakeOpenAI:
+    """Stand-in for the OpenAI client streaming a fixed coaching answer through responses.create"""
+
+    def __init__(self, words: int = 200, delay_per_token: float = 0.0):
+        self.words = words
+        self.delay_per_token = delay_per_token
+        self.calls = 0
+        self.responses = SimpleNamespace(create=self._create)
+
+    def _create(self, model: str, instructions: str, input: str, stream: bool = False, **kwargs):
+        self.calls += 1
+        text = " ".join(f"word{i}" for i in range(self.words))
+        usage = SimpleNamespace(input_tokens=(len(instructions) + len(input)) // 4, output_tokens=self.words)
+        if not stream:
+            return SimpleNamespace(output_text=text, usage=usage)
+        return self._stream(text, usage)
+
+    def _stream(self, text: str, usage):
+        for word in text.split(" "):
+            if self.delay_per_token:
+                time.sleep(self.delay_per_token)
+            yield SimpleNamespace(type="response.output_text.delta", delta=word + " ")
+        yield SimpleNamespace(type="response.completed", response=SimpleNamespace(usage=usage))
+
+
+def offline_secrets(directory: str) -> Dict:
+    """Secrets selecting the local SQLite storage backend and caches inside `directory`"""
+    return {
+        "strava_client_id": "0",
+        "strava_client_secret": "offline",
+        "supabase_url": "http://localhost",
+        "supabase_key": "offline",
+        "openai_api_key": "offline",
+        "storage_backend": "sqlite",
+        "sqlite_path": os.path.join(directory, "wildstride.sqlite3"),
+        "llm_cache_path": os.path.join(directory, "llm_responses.sqlite3")
+    }
+
+
+def use_offline_secrets(directory: str) -> Dict:
+    """
+    Point st.secrets at a generated secrets.toml, before any app module reads it.
+
+    Returns:
+        dict: The secrets written, also to be given to AppTest.secrets.
+    """
+    from streamlit import config
+
+    secrets = offline_secrets(directory)
+    path = os.path.join(directory, "secrets.toml")
+    with open(path, "w") as f:
+        for key, value in secrets.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+    config.set_option("secrets.files", [path])
+    return secrets
+
+
+def install_fake_strava(adapter: Optional[FakeStravaAdapter] = None) -> FakeStravaAdapter:
+    """Route every Strava request of the shared StravaClient to a FakeStravaAdapter"""
+    from strava_client import get_client
+
+    adapter = adapter or FakeStravaAdapter()
+    get_client().session.mount("https://www.strava.com/", adapter)
+    return adapter
+
+
+def install_fake_openai(fake: Optional[FakeOpenAI] = None) -> FakeOpenAI:
+    """Replace the OpenAI client used by llm with a FakeOpenAI"""
+    import llm
+
+    fake = fake or FakeOpenAI()
+    llm.client = fake
+    return fake
@@ -0,0 +1,172 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+from activities_parsing import extract_activity_summary, format_activity_for_prompt, update_activity_by_id
+from llm import generate_content_stream
+from storage import get_storage
+from strava_api import fetch_activity_details, fetch_activity_streams, get_valid_token, remove_character
+from strava_client import StravaRateLimitError
+from tracing import finish_trace, trace_context
+
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+# States for which a new request on the same activity reuses the existing job
+ACTIVE_OR_DONE = {JOB_QUEUED, JOB_RUNNING, JOB_DONE}
+FINISHED = {JOB_DONE, JOB_FAILED}
+# Seconds a finished job stays in memory (its card has rerun by then), the persisted row remains
+FINISHED_JOB_TTL = 600
+# Seconds after which a queued or running job persisted by another process is considered abandoned
+STALE_JOB_AFTER = 900
+
+# Seconds between two reads of a running job by the app: the first tokens arrive in well under a
+# second (see llm.generate_content_stream), a longer interval would hold them back
+JOB_POLL_INTERVAL = 0.2
+# Maximum number of coaching analyses running at once in this process
+MAX_ANALYSIS_WORKERS = 4
+
+STRAVA_SIGNATURE = " \n\n\n 💪Powered by WildStride💪"
+
+
+class JobQueue:
+    """
+    Bounded worker pool running coaching analyses outside the Streamlit script run.
+
+    Jobs are idempotent per (athlete_id, activity_id): enqueueing an activity that is queued,
+    running or already done returns the existing job. The coaching_jobs row is claimed in one
+    statement before a job runs, so this also holds across restarts and app processes. State
+    changes are persisted there; the text generated so far is kept in memory for progressive
+    display, and finished jobs are dropped from memory after finished_ttl seconds.
+    """
+
+    def __init__(self, storage=None, max_workers: int = MAX_ANALYSIS_WORKERS, finished_ttl: float = FINISHED_JOB_TTL):
+        self.storage = storage or get_storage()
+        self.finished_ttl = finished_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='coaching')
+        self._jobs: Dict[tuple, Dict] = {}
+        self._lock = threading.Lock()
+
+    def _update(self, job: Dict, persist: bool = True, **changes) -> None:
+        with self._lock:
+            job.update(changes)
+            job['updated_at'] = datetime.now().isoformat()
+            if job['status'] in FINISHED:
+                job['finished_at'] = time.monotonic()
+        if persist:
+            self.storage.save_coaching_job(job)
+
+    def _evict_finished(self) -> None:
+        """Drop the jobs finished more than finished_ttl seconds ago (call with the lock held)"""
+        expired_before = time.monotonic() - self.finished_ttl
+        expired = [key for key, job in self._jobs.items() if 'finished_at' in job and job['finished_at'] <= expired_before]
+        for key in expired:
+            del self._jobs[key]
+
+    def enqueue_analysis(self, athlete_id: str, activity_id: str, preferences: Dict) -> Dict:
+        """Queue a coaching analysis and return its job state immediately"""
+        key = (athlete_id, str(activity_id))
+        with self._lock:
+            self._evict_finished()
+            job = self._jobs.get(key)
+            if job and job['status'] in ACTIVE_OR_DONE:
+                return dict(job)
+
+        claimed = self.storage.claim_coaching_job(athlete_id, str(activity_id), stale_after=STALE_JOB_AFTER)
+        if claimed is None:
+            # Queued, running or done in another process (or before a restart): neither run nor charged twice
+            return self.storage.get_coaching_job(athlete_id, str(activity_id))
+
+        job = {
+            'athlete_id': athlete_id,
+            'activity_id': str(activity_id),
+            'status': JOB_QUEUED,
+            'partial_text': '',
+            'result': None,
+            'error': None,
+            'created_at': claimed['created_at'],
+            'updated_at': claimed['updated_at']
+        }
+        with self._lock:
+            self._jobs[key] = job
+        self._executor.submit(self._run_analysis, job, preferences)
+        return dict(job)
+
+    def get_status(self, athlete_id: str, activity_id: str, include_persisted: bool = True) -> Optional[Dict]:
+        """Current state of the job for an activity, from memory or (unless include_persisted is False) from the persisted row"""
+        with self._lock:
+            job = self._jobs.get((athlete_id, str(activity_id)))
+            if job:
+                return dict(job)
+        return self.storage.get_coaching_job(athlete_id, str(activity_id)) if include_persisted else None
+
+    def list_jobs(self, athlete_id: str) -> List[Dict]:
+        """Jobs of an athlete known to this process"""
+        with self._lock:
+            return [dict(job) for (job_athlete_id, _), job in self._jobs.items() if job_athlete_id == athlete_id]
+
+    def _stream_section(self, athlete_id: str, activity_id: str, access_token: str) -> str:
+        """Prompt section derived from the activity streams, empty if they cannot be loaded"""
+        # numpy comes with activity_streams, only load it in the worker that needs it
+        from activity_streams import describe_streams, load_activity_streams
+
+        try:
+            streams = load_activity_streams(
+                self.storage, athlete_id, activity_id,
+                fetch=lambda: fetch_activity_streams(access_token, activity_id)
+            )
+        except StravaRateLimitError as e:
+            # The analysis still runs on the summary fields
+            print(f"Skipping streams for activity {activity_id}: {e}")
+            return ""
+        return describe_streams(streams) if streams is not None else ""
+
+    def _run_analysis(self, job: Dict, preferences: Dict) -> None:
+        # Worker threads do not inherit the render's context, each job is traced on its own
+        with trace_context(athlete_id=job['athlete_id']):
+            try:
+                self._analyze(job, preferences)
+            finally:
+                finish_trace('jobs', 'analysis')
+
+    def _analyze(self, job: Dict, preferences: Dict) -> None:
+        athlete_id, activity_id = job['athlete_id'], job['activity_id']
+        try:
+            self._update(job, status=JOB_RUNNING)
+            access_token, _ = get_valid_token(athlete_id)
+            if not access_token:
+                raise ValueError("No valid Strava token for this athlete")
+
+            activity_detail = fetch_activity_details(access_token, activity_id)
+            str_summary = format_activity_for_prompt(extract_activity_summary(activity_detail))
+            stream_section = self._stream_section(athlete_id, activity_id, access_token)
+            if stream_section:
+                str_summary += "\n\n" + stream_section
+
+            for chunk in generate_content_stream(input_text=str_summary, athlete_id=athlete_id, prompt=str(preferences), activity_id=activity_id):
+                # Only the final state is persisted, the partial text is polled from memory
+                self._update(job, persist=False, partial_text=job['partial_text'] + chunk)
+
+            coach_feedback = remove_character(job['partial_text'], '###')
+            coach_feedback = remove_character(coach_feedback, '**')
+            update_activity_by_id(access_token=access_token, activity_id=activity_id, description=coach_feedback + STRAVA_SIGNATURE)
+            self._update(job, status=JOB_DONE, result=job['partial_text'])
+        except Exception as e:
+            print(f"Coaching job failed for activity {activity_id}: {e}")
+            self._update(job, status=JOB_FAILED, error=str(e))
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """Return the process-wide job queue, so the worker cap applies across all sessions"""
+    global _job_queue
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                _job_queue = JobQueue()
+    return _job_queue
@@ -1,10 +1,42 @@
-from storage import Storage
-from openai import OpenAI
+import threading
+import time
+from typing import Iterator
+from storage import get_storage
 import streamlit as st
-from activities_parsing import extract_activity_summary, format_activity_for_prompt
-# Initialize the OpenAI client
-openai_api_key = st.secrets["openai_api_key"]
-client = OpenAI(api_key=openai_api_key)  # or use environment variable
+from prompt_context import build_history_context, estimate_tokens, DEFAULT_HISTORY_TOKEN_BUDGET
+from training_load import format_form_for_prompt
+from tracing import span, tracer
+from llm_cache import ResponseCache, response_cache_key, DEFAULT_CACHE_PATH, DEFAULT_MAX_ENTRIES, DEFAULT_TTL
+
+# OpenAI client and response cache, built on first use (importing openai alone takes ~0.5 s)
+client = None
+response_cache = None
+_init_lock = threading.Lock()
+
+
+def get_openai_client():
+    """Return the process-wide OpenAI client"""
+    global client
+    if client is None:
+        with _init_lock:
+            if client is None:
+                from openai import OpenAI
+                client = OpenAI(api_key=st.secrets["openai_api_key"])
+    return client
+
+
+def get_response_cache() -> ResponseCache:
+    """Return the process-wide response cache: identical prompts (retried clicks, reruns, unchanged re-analysis) are answered from it"""
+    global response_cache
+    if response_cache is None:
+        with _init_lock:
+            if response_cache is None:
+                response_cache = ResponseCache(
+                    st.secrets.get("llm_cache_path", DEFAULT_CACHE_PATH),
+                    max_entries=int(st.secrets.get("llm_cache_max_entries", DEFAULT_MAX_ENTRIES)),
+                    ttl=float(st.secrets.get("llm_cache_ttl", DEFAULT_TTL))
+                )
+    return response_cache
 
 instructions_coaching = '''
                         You are an elite trail running coach and sport scientist.
@@ -28,25 +60,57 @@ instructions_coaching = '''
                         Use a **supportive and coaching tone**. Be specific and actionable.
                     '''
 
-def generate_content(input_text: str, athlete_id: str, prompt:str, activity_id:str,model="gpt-4o", temperature=1.0) -> str:
-    # Deduct one credit from the user's account
-    storage = Storage()
-    user_data = storage.get_user_data(athlete_id)
-    athletes_info = user_data.get('athletes_info', {})
-    credits = athletes_info.get('credits', 0)
-    used_credits = athletes_info.get('used_credits', 0)
+def generate_content(input_text: str, athlete_id: str, prompt:str, activity_id:str,model="gpt-4o", temperature=1.0,
+                     charge_on_cache_hit: bool = None, history_token_budget: int = None) -> str:
+    """Generate coaching feedback for an activity and store it, returning the full text"""
+    return "".join(generate_content_stream(
+        input_text=input_text,
+        athlete_id=athlete_id,
+        prompt=prompt,
+        activity_id=activity_id,
+        model=model,
+        temperature=temperature,
+        charge_on_cache_hit=charge_on_cache_hit,
+        history_token_budget=history_token_budget
+    ))
+
+def generate_content_stream(input_text: str, athlete_id: str, prompt:str, activity_id:str,model="gpt-4o", temperature=1.0,
+                            charge_on_cache_hit: bool = None, history_token_budget: int = None) -> Iterator[str]:
+    """
+    Generate coaching feedback for an activity, yielding text fragments as the model produces them.
+
+    The full text is cached and stored with update_activity_coach once the stream completes;
+    a stream abandoned midway (e.g. by a rerun) stores nothing.
+
+    Args:
+        charge_on_cache_hit (bool, optional): Whether a response served from the cache consumes a
+            credit, defaults to the llm_cache_charges_credit secret (False). Either way the athlete
+            needs at least one credit left.
+        history_token_budget (int, optional): Token budget for past activities, defaults to the
+            history_token_budget secret.
+    """
+    if charge_on_cache_hit is None:
+        charge_on_cache_hit = bool(st.secrets.get("llm_cache_charges_credit", False))
+    if history_token_budget is None:
+        history_token_budget = int(st.secrets.get("history_token_budget", DEFAULT_HISTORY_TOKEN_BUDGET))
+    storage = get_storage()
     last_activities = storage.get_user_activities(athlete_id)
 
-    full_past_act = ""
-    for activity in last_activities[:10]:
-        summary = extract_activity_summary(activity)
-        str_summary = format_activity_for_prompt(summary)
-        full_past_act += str_summary + "\n\n"
-    print(full_past_act)
+    # Compressed past activities (stored summaries) instead of raw rows with previous feedback
+    past_activities, history_tokens = build_history_context(
+        last_activities,
+        token_budget=history_token_budget,
+        exclude_activity_id=activity_id
+    )
+    # Precomputed on ingest, the model no longer has to infer fatigue from raw rows
+    training_form = format_form_for_prompt(storage.get_training_load(athlete_id))
     user_goal = f'''
+                ###USER TRAINING LOAD###
+                {training_form or 'Not available'}
+
                 ###USER PREVIOUS ACTIVITIES###
                 Based on the previous activities, provide the user pertinents informations about his progression
-                {last_activities}
+                {past_activities}
 
                 ###USER GOAL: find bellow the objective of the user
                 Distance is in kilometers and elevation is in meters
@@ -55,21 +119,59 @@ def generate_content(input_text: str, athlete_id: str, prompt:str, activity_id:s
                 '''
     user_goal = user_goal + instructions_coaching
 
-    if user_data and credits > 0:
-        storage.update_user_credits(athlete_id=athlete_id, credits=credits - 1, used_credits=used_credits +1)
-    else:
+    prompt_tokens = estimate_tokens(user_goal) + estimate_tokens(input_text)
+    print(f"Prompt size for activity {activity_id}: ~{prompt_tokens} tokens (history: ~{history_tokens})")
+
+    cache_key = response_cache_key(model, temperature, user_goal, input_text)
+    output_text = get_response_cache().get(cache_key)
+
+    # Deduct one credit from the user's account, atomically so concurrent clicks cannot double-spend
+    charged = output_text is None or charge_on_cache_hit
+    if charged and storage.reserve_credit(athlete_id) is None:
         raise ValueError("Insufficient credits to generate content.")
-    print(user_goal)
-    response = client.responses.create(
-        model=model,
-        temperature=temperature,
-        instructions=user_goal,
-        input=input_text
-    )
+    # A free cache hit is still reserved to athletes with credits left
+    if not charged and not storage.has_credits(athlete_id):
+        raise ValueError("Insufficient credits to generate content.")
+
+    if output_text is not None:
+        print("Coaching served from the response cache")
+        storage.update_activity_coach(athlete_id=athlete_id, activity_id=activity_id, coach_feedback=output_text)
+        yield output_text
+        return
 
-    storage.update_activity_coach(athlete_id=athlete_id, activity_id=activity_id, coach_feedback=response.output_text)
-    print(len(response.output_text))
-    return response.output_text
+    print(user_goal)
+    chunks = []
+    try:
+        # The span covers the whole stream; time to first token is recorded separately as it drives perceived latency
+        with span('openai', 'responses.create', model=model) as tags:
+            started_at = time.perf_counter()
+            stream = get_openai_client().responses.create(
+                model=model,
+                temperature=temperature,
+                instructions=user_goal,
+                input=input_text,
+                stream=True
+            )
+            for event in stream:
+                if event.type == "response.output_text.delta":
+                    if not chunks:
+                        tracer.record('openai', 'responses.first_token', time.perf_counter() - started_at, model=model)
+                    chunks.append(event.delta)
+                    yield event.delta
+                elif event.type == "response.completed" and getattr(event.response, 'usage', None):
+                    tags['input_tokens'] = event.response.usage.input_tokens
+                    tags['output_tokens'] = event.response.usage.output_tokens
+                    print(f"Prompt size for activity {activity_id}: {event.response.usage.input_tokens} tokens billed")
+    except Exception:
+        # The analysis failed, give the credit back (a stream abandoned by a rerun is not an error and stays charged)
+        if charged:
+            storage.refund_credit(athlete_id)
+        raise
+
+    output_text = "".join(chunks)
+    get_response_cache().put(cache_key, output_text, model=model)
+    storage.update_activity_coach(athlete_id=athlete_id, activity_id=activity_id, coach_feedback=output_text)
+    print(len(output_text))
 
 
 
@@ -0,0 +1,97 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+DEFAULT_CACHE_PATH = os.path.join(".cache", "llm_responses.sqlite3")
+DEFAULT_MAX_ENTRIES = 500
+# Seconds a response is served from the cache, so model and prompt updates eventually reach every athlete
+DEFAULT_TTL = 30 * 24 * 3600
+
+
+def response_cache_key(model: str, temperature: float, instructions: str, input_text: str) -> str:
+    """Hash everything that determines the model output into a cache key"""
+    payload = json.dumps(
+        {'model': model, 'temperature': temperature, 'instructions': instructions, 'input': input_text},
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """
+    Persistent, content-addressed cache of LLM responses stored in a local SQLite file.
+
+    Entries are keyed by response_cache_key, expire ttl seconds after they were stored and are
+    evicted least-recently-used first once the cache holds more than max_entries responses.
+    """
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_entries: int = DEFAULT_MAX_ENTRIES, ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                output_text TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used_at)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response text, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT output_text, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and row[1] <= now - self.ttl:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_used_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, output_text: str, model: str = None) -> None:
+        """Store a response and evict the least recently used ones beyond max_entries"""
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, output_text, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                (key, model, output_text, now, now)
+            )
+            self._conn.execute(
+                """
+                DELETE FROM responses WHERE key IN (
+                    SELECT key FROM responses ORDER BY last_used_at DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+        return {'hits': self.hits, 'misses': self.misses, 'size': size}
@@ -0,0 +1,56 @@
+-- Tables added next to the ones managed in the Supabase dashboard (athletes, user_preferences,
+-- athlete_stats, activities, strava_tokens). They mirror sqlite_backend.SCHEMA and must exist
+-- before the functions of the following migrations are created.
+
+-- Activity sync high-water mark, the start time (epoch seconds) of the latest ingested activity
+create table if not exists activity_sync (
+    athlete_id text primary key,
+    last_start_date bigint not null,
+    updated_at timestamp
+);
+
+-- Coaching analyses run by jobs.JobQueue, one row per athlete and activity
+create table if not exists coaching_jobs (
+    athlete_id text not null,
+    activity_id text not null,
+    status text not null,
+    error text,
+    created_at timestamp,
+    updated_at timestamp,
+    primary key (athlete_id, activity_id)
+);
+
+-- Compressed sample streams of an activity (activity_streams.encode_streams), stored as base64
+-- text until 0006 converts the column to bytea
+create table if not exists activity_streams (
+    athlete_id text not null,
+    activity_id text not null,
+    stream_types jsonb,
+    sample_count integer,
+    data text,
+    updated_at timestamp,
+    primary key (athlete_id, activity_id)
+);
+
+-- Fitness (CTL) and fatigue (ATL) of an athlete as of last_day, see training_load
+create table if not exists training_load (
+    athlete_id text primary key,
+    ctl double precision not null default 0,
+    atl double precision not null default 0,
+    last_day date,
+    updated_at timestamp
+);
+
+-- Weekly and monthly totals per sport, see activity_rollups
+create table if not exists activity_rollups (
+    athlete_id text not null,
+    period text not null,
+    period_start date not null,
+    sport_type text not null,
+    count integer not null default 0,
+    distance double precision not null default 0,
+    moving_time double precision not null default 0,
+    elevation_gain double precision not null default 0,
+    updated_at timestamp,
+    primary key (athlete_id, period, period_start, sport_type)
+);
@@ -0,0 +1,25 @@
+-- Fold a batch of activity loads into an athlete's training_load row in one statement.
+-- Storage computes the parameters with training_load.load_delta; concurrent writers (the app,
+-- the webhook receiver) each apply their own increment, so no update is lost. Increments commute
+-- (the state is linear in the loads), which is why a value going below zero on the way is not
+-- clamped: another writer's increment may still be on its way (see training_load.current_form).
+-- Returns the updated row, or no row when the athlete has no training load yet.
+create or replace function apply_training_load(
+    p_athlete_id text,
+    p_day date,
+    p_ctl double precision,
+    p_atl double precision,
+    p_ctl_decay double precision,
+    p_atl_decay double precision
+) returns setof training_load
+language sql as $$
+    update training_load
+    set ctl = ctl * power(p_ctl_decay, greatest(p_day - coalesce(last_day, p_day), 0))
+              + p_ctl * power(p_ctl_decay, greatest(coalesce(last_day, p_day) - p_day, 0)),
+        atl = atl * power(p_atl_decay, greatest(p_day - coalesce(last_day, p_day), 0))
+              + p_atl * power(p_atl_decay, greatest(coalesce(last_day, p_day) - p_day, 0)),
+        last_day = greatest(coalesce(last_day, p_day), p_day),
+        updated_at = now()
+    where athlete_id = p_athlete_id
+    returning *;
+$$;
@@ -0,0 +1,23 @@
+-- Add per (period, period_start, sport_type) deltas to an athlete's activity_rollups in one call.
+-- p_deltas is a JSON array of {period, period_start, sport_type, count, distance, moving_time,
+-- elevation_gain} built by activity_rollups.deltas_to_rows; rows are incremented in place by the
+-- upsert, so concurrent writers cannot lose each other's changes. Rollups left without activities
+-- keep a zero count instead of being deleted: a delete is not commutative with the increments of
+-- other writers (a replacement applied before the insert it undoes would resurrect the row), so
+-- readers skip rows with count <= 0 and rebuild_rollups clears them.
+create or replace function apply_rollup_deltas(p_athlete_id text, p_deltas jsonb) returns void
+language sql as $$
+    insert into activity_rollups (athlete_id, period, period_start, sport_type, count, distance, moving_time,
+                                  elevation_gain, updated_at)
+    select p_athlete_id, d.period, d.period_start, d.sport_type, d.count, d.distance, d.moving_time,
+           d.elevation_gain, now()
+    from jsonb_to_recordset(p_deltas) as d(period text, period_start date, sport_type text, count integer,
+                                          distance double precision, moving_time double precision,
+                                          elevation_gain double precision)
+    on conflict (athlete_id, period, period_start, sport_type) do update
+    set count = activity_rollups.count + excluded.count,
+        distance = activity_rollups.distance + excluded.distance,
+        moving_time = activity_rollups.moving_time + excluded.moving_time,
+        elevation_gain = activity_rollups.elevation_gain + excluded.elevation_gain,
+        updated_at = excluded.updated_at;
+$$;
@@ -0,0 +1,20 @@
+-- Claim the coaching job of an activity before running it, in one statement.
+-- A new row is created queued; an existing one is taken over only if its analysis failed or if it
+-- was left queued/running since p_stale_before (its process died). Queued, running and done jobs
+-- are not claimed again, so a restart or a second app process neither re-runs nor re-charges them.
+-- Returns the claimed row, or no row when the job belongs to someone else.
+create or replace function claim_coaching_job(
+    p_athlete_id text,
+    p_activity_id text,
+    p_now timestamp,
+    p_stale_before timestamp
+) returns setof coaching_jobs
+language sql as $$
+    insert into coaching_jobs (athlete_id, activity_id, status, error, created_at, updated_at)
+    values (p_athlete_id, p_activity_id, 'queued', null, p_now, p_now)
+    on conflict (athlete_id, activity_id) do update
+    set status = 'queued', error = null, created_at = excluded.created_at, updated_at = excluded.updated_at
+    where coaching_jobs.status = 'failed'
+       or (coaching_jobs.status in ('queued', 'running') and coaching_jobs.updated_at < p_stale_before)
+    returning *;
+$$;
@@ -0,0 +1,18 @@
+-- Take and give back the one credit a coaching analysis costs (Storage.reserve_credit/refund_credit).
+-- Each is a single conditional UPDATE, so concurrent calls cannot double-spend or lose an update.
+-- reserve_credit returns no row when the athlete has no credit left, nothing is changed then.
+create or replace function reserve_credit(p_athlete_id text) returns setof athletes
+language sql as $$
+    update athletes
+    set credits = credits - 1, used_credits = coalesce(used_credits, 0) + 1
+    where athlete_id = p_athlete_id and credits > 0
+    returning *;
+$$;
+
+create or replace function refund_credit(p_athlete_id text) returns setof athletes
+language sql as $$
+    update athletes
+    set credits = coalesce(credits, 0) + 1, used_credits = greatest(coalesce(used_credits, 0) - 1, 0)
+    where athlete_id = p_athlete_id
+    returning *;
+$$;
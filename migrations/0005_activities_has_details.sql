@@ -0,0 +1,6 @@
+-- Mark the activities stored from a detailed payload (splits, segment efforts), activity_sync
+-- fetches the details of the most recent activities that still lack them.
+alter table activities add column if not exists has_details boolean not null default false;
+
+-- Rows stored before this column: a summary built from a detailed payload lists its splits
+update activities set has_details = true where summary like '%**Splits:**%' or summary like '%**Segment Efforts:**%';
@@ -0,0 +1,3 @@
+-- Store the npz stream blobs (activity_streams.encode_streams) as raw bytes instead of base64 text,
+-- a third smaller. PostgREST exchanges bytea as \x-prefixed hex, Storage converts it.
+alter table activity_streams alter column data type bytea using decode(data, 'base64');
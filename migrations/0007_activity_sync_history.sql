@@ -0,0 +1,4 @@
+-- A first sync ingests the newest activities first, then walks the older history backwards in
+-- the background: history_before is the start time (epoch seconds) of the oldest activity
+-- ingested so far, null once the backfill reached the athlete's first activity.
+alter table activity_sync add column if not exists history_before bigint;
@@ -0,0 +1,36 @@
+-- Upsert a batch of activity rows (Storage._activity_row) and return the stored rows they replaced.
+-- Storage derives the training load and rollup increments from the returned rows, so the previous
+-- version has to be read atomically with the write: the per-athlete advisory lock serializes the
+-- ingests of an athlete (the app sync, the webhook), and the select below runs with a snapshot taken
+-- after it, so the second of two concurrent ingests of an activity sees the row of the first one.
+-- Each caller then increments the aggregates by its own change only.
+create or replace function upsert_activities(p_athlete_id text, p_rows jsonb) returns setof activities
+language sql as $$
+    select pg_advisory_xact_lock(hashtext('activities:' || p_athlete_id));
+
+    with incoming as (
+        select * from jsonb_populate_recordset(null::activities, p_rows)
+    ), replaced as (
+        select activities.* from activities
+        where activities.athlete_id = p_athlete_id
+          and activities.activity_id in (select activity_id from incoming)
+    ), written as (
+        insert into activities (athlete_id, activity_id, name, start_date_local, sport_type, distance, moving_time,
+                                total_elevation_gain, average_speed, average_cadence, average_watts, average_heartrate,
+                                max_heartrate, suffer_score, has_details, updated_at, summary)
+        select p_athlete_id, activity_id, name, start_date_local, sport_type, distance, moving_time,
+               total_elevation_gain, average_speed, average_cadence, average_watts, average_heartrate,
+               max_heartrate, suffer_score, has_details, updated_at, summary
+        from incoming
+        on conflict (athlete_id, activity_id) do update
+        set name = excluded.name, start_date_local = excluded.start_date_local, sport_type = excluded.sport_type,
+            distance = excluded.distance, moving_time = excluded.moving_time,
+            total_elevation_gain = excluded.total_elevation_gain, average_speed = excluded.average_speed,
+            average_cadence = excluded.average_cadence, average_watts = excluded.average_watts,
+            average_heartrate = excluded.average_heartrate, max_heartrate = excluded.max_heartrate,
+            suffer_score = excluded.suffer_score, has_details = excluded.has_details,
+            updated_at = excluded.updated_at, summary = excluded.summary
+        returning activity_id
+    )
+    select * from replaced;
+$$;
@@ -0,0 +1,22 @@
+-- Read and write the npz stream blobs (activity_streams.encode_streams) as base64 text, converted to
+-- and from the bytea column by the database. PostgREST exchanges bytea columns as \x-prefixed hex,
+-- which doubles the payload; base64 adds a third.
+create or replace function save_activity_streams(p_athlete_id text, p_activity_id text, p_stream_types jsonb,
+                                                 p_sample_count integer, p_data text) returns void
+language sql as $$
+    insert into activity_streams (athlete_id, activity_id, stream_types, sample_count, data, updated_at)
+    values (p_athlete_id, p_activity_id, p_stream_types, p_sample_count, decode(p_data, 'base64'), now())
+    on conflict (athlete_id, activity_id) do update
+    set stream_types = excluded.stream_types,
+        sample_count = excluded.sample_count,
+        data = excluded.data,
+        updated_at = excluded.updated_at;
+$$;
+
+create or replace function get_activity_streams(p_athlete_id text, p_activity_id text)
+returns table (stream_types jsonb, sample_count integer, data text)
+language sql stable as $$
+    select s.stream_types, s.sample_count, encode(s.data, 'base64')
+    from activity_streams s
+    where s.athlete_id = p_athlete_id and s.activity_id = p_activity_id;
+$$;
@@ -0,0 +1,84 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+# Average characters per token for the markdown/emoji text we send (GPT-4o tokenizer)
+CHARS_PER_TOKEN = 4
+DEFAULT_HISTORY_TOKEN_BUDGET = 1200
+HISTORY_MAX_ACTIVITIES = 10
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate the number of tokens in a prompt fragment"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN) if text else 0
+
+
+def compact_summary(summary: str) -> str:
+    """Strip markdown emphasis and blank lines from a stored activity summary"""
+    lines = [line.replace("**", "").strip() for line in summary.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def activity_digest(activity: Dict) -> str:
+    """One-line digest of a stored activity row, used when its full summary does not fit"""
+    parts = [
+        (activity.get('start_date_local') or '')[:10],
+        activity.get('sport_type') or 'Unknown',
+        f"{(activity.get('distance') or 0) / 1000:.1f} km",
+        f"{(activity.get('moving_time') or 0) / 60:.0f} min",
+        f"{activity.get('total_elevation_gain') or 0:.0f} m D+"
+    ]
+    speed = activity.get('average_speed')
+    if speed:
+        pace = int(1000 / speed)
+        parts.append(f"{pace // 60}:{pace % 60:02d} min/km")
+    if activity.get('average_heartrate'):
+        parts.append(f"HR {activity['average_heartrate']:.0f}")
+    if activity.get('suffer_score') is not None:
+        parts.append(f"suffer {activity['suffer_score']}")
+    return " | ".join(parts)
+
+
+def build_history_context(activities: List[Dict], token_budget: int = DEFAULT_HISTORY_TOKEN_BUDGET,
+                          max_activities: int = HISTORY_MAX_ACTIVITIES,
+                          exclude_activity_id: Optional[str] = None) -> Tuple[str, int]:
+    """
+    Select and compress past activities so they fit in a token budget.
+
+    Activities are taken newest first. Each one uses its stored `summary` when that still
+    leaves room for one-line digests of the remaining activities, otherwise its own digest;
+    selection stops once not even a digest fits.
+
+    Args:
+        activities (list): Stored activity rows, newest first.
+        token_budget (int): Maximum estimated tokens for the history block.
+        max_activities (int): Maximum number of past activities to include.
+        exclude_activity_id (str, optional): The activity being analysed, already sent as input.
+
+    Returns:
+        tuple: The history text and its estimated token count.
+    """
+    selected = [
+        activity for activity in activities
+        if exclude_activity_id is None or str(activity.get('activity_id')) != str(exclude_activity_id)
+    ][:max_activities]
+    digests = [activity_digest(activity) for activity in selected]
+    # +1 for the separator between blocks
+    digest_tokens = [estimate_tokens(digest) + 1 for digest in digests]
+    remaining_digest_tokens = sum(digest_tokens)
+
+    blocks = []
+    used_tokens = 0
+    for activity, digest, tokens in zip(selected, digests, digest_tokens):
+        remaining_digest_tokens -= tokens
+        summary = compact_summary(activity['summary']) if activity.get('summary') else None
+        summary_tokens = estimate_tokens(summary) + 1 if summary else None
+        if summary and used_tokens + summary_tokens + remaining_digest_tokens <= token_budget:
+            blocks.append(summary)
+            used_tokens += summary_tokens
+        elif used_tokens + tokens <= token_budget:
+            blocks.append(digest)
+            used_tokens += tokens
+        else:
+            break
+
+    return "\n\n".join(blocks), used_tokens
@@ -0,0 +1,764 @@
+"""
+Local SQLite backend for Storage.
+
+SQLiteClient answers the subset of the supabase-py query builder that Storage uses
+(table/select/insert/upsert/update/delete, eq/neq/gt/gte/lt/lte/in_/is_/or_ filters,
+order/limit/range, and rpc() for the functions in RPC_FUNCTIONS) from a SQLite file in
+WAL mode, so Storage runs unchanged on it for
+tests and offline benchmarks. ReplicaClient puts a SQLiteClient in front of Supabase as
+a per-athlete read replica.
+"""
+import base64
+import json
+import math
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+from postgrest import APIResponse
+from postgrest.exceptions import APIError
+
+DEFAULT_SQLITE_PATH = os.path.join(".cache", "wildstride.sqlite3")
+# Seconds an athlete's replicated rows are served before they are pulled again from the primary
+REPLICA_MAX_STALENESS = 300
+# Rows pulled per request when hydrating the replica
+REPLICA_PAGE_SIZE = 1000
+# Tables always read from the primary: streams are read one row at a time, and pulling an athlete's
+# whole table for it would copy every stored stream blob into the replica; tokens are rotated by
+# other processes, and a stale refresh token is already spent
+REPLICA_EXCLUDED_TABLES = ('activity_streams', 'strava_tokens')
+
+# Column types: JSON is stored as TEXT and decoded on read, BOOLEAN is stored as 0/1, BYTEA is stored
+# as a BLOB and exchanged as \x-prefixed hex text like PostgREST does
+SCHEMA = {
+    'user_preferences': {
+        'columns': {'athlete_id': 'TEXT', 'preferences': 'JSON', 'updated_at': 'TEXT'},
+        'primary_key': ('athlete_id',)
+    },
+    'athletes': {
+        'columns': {
+            'athlete_id': 'TEXT', 'firstname': 'TEXT', 'lastname': 'TEXT', 'city': 'TEXT', 'country': 'TEXT',
+            'profile_url': 'TEXT', 'ref_code': 'TEXT', 'used_ref_code': 'TEXT',
+            'credits': 'INTEGER DEFAULT 3', 'used_credits': 'INTEGER DEFAULT 0',
+            'created_at': 'TEXT', 'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id',)
+    },
+    'athlete_stats': {
+        'columns': {
+            'athlete_id': 'TEXT', 'period': 'TEXT', 'activity_type': 'TEXT', 'total_activities': 'INTEGER',
+            'total_distance': 'REAL', 'total_elevation': 'REAL', 'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id', 'period', 'activity_type')
+    },
+    'activities': {
+        'columns': {
+            'athlete_id': 'TEXT', 'activity_id': 'TEXT', 'name': 'TEXT', 'start_date_local': 'TEXT',
+            'sport_type': 'TEXT', 'type': 'TEXT', 'distance': 'REAL', 'moving_time': 'INTEGER',
+            'total_elevation_gain': 'REAL', 'average_speed': 'REAL', 'average_cadence': 'REAL',
+            'average_watts': 'REAL', 'average_heartrate': 'REAL', 'max_heartrate': 'REAL',
+            'suffer_score': 'REAL', 'summary': 'TEXT', 'coach_feedback': 'TEXT',
+            'is_coached': 'BOOLEAN DEFAULT 0', 'has_details': 'BOOLEAN DEFAULT 0', 'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id', 'activity_id'),
+        # History pages and scans read (athlete_id, start_date_local, activity_id) ranges
+        'indexes': [('athlete_id', 'start_date_local', 'activity_id')]
+    },
+    'strava_tokens': {
+        'columns': {
+            'athlete_id': 'TEXT', 'access_token': 'TEXT', 'refresh_token': 'TEXT', 'expires_at': 'INTEGER',
+            'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id',)
+    },
+    'activity_sync': {
+        'columns': {'athlete_id': 'TEXT', 'last_start_date': 'INTEGER', 'history_before': 'INTEGER', 'updated_at': 'TEXT'},
+        'primary_key': ('athlete_id',)
+    },
+    'coaching_jobs': {
+        'columns': {
+            'athlete_id': 'TEXT', 'activity_id': 'TEXT', 'status': 'TEXT', 'error': 'TEXT',
+            'created_at': 'TEXT', 'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id', 'activity_id')
+    },
+    'activity_streams': {
+        'columns': {
+            'athlete_id': 'TEXT', 'activity_id': 'TEXT', 'stream_types': 'JSON', 'sample_count': 'INTEGER',
+            'data': 'BYTEA', 'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id', 'activity_id')
+    },
+    'training_load': {
+        'columns': {'athlete_id': 'TEXT', 'ctl': 'REAL', 'atl': 'REAL', 'last_day': 'TEXT', 'updated_at': 'TEXT'},
+        'primary_key': ('athlete_id',)
+    },
+    'activity_rollups': {
+        'columns': {
+            'athlete_id': 'TEXT', 'period': 'TEXT', 'period_start': 'TEXT', 'sport_type': 'TEXT',
+            'count': 'INTEGER', 'distance': 'REAL', 'moving_time': 'REAL', 'elevation_gain': 'REAL',
+            'updated_at': 'TEXT'
+        },
+        'primary_key': ('athlete_id', 'period', 'period_start', 'sport_type')
+    },
+}
+
+# Columns of the activity rows written by upsert_activities (see Storage._activity_row)
+UPSERTED_ACTIVITY_COLUMNS = [
+    'activity_id', 'name', 'start_date_local', 'sport_type', 'distance', 'moving_time', 'total_elevation_gain',
+    'average_speed', 'average_cadence', 'average_watts', 'average_heartrate', 'max_heartrate', 'suffer_score',
+    'has_details', 'updated_at', 'summary'
+]
+_UPSERTED_ACTIVITY_VALUES = ', '.join(f"json_extract(value, '$.{column}')" for column in UPSERTED_ACTIVITY_COLUMNS)
+_UPSERTED_ACTIVITY_UPDATES = ', '.join(f"{column} = excluded.{column}" for column in UPSERTED_ACTIVITY_COLUMNS[1:])
+
+# SQLite versions of the Postgres functions Storage calls with rpc() (see migrations/): name -> (table
+# whose rows the function returns, statement or tuple of statements with :named parameters run in one
+# transaction, the rows of the last one are returned)
+RPC_FUNCTIONS = {
+    'reserve_credit': (
+        'athletes',
+        "UPDATE athletes SET credits = credits - 1, used_credits = COALESCE(used_credits, 0) + 1 "
+        "WHERE athlete_id = :p_athlete_id AND credits > 0 RETURNING *"
+    ),
+    'refund_credit': (
+        'athletes',
+        "UPDATE athletes SET credits = COALESCE(credits, 0) + 1, used_credits = MAX(COALESCE(used_credits, 0) - 1, 0) "
+        "WHERE athlete_id = :p_athlete_id RETURNING *"
+    ),
+    'apply_training_load': (
+        'training_load',
+        "UPDATE training_load SET "
+        "ctl = ctl * power(:p_ctl_decay, MAX(julianday(:p_day) - julianday(COALESCE(last_day, :p_day)), 0)) "
+        "+ :p_ctl * power(:p_ctl_decay, MAX(julianday(COALESCE(last_day, :p_day)) - julianday(:p_day), 0)), "
+        "atl = atl * power(:p_atl_decay, MAX(julianday(:p_day) - julianday(COALESCE(last_day, :p_day)), 0)) "
+        "+ :p_atl * power(:p_atl_decay, MAX(julianday(COALESCE(last_day, :p_day)) - julianday(:p_day), 0)), "
+        "last_day = MAX(COALESCE(last_day, :p_day), :p_day), "
+        "updated_at = strftime('%Y-%m-%dT%H:%M:%f', 'now') "
+        "WHERE athlete_id = :p_athlete_id RETURNING *"
+    ),
+    'claim_coaching_job': (
+        'coaching_jobs',
+        "INSERT INTO coaching_jobs (athlete_id, activity_id, status, error, created_at, updated_at) "
+        "VALUES (:p_athlete_id, :p_activity_id, 'queued', NULL, :p_now, :p_now) "
+        "ON CONFLICT (athlete_id, activity_id) DO UPDATE SET "
+        "status = 'queued', error = NULL, created_at = excluded.created_at, updated_at = excluded.updated_at "
+        "WHERE coaching_jobs.status = 'failed' "
+        "OR (coaching_jobs.status IN ('queued', 'running') AND coaching_jobs.updated_at < :p_stale_before) "
+        "RETURNING *"
+    ),
+    'apply_rollup_deltas': (
+        'activity_rollups',
+        "INSERT INTO activity_rollups (athlete_id, period, period_start, sport_type, \"count\", distance, "
+        "moving_time, elevation_gain, updated_at) "
+        "SELECT :p_athlete_id, json_extract(value, '$.period'), json_extract(value, '$.period_start'), "
+        "json_extract(value, '$.sport_type'), json_extract(value, '$.count'), json_extract(value, '$.distance'), "
+        "json_extract(value, '$.moving_time'), json_extract(value, '$.elevation_gain'), "
+        "strftime('%Y-%m-%dT%H:%M:%f', 'now') "
+        "FROM json_each(:p_deltas) WHERE true "
+        "ON CONFLICT (athlete_id, period, period_start, sport_type) DO UPDATE SET "
+        "\"count\" = \"count\" + excluded.\"count\", distance = distance + excluded.distance, "
+        "moving_time = moving_time + excluded.moving_time, elevation_gain = elevation_gain + excluded.elevation_gain, "
+        "updated_at = excluded.updated_at"
+    ),
+    'upsert_activities': (
+        'activities',
+        (
+            # Runs under the client lock, which plays the part of the Postgres advisory lock
+            "DROP TABLE IF EXISTS temp.replaced_activities",
+            "CREATE TEMP TABLE replaced_activities AS SELECT * FROM activities "
+            "WHERE athlete_id = :p_athlete_id "
+            "AND activity_id IN (SELECT json_extract(value, '$.activity_id') FROM json_each(:p_rows))",
+            f"INSERT INTO activities (athlete_id, {', '.join(UPSERTED_ACTIVITY_COLUMNS)}) "
+            f"SELECT :p_athlete_id, {_UPSERTED_ACTIVITY_VALUES} FROM json_each(:p_rows) WHERE true "
+            f"ON CONFLICT (athlete_id, activity_id) DO UPDATE SET {_UPSERTED_ACTIVITY_UPDATES}",
+            "SELECT * FROM temp.replaced_activities"
+        )
+    ),
+    'save_activity_streams': (
+        'activity_streams',
+        "INSERT INTO activity_streams (athlete_id, activity_id, stream_types, sample_count, data, updated_at) "
+        "VALUES (:p_athlete_id, :p_activity_id, :p_stream_types, :p_sample_count, decode(:p_data, 'base64'), "
+        "strftime('%Y-%m-%dT%H:%M:%f', 'now')) "
+        "ON CONFLICT (athlete_id, activity_id) DO UPDATE SET stream_types = excluded.stream_types, "
+        "sample_count = excluded.sample_count, data = excluded.data, updated_at = excluded.updated_at"
+    ),
+    'get_activity_streams': (
+        'activity_streams',
+        "SELECT stream_types, sample_count, encode(data, 'base64') AS data FROM activity_streams "
+        "WHERE athlete_id = :p_athlete_id AND activity_id = :p_activity_id"
+    )
+}
+# Functions returning the rows their write replaced rather than the rows written: the replica pulls
+# the table again instead of copying them
+RPC_RETURNS_REPLACED_ROWS = ('upsert_activities',)
+
+# PostgREST filter operators supported in or_() expressions
+_OPERATORS = {'eq': '=', 'neq': '!=', 'gt': '>', 'gte': '>=', 'lt': '<', 'lte': '<='}
+
+
+def _api_error(message: str, code: str = 'SQLITE') -> APIError:
+    return APIError({'message': message, 'code': code, 'hint': None, 'details': None})
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
+
+
+def _pg_encode(data: bytes, format: str) -> str:
+    """Postgres encode(bytea, 'base64'), for RPC_FUNCTIONS"""
+    if format != 'base64':
+        raise ValueError(f"unsupported encoding {format}")
+    return base64.b64encode(data).decode('ascii')
+
+
+def _pg_decode(text: str, format: str) -> bytes:
+    """Postgres decode(text, 'base64'), for RPC_FUNCTIONS"""
+    if format != 'base64':
+        raise ValueError(f"unsupported encoding {format}")
+    return base64.b64decode(text)
+
+
+def _sql_type(column_type: str) -> str:
+    """SQLite declaration of a SCHEMA column type"""
+    return column_type.replace('JSON', 'TEXT').replace('BYTEA', 'BLOB')
+
+
+def _split_top_level(text: str) -> List[str]:
+    """Split a PostgREST logic expression on the commas that are not nested or quoted"""
+    parts, depth, quoted, current = [], 0, False, ''
+    for char in text:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == '(':
+            depth += 1
+        elif not quoted and char == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and char == ',':
+            parts.append(current)
+            current = ''
+            continue
+        current += char
+    if current:
+        parts.append(current)
+    return parts
+
+
+class SQLiteQuery:
+    """One table request, built with the same chained calls as postgrest-py and run by execute()"""
+
+    def __init__(self, client: 'SQLiteClient', table: str):
+        if table not in client.schema:
+            raise _api_error(f'relation "{table}" does not exist', '42P01')
+        self.client = client
+        self.table = table
+        self.columns = client.schema[table]['columns']
+        self._operation = 'select'
+        self._select = '*'
+        self._payload: List[Dict] = []
+        self._on_conflict: Optional[str] = None
+        self._where: List[Tuple[str, list]] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+
+    def _column(self, name: str) -> str:
+        if name not in self.columns:
+            raise _api_error(f'column {self.table}.{name} does not exist', '42703')
+        return _quote(name)
+
+    # Operations
+
+    def select(self, columns: str = '*', count=None) -> 'SQLiteQuery':
+        self._operation = 'select'
+        self._select = columns
+        return self
+
+    def insert(self, rows, **kwargs) -> 'SQLiteQuery':
+        self._operation = 'insert'
+        self._payload = rows if isinstance(rows, list) else [rows]
+        return self
+
+    def upsert(self, rows, on_conflict: Optional[str] = None, **kwargs) -> 'SQLiteQuery':
+        self._operation = 'upsert'
+        self._payload = rows if isinstance(rows, list) else [rows]
+        self._on_conflict = on_conflict
+        return self
+
+    def update(self, values: Dict, **kwargs) -> 'SQLiteQuery':
+        self._operation = 'update'
+        self._payload = [values]
+        return self
+
+    def delete(self, **kwargs) -> 'SQLiteQuery':
+        self._operation = 'delete'
+        return self
+
+    # Filters
+
+    def _filter(self, column: str, operator: str, value) -> 'SQLiteQuery':
+        self._where.append((f"{self._column(column)} {operator} ?", [self.client.encode(self.table, column, value)]))
+        return self
+
+    def eq(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '=', value)
+
+    def neq(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '!=', value)
+
+    def gt(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '>', value)
+
+    def gte(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '>=', value)
+
+    def lt(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '<', value)
+
+    def lte(self, column: str, value) -> 'SQLiteQuery':
+        return self._filter(column, '<=', value)
+
+    def is_(self, column: str, value) -> 'SQLiteQuery':
+        self._where.append((f"{self._column(column)} IS {'NULL' if value in (None, 'null') else 'NOT NULL'}", []))
+        return self
+
+    def in_(self, column: str, values) -> 'SQLiteQuery':
+        values = [self.client.encode(self.table, column, value) for value in values]
+        if not values:
+            self._where.append(('0', []))
+        else:
+            self._where.append((f"{self._column(column)} IN ({', '.join('?' * len(values))})", values))
+        return self
+
+    def or_(self, filters: str) -> 'SQLiteQuery':
+        self._where.append(self._logic('OR', filters))
+        return self
+
+    def _logic(self, joiner: str, expression: str) -> Tuple[str, list]:
+        clauses, params = [], []
+        for part in _split_top_level(expression):
+            part = part.strip()
+            if part.startswith(('and(', 'or(')):
+                nested_joiner, _, inner = part.partition('(')
+                sql, nested_params = self._logic(nested_joiner.upper(), inner[:-1])
+            else:
+                column, operator, value = part.split('.', 2)
+                if operator not in _OPERATORS:
+                    raise _api_error(f'unsupported operator "{operator}" in or filter', 'PGRST100')
+                if len(value) >= 2 and value[0] == value[-1] == '"':
+                    value = value[1:-1]
+                sql, nested_params = f"{self._column(column)} {_OPERATORS[operator]} ?", [value]
+            clauses.append(f"({sql})")
+            params.extend(nested_params)
+        return f" {joiner} ".join(clauses), params
+
+    # Modifiers
+
+    def order(self, column: str, desc: bool = False, nullsfirst: Optional[bool] = None, **kwargs) -> 'SQLiteQuery':
+        # PostgreSQL puts NULLs last ascending and first descending, SQLite does the opposite
+        if nullsfirst is None:
+            nullsfirst = desc
+        self._order.append(f"{self._column(column)} {'DESC' if desc else 'ASC'} NULLS {'FIRST' if nullsfirst else 'LAST'}")
+        return self
+
+    def limit(self, size: int) -> 'SQLiteQuery':
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int) -> 'SQLiteQuery':
+        self._offset = start
+        self._limit = end - start + 1
+        return self
+
+    # Execution
+
+    def _where_sql(self) -> Tuple[str, list]:
+        if not self._where:
+            return '', []
+        params = [param for _, clause_params in self._where for param in clause_params]
+        return ' WHERE ' + ' AND '.join(f"({sql})" for sql, _ in self._where), params
+
+    def _build(self) -> Tuple[str, list]:
+        table = _quote(self.table)
+        where, params = self._where_sql()
+
+        if self._operation == 'select':
+            if self._select.strip() == '*':
+                columns = '*'
+            else:
+                columns = ', '.join(self._column(name.strip()) for name in self._select.split(','))
+            sql = f"SELECT {columns} FROM {table}{where}"
+            if self._order:
+                sql += ' ORDER BY ' + ', '.join(self._order)
+            if self._limit is not None or self._offset is not None:
+                sql += ' LIMIT ? OFFSET ?'
+                params = params + [self._limit if self._limit is not None else -1, self._offset or 0]
+            return sql, params
+
+        if self._operation == 'delete':
+            return f"DELETE FROM {table}{where} RETURNING *", params
+
+        if self._operation == 'update':
+            values = self._payload[0]
+            assignments = ', '.join(f"{self._column(name)} = ?" for name in values)
+            encoded = [self.client.encode(self.table, name, value) for name, value in values.items()]
+            return f"UPDATE {table} SET {assignments}{where} RETURNING *", encoded + params
+
+        raise _api_error(f"{self._operation} is executed row by row")
+
+    def execute(self) -> APIResponse:
+        if self._operation in ('insert', 'upsert'):
+            return APIResponse(data=self.client.write_rows(self.table, self._payload, self._on_conflict,
+                                                           upsert=self._operation == 'upsert'))
+        sql, params = self._build()
+        return APIResponse(data=self.client.query(self.table, sql, params))
+
+
+class SQLiteRpc:
+    """rpc() call of a function from RPC_FUNCTIONS, run in a single transaction"""
+
+    def __init__(self, client: 'SQLiteClient', name: str, params: Dict):
+        if name not in RPC_FUNCTIONS:
+            raise _api_error(f"Could not find the function public.{name} in the schema cache", 'PGRST202')
+        self.client = client
+        self.table, self._sql = RPC_FUNCTIONS[name]
+        # JSON arguments (jsonb in Postgres) are passed as text to json_each()
+        self._params = {key: json.dumps(value) if isinstance(value, (list, dict)) else value for key, value in params.items()}
+
+    def execute(self) -> APIResponse:
+        return APIResponse(data=self.client.query(self.table, self._sql, self._params))
+
+
+class SQLiteClient:
+    """
+    Supabase-compatible client backed by a local SQLite database.
+
+    A single connection in WAL mode is shared by all threads behind a lock, like the LLM
+    response cache. Tables and indexes from SCHEMA are created on first use.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH, schema: Optional[Dict] = None):
+        self.path = path
+        self.schema = SCHEMA if schema is None else schema
+        if path != ':memory:':
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        # Math functions are optional in SQLite builds, RPC_FUNCTIONS need power(), and encode()/decode() of Postgres
+        self._conn.create_function("power", 2, math.pow, deterministic=True)
+        self._conn.create_function("encode", 2, _pg_encode, deterministic=True)
+        self._conn.create_function("decode", 2, _pg_decode, deterministic=True)
+        self._create_tables()
+
+    def _create_tables(self) -> None:
+        with self._lock:
+            for table, definition in self.schema.items():
+                columns = [
+                    f"{_quote(name)} {_sql_type(column_type)}"
+                    for name, column_type in definition['columns'].items()
+                ]
+                primary_key = ', '.join(_quote(name) for name in definition['primary_key'])
+                self._conn.execute(
+                    f"CREATE TABLE IF NOT EXISTS {_quote(table)} ({', '.join(columns)}, PRIMARY KEY ({primary_key}))"
+                )
+                # Databases created by an older schema get the columns added since
+                existing = {row['name'] for row in self._conn.execute(f"PRAGMA table_info({_quote(table)})")}
+                for name, column_type in definition['columns'].items():
+                    if name not in existing:
+                        self._conn.execute(
+                            f"ALTER TABLE {_quote(table)} ADD COLUMN {_quote(name)} {_sql_type(column_type)}"
+                        )
+                for index_columns in definition.get('indexes', []):
+                    index_name = f"{table}_{'_'.join(index_columns)}"
+                    self._conn.execute(
+                        f"CREATE INDEX IF NOT EXISTS {_quote(index_name)} ON {_quote(table)} "
+                        f"({', '.join(_quote(name) for name in index_columns)})"
+                    )
+            self._conn.commit()
+
+    def table(self, name: str) -> SQLiteQuery:
+        return SQLiteQuery(self, name)
+
+    def from_(self, name: str) -> SQLiteQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None, **kwargs) -> SQLiteRpc:
+        return SQLiteRpc(self, name, params or {})
+
+    def _column_type(self, table: str, column: str) -> str:
+        return self.schema[table]['columns'][column].split()[0]
+
+    def encode(self, table: str, column: str, value) -> Any:
+        column_type = self._column_type(table, column)
+        if value is not None and column_type == 'JSON':
+            return json.dumps(value)
+        if isinstance(value, str) and column_type == 'BYTEA':
+            return bytes.fromhex(value.removeprefix('\\x'))
+        return value
+
+    def decode_row(self, table: str, row: sqlite3.Row) -> Dict:
+        decoded = {}
+        for column in row.keys():
+            value = row[column]
+            column_type = self._column_type(table, column)
+            if value is not None and column_type == 'JSON':
+                value = json.loads(value)
+            elif value is not None and column_type == 'BOOLEAN':
+                value = bool(value)
+            elif isinstance(value, bytes) and column_type == 'BYTEA':
+                value = '\\x' + value.hex()
+            decoded[column] = value
+        return decoded
+
+    def query(self, table: str, sql, params) -> List[Dict]:
+        """Run a statement, or a tuple of statements in one transaction, returning the rows of the last one"""
+        statements = (sql,) if isinstance(sql, str) else sql
+        with self._lock:
+            try:
+                # Take the write lock up front, so reads made by the statements are not stale by the time
+                # they write (other connections to the file, e.g. the webhook process, wait meanwhile)
+                self._conn.execute("BEGIN IMMEDIATE")
+                for statement in statements:
+                    rows = self._conn.execute(statement, params).fetchall()
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                raise _api_error(str(e)) from e
+        return [self.decode_row(table, row) for row in rows]
+
+    def _insert_sql(self, table: str, rows: List[Dict], on_conflict: Optional[str], upsert: bool) -> Tuple[str, List[str]]:
+        """INSERT (or upsert) statement for rows and the columns its parameters follow"""
+        columns_schema = self.schema[table]['columns']
+        # Like PostgREST, the columns of a multi-row request are the union of the row keys
+        columns = list(dict.fromkeys(name for row in rows for name in row))
+        for name in columns:
+            if name not in columns_schema:
+                raise _api_error(f"Could not find the '{name}' column of '{table}' in the schema cache", 'PGRST204')
+        sql = (f"INSERT INTO {_quote(table)} ({', '.join(_quote(name) for name in columns)}) "
+               f"VALUES ({', '.join('?' * len(columns))})")
+        if upsert:
+            conflict_columns = [name.strip() for name in on_conflict.split(',')] if on_conflict \
+                else list(self.schema[table]['primary_key'])
+            updates = [name for name in columns if name not in conflict_columns]
+            sql += f" ON CONFLICT ({', '.join(_quote(name) for name in conflict_columns)}) "
+            if updates:
+                sql += 'DO UPDATE SET ' + ', '.join(f"{_quote(name)} = excluded.{_quote(name)}" for name in updates)
+            else:
+                sql += 'DO NOTHING'
+        return sql + " RETURNING *", columns
+
+    def _insert_rows(self, table: str, rows: List[Dict], on_conflict: Optional[str], upsert: bool) -> List[sqlite3.Row]:
+        """Run the inserts of rows in the current transaction (hold the lock, commit or roll back after)"""
+        if not rows:
+            return []
+        sql, columns = self._insert_sql(table, rows, on_conflict, upsert)
+        stored = []
+        for row in rows:
+            params = [self.encode(table, name, row.get(name)) for name in columns]
+            stored.extend(self._conn.execute(sql, params).fetchall())
+        return stored
+
+    def write_rows(self, table: str, rows: List[Dict], on_conflict: Optional[str] = None,
+                   upsert: bool = True) -> List[Dict]:
+        """Insert or upsert rows in one transaction, returning them as stored (PostgREST return=representation)"""
+        with self._lock:
+            try:
+                stored = self._insert_rows(table, rows, on_conflict, upsert)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                code = '23505' if isinstance(e, sqlite3.IntegrityError) else 'SQLITE'
+                raise _api_error(str(e), code) from e
+        return [self.decode_row(table, row) for row in stored]
+
+    def replace_rows(self, table: str, athlete_id: str, rows: List[Dict]) -> None:
+        """
+        Replace every row of an athlete in a table, dropping columns the local schema does not know.
+
+        The delete and the inserts are one transaction, readers see either the old rows or the new ones.
+        """
+        columns_schema = self.schema[table]['columns']
+        rows = [{name: value for name, value in row.items() if name in columns_schema} for row in rows]
+        with self._lock:
+            try:
+                self._conn.execute(f"DELETE FROM {_quote(table)} WHERE athlete_id = ?", (athlete_id,))
+                self._insert_rows(table, rows, None, upsert=True)
+                self._conn.commit()
+            except sqlite3.Error as e:
+                self._conn.rollback()
+                raise _api_error(str(e)) from e
+
+    def merge_rows(self, table: str, rows: List[Dict]) -> None:
+        """Upsert rows by primary key, dropping columns the local schema does not know"""
+        columns_schema = self.schema[table]['columns']
+        self.write_rows(table, [{name: value for name, value in row.items() if name in columns_schema} for row in rows])
+
+    def remove_rows(self, table: str, rows: List[Dict]) -> None:
+        """Delete rows by primary key"""
+        primary_key = self.schema[table]['primary_key']
+        where = ' AND '.join(f"{_quote(name)} = ?" for name in primary_key)
+        with self._lock:
+            for row in rows:
+                self._conn.execute(f"DELETE FROM {_quote(table)} WHERE {where}", [row.get(name) for name in primary_key])
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+class _ReplicaQuery:
+    """Records a chained request and sends it to the replica (reads) or the primary (writes) on execute()"""
+
+    WRITE_OPERATIONS = ('insert', 'upsert', 'update', 'delete')
+
+    def __init__(self, client: 'ReplicaClient', table: str):
+        self._client = client
+        self._table = table
+        self._calls: List[Tuple[str, tuple, dict]] = []
+
+    def __getattr__(self, name: str):
+        def record(*args, **kwargs):
+            self._calls.append((name, args, kwargs))
+            return self
+        return record
+
+    def _replay(self, client):
+        request = client.table(self._table)
+        for name, args, kwargs in self._calls:
+            request = getattr(request, name)(*args, **kwargs)
+        return request.execute()
+
+    def execute(self) -> APIResponse:
+        operation = next((name for name, _, _ in self._calls if name in self.WRITE_OPERATIONS + ('select',)), 'select')
+        athlete_id = next((args[1] for name, args, _ in self._calls if name == 'eq' and args[0] == 'athlete_id'), None)
+
+        if operation == 'select':
+            if athlete_id is None or not self._client.replicates(self._table):
+                return self._replay(self._client.primary)
+            self._client.hydrate(self._table, str(athlete_id))
+            return self._replay(self._client.replica)
+
+        response = self._replay(self._client.primary)
+        self._client.mirror(self._table, operation, response.data or [])
+        return response
+
+
+class _ReplicaRpc:
+    """rpc() call sent to the primary, the rows a known function returns are applied to the replica like a write"""
+
+    def __init__(self, client: 'ReplicaClient', name: str, params: Dict, kwargs: Dict):
+        self._client = client
+        self._name = name
+        self._params = params
+        self._kwargs = kwargs
+
+    def execute(self) -> APIResponse:
+        response = self._client.primary.rpc(self._name, self._params, **self._kwargs).execute()
+        if self._name in RPC_FUNCTIONS:
+            table = RPC_FUNCTIONS[self._name][0]
+            if isinstance(response.data, list) and response.data and self._name not in RPC_RETURNS_REPLACED_ROWS:
+                self._client.mirror(table, 'update', response.data)
+            else:
+                # Nothing to copy (e.g. apply_rollup_deltas returns no rows, upsert_activities the replaced ones),
+                # pull the table again on next read
+                self._client.invalidate(table, str(self._params.get('p_athlete_id')))
+        return response
+
+
+class ReplicaClient:
+    """
+    Supabase client with a local SQLite read replica.
+
+    Reads filtered on athlete_id are served from SQLite once that athlete's rows of the
+    table were pulled from the primary (except REPLICA_EXCLUDED_TABLES), and pulled again after
+    max_staleness seconds to pick up writes from other processes (webhook, other app instances).
+    Concurrent reads of a stale (table, athlete) share a single pull. Writes go to the
+    primary and the rows it returns are applied to the replica.
+    """
+
+    def __init__(self, primary, replica: SQLiteClient, max_staleness: float = REPLICA_MAX_STALENESS):
+        self.primary = primary
+        self.replica = replica
+        self.max_staleness = max_staleness
+        self._hydrated_at: Dict[tuple, float] = {}
+        # Bumped by every mirrored write, a pull that overlapped one is not trusted
+        self._generations: Dict[tuple, int] = {}
+        self._pull_locks: Dict[tuple, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def table(self, name: str) -> _ReplicaQuery:
+        return _ReplicaQuery(self, name)
+
+    def from_(self, name: str) -> _ReplicaQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None, **kwargs) -> '_ReplicaRpc':
+        return _ReplicaRpc(self, name, params or {}, kwargs)
+
+    def replicates(self, table: str) -> bool:
+        return table in self.replica.schema and table not in REPLICA_EXCLUDED_TABLES
+
+    def _is_fresh(self, key: tuple) -> bool:
+        hydrated_at = self._hydrated_at.get(key)
+        return hydrated_at is not None and time.monotonic() - hydrated_at < self.max_staleness
+
+    def hydrate(self, table: str, athlete_id: str) -> None:
+        """Pull an athlete's rows of a table from the primary unless the replica has a fresh copy"""
+        key = (table, athlete_id)
+        with self._lock:
+            if self._is_fresh(key):
+                return
+            pull_lock = self._pull_locks.setdefault(key, threading.Lock())
+
+        # One pull per (table, athlete) at a time, concurrent reruns wait for it and reuse its rows
+        with pull_lock:
+            with self._lock:
+                if self._is_fresh(key):
+                    return
+                generation = self._generations.get(key, 0)
+
+            # Pages are only stable under a total order, sort on the primary key
+            rows = []
+            while True:
+                query = self.primary.table(table).select('*').eq('athlete_id', athlete_id)
+                for column in self.replica.schema[table]['primary_key']:
+                    query = query.order(column)
+                page = query.range(len(rows), len(rows) + REPLICA_PAGE_SIZE - 1).execute().data or []
+                rows.extend(page)
+                if len(page) < REPLICA_PAGE_SIZE:
+                    break
+            self.replica.replace_rows(table, athlete_id, rows)
+
+            with self._lock:
+                if self._generations.get(key, 0) == generation:
+                    self._hydrated_at[key] = time.monotonic()
+
+    def invalidate(self, table: str, athlete_id: str) -> None:
+        """Make the next read of an athlete's rows pull them from the primary again"""
+        key = (table, athlete_id)
+        with self._lock:
+            self._hydrated_at.pop(key, None)
+            self._generations[key] = self._generations.get(key, 0) + 1
+
+    def mirror(self, table: str, operation: str, rows: List[Dict]) -> None:
+        if not self.replicates(table) or not rows:
+            return
+        with self._lock:
+            for athlete_id in {str(row.get('athlete_id')) for row in rows}:
+                key = (table, athlete_id)
+                self._generations[key] = self._generations.get(key, 0) + 1
+        if operation == 'delete':
+            self.replica.remove_rows(table, rows)
+        else:
+            self.replica.merge_rows(table, rows)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'hydrated': len(self._hydrated_at)}
@@ -1,23 +1,94 @@
-from datetime import datetime
-from typing import Dict, List, Optional
+import base64
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from datetime import datetime, timedelta
+from typing import Callable, Dict, List, Optional, Tuple
 import os
-from supabase import create_client, Client
+import threading
 import streamlit as st
 from activities_parsing import generate_user_identifier
+from storage_cache import ReadCache
+from tracing import TracedClient
+import activity_rollups
+import training_load
+
+# Maximum number of rows sent in a single multi-row upsert request
+UPSERT_CHUNK_SIZE = 500
+# Number of activities shown in the dashboard history
+DASHBOARD_ACTIVITY_LIMIT = 20
+# Weeks of history covered by the dashboard weekly chart
+DASHBOARD_ROLLUP_WEEKS = 52
+# Rows read per request when scanning all activities of an athlete (PostgREST caps responses at 1000)
+SCAN_PAGE_SIZE = 1000
+
+# Shared pool used to send independent read queries in parallel
+_query_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix='storage')
+
+# Backends selectable with the storage_backend secret
+BACKEND_SUPABASE = 'supabase'
+BACKEND_SQLITE = 'sqlite'
+BACKEND_SUPABASE_REPLICA = 'supabase+sqlite'
+
+
+def create_backend_client(backend: Optional[str] = None):
+    """
+    Build the database client Storage talks to.
+
+    Args:
+        backend (str, optional): 'supabase' (default), 'sqlite' for a standalone local database
+            (tests, offline benchmarks) or 'supabase+sqlite' for Supabase behind a local read replica.
+            Defaults to the storage_backend secret.
+    """
+    # Imported here, supabase (and postgrest, which sqlite_backend uses for its responses) take
+    # ~0.3 s to import and pages that never reach the database should not pay for it
+    from sqlite_backend import DEFAULT_SQLITE_PATH, ReplicaClient, SQLiteClient
+
+    backend = backend or st.secrets.get("storage_backend", BACKEND_SUPABASE)
+    sqlite_path = st.secrets.get("sqlite_path", DEFAULT_SQLITE_PATH)
+    if backend == BACKEND_SQLITE:
+        return SQLiteClient(sqlite_path)
+
+    from supabase import create_client
+    supabase = create_client(
+        st.secrets["supabase_url"],
+        st.secrets["supabase_key"]
+    )
+    if backend == BACKEND_SUPABASE_REPLICA:
+        return ReplicaClient(supabase, SQLiteClient(sqlite_path))
+    if backend != BACKEND_SUPABASE:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return supabase
+
 
 class Storage:
-    def __init__(self):
-        # Initialize Supabase client
-        self.supabase: Client = create_client(
-            st.secrets["supabase_url"],
-            st.secrets["supabase_key"]
-        )
+    # Number of database clients built in this process, see connection_stats()
+    clients_created = 0
+
+    def __init__(self, client=None):
+        # Any client exposing the supabase-py query builder (Supabase, SQLiteClient, ReplicaClient),
+        # wrapped so every execute() is timed
+        self.supabase = TracedClient(client if client is not None else create_backend_client())
+        Storage.clients_created += 1
+        self._cache = ReadCache()
+        # Serializes full rebuilds of per-athlete aggregates (training load, rollups) in this process
+        self._aggregates_lock = threading.Lock()
         self._ensure_tables()
 
     def _ensure_tables(self):
         """Ensure tables exist (Supabase will create them automatically)"""
         pass  # Tables are managed through Supabase dashboard
 
+    def connection_stats(self) -> Dict:
+        """Report how many Supabase clients and pooled HTTP connections this process holds"""
+        stats = {'clients': Storage.clients_created, 'open_connections': None}
+        try:
+            pool = self.supabase.postgrest.session._transport._pool
+            stats['open_connections'] = len(pool.connections)
+        except AttributeError:
+            # The client internals differ between supabase-py versions
+            pass
+        return stats
+
     def _extract_stats_from_totals(self, totals: Dict) -> Dict:
         """Extract relevant statistics from Strava totals"""
         return {
@@ -26,6 +97,19 @@ class Storage:
             'total_elevation': totals.get('elevation_gain', 0)
         }
 
+    def _run_concurrently(self, queries: Dict[str, Callable]) -> Dict:
+        """Run independent Supabase queries in parallel and return their responses by name"""
+        # Each query runs in a copy of the caller's context, so its span keeps the render's trace
+        futures = {name: _query_executor.submit(contextvars.copy_context().run, query) for name, query in queries.items()}
+        return {name: future.result() for name, future in futures.items()}
+
+    def _upsert_rows(self, table: str, rows: List[Dict], on_conflict: str) -> None:
+        """Upsert rows in chunks, sending one request per chunk instead of one per row"""
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            self.supabase.table(table) \
+                .upsert(rows[start:start + UPSERT_CHUNK_SIZE], on_conflict=on_conflict) \
+                .execute()
+
     def save_user_data(self, athlete_id: str, data: Dict) -> None:
         """Save user data to Supabase"""
         # Update preferences
@@ -38,8 +122,8 @@ class Storage:
 
         # Update activities if present
         if 'activities' in data:
-            for activity in data['activities']:
-                self.supabase.table('activities').upsert({
+            rows = [
+                {
                     'athlete_id': athlete_id,
                     'activity_id': activity['id'],
                     'name': activity['name'],
@@ -49,38 +133,136 @@ class Storage:
                     'moving_time': activity['moving_time'],
                     'total_elevation_gain': activity['total_elevation_gain'],
                     'updated_at': datetime.now().isoformat()
-                }).execute()
+                }
+                for activity in data['activities']
+            ]
+            self._upsert_rows('activities', rows, on_conflict='athlete_id,activity_id')
+
+        self._cache.invalidate(athlete_id, 'user_preferences', 'activities')
+
+    def _fetch_preferences(self, athlete_id: str) -> List[Dict]:
+        return self._cache.get_or_load(
+            ('user_preferences', athlete_id),
+            lambda: self.supabase.table('user_preferences')
+                .select('preferences')
+                .eq('athlete_id', athlete_id)
+                .execute().data or []
+        )
 
-    def get_user_data(self, athlete_id: str) -> Optional[Dict]:
-        """Get user data from Supabase"""
-        # Get preferences
-        preferences = self.supabase.table('user_preferences') \
-            .select('preferences') \
-            .eq('athlete_id', athlete_id) \
-            .execute()
+    def _fetch_athletes_info(self, athlete_id: str) -> List[Dict]:
+        return self._cache.get_or_load(
+            ('athletes', athlete_id),
+            lambda: self.supabase.table('athletes')
+                .select('*')
+                .eq('athlete_id', athlete_id)
+                .execute().data or []
+        )
 
-        # Get activities
-        activities = self.supabase.table('activities') \
-            .select('*') \
-            .eq('athlete_id', athlete_id) \
-            .order('start_date_local', desc=True) \
-            .limit(10) \
-            .execute()
+    def _fetch_stats(self, athlete_id: str) -> List[Dict]:
+        return self._cache.get_or_load(
+            ('athlete_stats', athlete_id),
+            lambda: self.supabase.table('athlete_stats')
+                .select('*')
+                .eq('athlete_id', athlete_id)
+                .execute().data or []
+        )
 
-        athletes_info = self.supabase.table('athletes') \
-            .select('*') \
-            .eq('athlete_id', athlete_id) \
-            .execute()
+    def _fetch_activities_page(self, athlete_id: str, page_size: int, cursor: Optional[Tuple[str, str]]) -> List[Dict]:
+        def load():
+            query = self.supabase.table('activities') \
+                .select('*') \
+                .eq('athlete_id', athlete_id)
+            if cursor is not None:
+                # Keyset condition (start_date_local, activity_id) < cursor, values quoted for PostgREST
+                start_date_local, activity_id = cursor
+                query = query.or_(
+                    f'start_date_local.lt."{start_date_local}",'
+                    f'and(start_date_local.eq."{start_date_local}",activity_id.lt."{activity_id}")'
+                )
+            # One extra row tells whether another page follows
+            return query.order('start_date_local', desc=True) \
+                .order('activity_id', desc=True) \
+                .limit(page_size + 1) \
+                .execute().data or []
+        return self._cache.get_or_load(('activities', athlete_id, 'page', page_size, cursor), load)
+
+    def _fetch_recent_activities(self, athlete_id: str, limit: int) -> List[Dict]:
+        return self._fetch_activities_page(athlete_id, limit, None)[:limit]
+
+    def _fetch_training_load(self, athlete_id: str) -> List[Dict]:
+        return self._cache.get_or_load(
+            ('training_load', athlete_id),
+            lambda: self.supabase.table('training_load')
+                .select('*')
+                .eq('athlete_id', athlete_id)
+                .execute().data or []
+        )
 
-        if not preferences.data and not activities.data:
+    def cache_stats(self) -> Dict:
+        """Hit/miss counters of the read cache"""
+        return self._cache.stats()
+
+    def get_user_data(self, athlete_id: str) -> Optional[Dict]:
+        """Get user data from Supabase"""
+        # The three queries are independent, send them in parallel
+        results = self._run_concurrently({
+            'preferences': lambda: self._fetch_preferences(athlete_id),
+            'activities': lambda: self._fetch_recent_activities(athlete_id, 10),
+            'athletes_info': lambda: self._fetch_athletes_info(athlete_id)
+        })
+        preferences = results['preferences']
+        activities = results['activities']
+        athletes_info = results['athletes_info']
+
+        if not preferences and not activities:
             return None
 
         return {
-            'preferences': preferences.data[0]['preferences'] if preferences.data else {},
-            'activities': activities.data if activities.data else [],
-            'athletes_info': athletes_info.data[0] if athletes_info.data else {}
+            'preferences': preferences[0]['preferences'] if preferences else {},
+            'activities': activities,
+            'athletes_info': athletes_info[0] if athletes_info else {}
         }
 
+    def load_dashboard(self, athlete_id: str, activity_limit: int = DASHBOARD_ACTIVITY_LIMIT) -> Dict:
+        """Load preferences, athlete info, stats, recent activities and aggregates for a page render in one parallel round trip"""
+        weekly_since = activity_rollups.period_floor(activity_rollups.PERIOD_WEEK, DASHBOARD_ROLLUP_WEEKS)
+        results = self._run_concurrently({
+            'preferences': lambda: self._fetch_preferences(athlete_id),
+            'athletes_info': lambda: self._fetch_athletes_info(athlete_id),
+            'stats': lambda: self._fetch_stats(athlete_id),
+            'activities': lambda: self.get_activities_page(athlete_id, activity_limit),
+            'training_load': lambda: self._fetch_training_load(athlete_id),
+            'weekly_rollups': lambda: self._fetch_rollups(athlete_id, activity_rollups.PERIOD_WEEK, weekly_since),
+            'monthly_rollups': lambda: self._fetch_rollups(athlete_id, activity_rollups.PERIOD_MONTH, None)
+        })
+        activities, activities_cursor = results['activities']
+        if activities and not results['monthly_rollups']:
+            # History ingested before rollups existed, build them once
+            with self._aggregates_lock:
+                self.rebuild_rollups(athlete_id)
+            results['weekly_rollups'] = self._fetch_rollups(athlete_id, activity_rollups.PERIOD_WEEK, weekly_since)
+            results['monthly_rollups'] = self._fetch_rollups(athlete_id, activity_rollups.PERIOD_MONTH, None)
+        return {
+            'preferences': results['preferences'][0]['preferences'] if results['preferences'] else {},
+            'athletes_info': results['athletes_info'][0] if results['athletes_info'] else {},
+            'stats': self._organize_stats(results['stats']),
+            'activities': activities,
+            'activities_cursor': activities_cursor,
+            'training_load': training_load.row_to_state(results['training_load'][0]) if results['training_load'] else None,
+            'weekly_rollups': results['weekly_rollups'],
+            'monthly_rollups': results['monthly_rollups']
+        }
+
+    def get_user_preferences(self, athlete_id: str) -> Dict:
+        """Get the training goals of an athlete, empty if never set"""
+        rows = self._fetch_preferences(athlete_id)
+        return rows[0]['preferences'] if rows else {}
+
+    def get_athlete_info(self, athlete_id: str) -> Dict:
+        """Get the athletes row (profile, credits, referral codes) of an athlete, empty if unknown"""
+        rows = self._fetch_athletes_info(athlete_id)
+        return rows[0] if rows else {}
+
     def update_user_preferences(self, athlete_id: str, preferences: Dict) -> None:
         """Update user preferences"""
         self.supabase.table('user_preferences').upsert({
@@ -88,31 +270,248 @@ class Storage:
             'preferences': preferences,
             'updated_at': datetime.now().isoformat()
         }).execute()
+        self._cache.invalidate(athlete_id, 'user_preferences')
 
-    def add_activity(self, athlete_id: str, activity: Dict, summary: str) -> None:
-        """Add an activity to user's history with additional fields"""
-        self.supabase.table('activities') \
-            .upsert(
-                {
-                    'athlete_id': athlete_id,
-                    'activity_id': str(activity['id']),  # Convert to string to ensure consistency
-                    'name': activity['name'],
-                    'start_date_local': activity['start_date_local'],
-                    'sport_type': activity['sport_type'],
-                    'distance': activity['distance'],
-                    'moving_time': activity['moving_time'],
-                    'total_elevation_gain': activity['total_elevation_gain'],
-                    'average_speed': activity.get('average_speed'),
-                    'average_cadence': activity.get('average_cadence'),
-                    'average_watts': activity.get('average_watts'),
-                    'average_heartrate': activity.get('average_heartrate'),
-                    'max_heartrate': activity.get('max_heartrate'),
-                    'suffer_score': activity.get('suffer_score'),
-                    'updated_at': datetime.now().isoformat(),
-                    'summary': summary
-                },
-                on_conflict='athlete_id,activity_id'  # Specify the unique constraint
-            ).execute()
+    def _activity_row(self, athlete_id: str, activity: Dict, summary: str) -> Dict:
+        """Build the activities table row for a Strava activity"""
+        return {
+            'athlete_id': athlete_id,
+            'activity_id': str(activity['id']),  # Convert to string to ensure consistency
+            'name': activity['name'],
+            'start_date_local': activity['start_date_local'],
+            'sport_type': activity['sport_type'],
+            'distance': activity['distance'],
+            'moving_time': activity['moving_time'],
+            'total_elevation_gain': activity['total_elevation_gain'],
+            'average_speed': activity.get('average_speed'),
+            'average_cadence': activity.get('average_cadence'),
+            'average_watts': activity.get('average_watts'),
+            'average_heartrate': activity.get('average_heartrate'),
+            'max_heartrate': activity.get('max_heartrate'),
+            'suffer_score': activity.get('suffer_score'),
+            # Only the detailed payload (GET /activities/{id}) has segment efforts and splits
+            'has_details': 'segment_efforts' in activity or 'splits_metric' in activity,
+            'updated_at': datetime.now().isoformat(),
+            'summary': summary
+        }
+
+    def add_activity(self, athlete_id: str, activity: Dict, summary: str, streams: Optional[Dict] = None) -> None:
+        """Add an activity to user's history with additional fields, and its encoded streams if given"""
+        self.add_activities(athlete_id, [(activity, summary)])
+        if streams:
+            self.save_activity_streams(athlete_id, activity['id'], streams)
+
+    def add_activities(self, athlete_id: str, activities: List[Tuple[Dict, str]]) -> None:
+        """Add several (activity, summary) pairs to user's history using batched upserts"""
+        # A single upsert statement cannot touch the same row twice, keep the last version
+        rows = {}
+        for activity, summary in activities:
+            row = self._activity_row(athlete_id, activity, summary)
+            rows[row['activity_id']] = row
+        if not rows:
+            return
+        # Stored versions of re-ingested activities, their old values are swapped out of the aggregates.
+        # They are read in the same call as the write, so of two concurrent ingests of an activity the
+        # second one replaces the first one's row, and each increment below only carries its own change
+        previous = self._upsert_activities(athlete_id, list(rows.values()))
+        self._cache.invalidate(athlete_id, 'activities')
+
+        loads = training_load.activity_loads(previous, sign=-1) + training_load.activity_loads(rows.values())
+        if self.apply_training_load(athlete_id, loads) is None:
+            # First ingest for this athlete, derive the aggregates from the whole stored history
+            with self._aggregates_lock:
+                self.rebuild_training_load(athlete_id)
+                self.rebuild_rollups(athlete_id)
+            return
+
+        self._apply_rollup_deltas(athlete_id, activity_rollups.merge_deltas(
+            activity_rollups.rollup_deltas(previous, sign=-1),
+            activity_rollups.rollup_deltas(rows.values())
+        ))
+
+    def _upsert_activities(self, athlete_id: str, rows: List[Dict]) -> List[Dict]:
+        """Upsert activity rows in chunks, returning the stored rows they replaced (migrations/0008_upsert_activities.sql)"""
+        previous = []
+        for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+            previous.extend(self.supabase.rpc('upsert_activities', {
+                'p_athlete_id': athlete_id,
+                'p_rows': rows[start:start + UPSERT_CHUNK_SIZE]
+            }).execute().data or [])
+        return previous
+
+    def get_existing_activity_ids(self, athlete_id: str, activity_ids: List) -> set:
+        """Return which of the given activity IDs are already stored for an athlete"""
+        ids = [str(activity_id) for activity_id in activity_ids]
+        if not ids:
+            return set()
+        result = self.supabase.table('activities') \
+            .select('activity_id') \
+            .eq('athlete_id', athlete_id) \
+            .in_('activity_id', ids) \
+            .execute()
+        return {row['activity_id'] for row in result.data or []}
+
+    def get_activity_ids_without_details(self, athlete_id: str, limit: int) -> List[str]:
+        """Return which of the `limit` most recent activities of an athlete were stored from a summary payload only"""
+        result = self.supabase.table('activities') \
+            .select('activity_id,has_details') \
+            .eq('athlete_id', athlete_id) \
+            .order('start_date_local', desc=True) \
+            .limit(limit) \
+            .execute()
+        return [row['activity_id'] for row in result.data or [] if not row.get('has_details')]
+
+    def delete_activity(self, athlete_id: str, activity_id: str) -> None:
+        """Remove an activity from user's history"""
+        # The delete returns the removed row (to one caller only), its load is taken back from the aggregates
+        deleted = self.supabase.table('activities') \
+            .delete() \
+            .eq('athlete_id', athlete_id) \
+            .eq('activity_id', str(activity_id)) \
+            .execute().data or []
+        if deleted and self.apply_training_load(athlete_id, training_load.activity_loads(deleted, sign=-1)) is not None:
+            self._apply_rollup_deltas(athlete_id, activity_rollups.rollup_deltas(deleted, sign=-1))
+        self.supabase.table('activity_streams') \
+            .delete() \
+            .eq('athlete_id', athlete_id) \
+            .eq('activity_id', str(activity_id)) \
+            .execute()
+        self._cache.invalidate(athlete_id, 'activities')
+
+    def save_activity_streams(self, athlete_id: str, activity_id: str, streams: Dict) -> None:
+        """
+        Store the compressed streams of an activity (see activity_streams.encode_streams).
+
+        The blob travels as base64 and is decoded into the bytea column by the database
+        (migrations/0009_activity_streams_functions.sql); PostgREST would send bytea as hex, twice its size.
+        """
+        self.supabase.rpc('save_activity_streams', {
+            'p_athlete_id': athlete_id,
+            'p_activity_id': str(activity_id),
+            'p_stream_types': streams['stream_types'],
+            'p_sample_count': streams['sample_count'],
+            'p_data': base64.b64encode(streams['data']).decode('ascii')
+        }).execute()
+
+    def get_activity_streams(self, athlete_id: str, activity_id: str) -> Optional[Dict]:
+        """Get the compressed streams of an activity, None if they were never stored"""
+        result = self.supabase.rpc('get_activity_streams', {
+            'p_athlete_id': athlete_id,
+            'p_activity_id': str(activity_id)
+        }).execute()
+        if not result.data:
+            return None
+        row = result.data[0]
+        return dict(row, data=base64.b64decode(row['data']))
+
+    def get_training_load(self, athlete_id: str) -> Optional[Dict]:
+        """Get the stored fitness/fatigue state of an athlete (see training_load), None if never computed"""
+        rows = self._fetch_training_load(athlete_id)
+        return training_load.row_to_state(rows[0]) if rows else None
+
+    def save_training_load(self, athlete_id: str, state: Dict) -> None:
+        """Store the fitness/fatigue state of an athlete"""
+        self.supabase.table('training_load').upsert(
+            training_load.state_to_row(athlete_id, state),
+            on_conflict='athlete_id'
+        ).execute()
+        self._cache.invalidate(athlete_id, 'training_load')
+
+    def apply_training_load(self, athlete_id: str, loads: List[Tuple[int, float]]) -> Optional[Dict]:
+        """
+        Fold (day, load) changes into the stored training load in one server-side statement.
+
+        The increment is applied by the database (migrations/0001_apply_training_load.sql), so
+        concurrent writers in other processes cannot overwrite each other's changes.
+
+        Returns:
+            dict: The new state, or None if the athlete has no stored state yet (nothing is changed then).
+        """
+        if not loads:
+            return self.get_training_load(athlete_id)
+        rows = self.supabase.rpc('apply_training_load', {
+            'p_athlete_id': athlete_id,
+            **training_load.load_delta(loads)
+        }).execute().data or []
+        self._cache.invalidate(athlete_id, 'training_load')
+        return training_load.row_to_state(rows[0]) if rows else None
+
+    def _scan_activities(self, athlete_id: str, columns: List[str]) -> List[Dict]:
+        """Read some columns of every stored activity of an athlete, page by page"""
+        rows = []
+        while True:
+            page = self.supabase.table('activities') \
+                .select(','.join(columns)) \
+                .eq('athlete_id', athlete_id) \
+                .order('start_date_local') \
+                .range(len(rows), len(rows) + SCAN_PAGE_SIZE - 1) \
+                .execute().data or []
+            rows.extend(page)
+            if len(page) < SCAN_PAGE_SIZE:
+                return rows
+
+    def rebuild_training_load(self, athlete_id: str) -> Dict:
+        """Recompute the training load state from every stored activity and save it"""
+        rows = self._scan_activities(athlete_id, ['start_date_local', 'suffer_score', 'moving_time', 'average_heartrate'])
+        state = training_load.compute_state(rows)
+        self.save_training_load(athlete_id, state)
+        return state
+
+    def _apply_rollup_deltas(self, athlete_id: str, deltas: Dict) -> None:
+        """
+        Add per-period deltas to the stored rollups, touching only the affected rows.
+
+        The rows are incremented by the database in one call (migrations/0002_apply_rollup_deltas.sql),
+        so writers in other processes cannot overwrite each other's totals. Rollups emptied by a delta keep
+        a zero count rather than being deleted, which keeps increments commutative; readers skip them.
+        """
+        deltas = {key: totals for key, totals in deltas.items() if any(totals.values())}
+        if not deltas:
+            return
+        self.supabase.rpc('apply_rollup_deltas', {
+            'p_athlete_id': athlete_id,
+            'p_deltas': activity_rollups.deltas_to_rows(deltas)
+        }).execute()
+        self._cache.invalidate(athlete_id, 'activity_rollups')
+
+    def rebuild_rollups(self, athlete_id: str) -> None:
+        """Recompute every weekly and monthly rollup of an athlete from the stored activities"""
+        rows = self._scan_activities(athlete_id, activity_rollups.ACTIVITY_COLUMNS)
+        upserts, _ = activity_rollups.apply_deltas(athlete_id, [], activity_rollups.rollup_deltas(rows))
+        self.supabase.table('activity_rollups').delete().eq('athlete_id', athlete_id).execute()
+        self._upsert_rows('activity_rollups', upserts, on_conflict='athlete_id,period,period_start,sport_type')
+        self._cache.invalidate(athlete_id, 'activity_rollups')
+
+    def _fetch_rollups(self, athlete_id: str, period: str, since: Optional[str]) -> List[Dict]:
+        def load():
+            rows = []
+            while True:
+                query = self.supabase.table('activity_rollups') \
+                    .select('period_start,sport_type,count,distance,moving_time,elevation_gain') \
+                    .eq('athlete_id', athlete_id) \
+                    .eq('period', period) \
+                    .gt('count', 0)
+                if since:
+                    query = query.gte('period_start', since)
+                page = query.order('period_start').range(len(rows), len(rows) + SCAN_PAGE_SIZE - 1).execute().data or []
+                rows.extend(page)
+                if len(page) < SCAN_PAGE_SIZE:
+                    return rows
+        return self._cache.get_or_load(('activity_rollups', athlete_id, period, since), load)
+
+    def get_activity_rollups(self, athlete_id: str, period: str, since: Optional[str] = None) -> List[Dict]:
+        """
+        Get an athlete's activity totals per period and sport_type, oldest first.
+
+        Args:
+            athlete_id (str): The athlete.
+            period (str): activity_rollups.PERIOD_WEEK or PERIOD_MONTH.
+            since (str, optional): ISO date of the first period to include.
+
+        Returns:
+            list: Rows with period_start, sport_type, count, distance, moving_time and elevation_gain.
+        """
+        return self._fetch_rollups(athlete_id, period, since)
 
     def update_activity_coach(self, athlete_id: str, activity_id: str, coach_feedback:str) -> None:
         """Add an activity to user's history"""
@@ -127,16 +526,33 @@ class Storage:
                 },
                 on_conflict='athlete_id,activity_id'  # Specify the unique constraint
             ).execute()
-
-    def get_user_activities(self, athlete_id: str) -> List[Dict]:
-        """Get user's stored activities"""
-        result = self.supabase.table('activities') \
-            .select('*') \
-            .eq('athlete_id', athlete_id) \
-            .order('start_date_local', desc=True) \
-            .limit(20) \
-            .execute()
-        return result.data if result.data else []
+        self._cache.invalidate(athlete_id, 'activities')
+
+    def get_user_activities(self, athlete_id: str, limit: int = DASHBOARD_ACTIVITY_LIMIT) -> List[Dict]:
+        """Get user's most recent stored activities"""
+        return self._fetch_recent_activities(athlete_id, limit)
+
+    def get_activities_page(self, athlete_id: str, page_size: int = DASHBOARD_ACTIVITY_LIMIT,
+                            cursor: Optional[Tuple[str, str]] = None) -> Tuple[List[Dict], Optional[Tuple[str, str]]]:
+        """
+        Get one page of an athlete's activities, newest first, using keyset pagination.
+
+        Pages are ordered by (start_date_local, activity_id), so they stay consistent when
+        activities are added or removed between requests and each one costs an index range scan.
+
+        Args:
+            athlete_id (str): The athlete.
+            page_size (int): Number of activities per page.
+            cursor (tuple, optional): The next_cursor returned with the previous page, None for the first page.
+
+        Returns:
+            tuple: The activities of the page, and the cursor of the next page (None on the last page).
+        """
+        rows = self._fetch_activities_page(athlete_id, page_size, cursor)
+        if len(rows) <= page_size:
+            return rows, None
+        rows = rows[:page_size]
+        return rows, (rows[-1]['start_date_local'], rows[-1]['activity_id'])
 
     def update_athlete(self, athlete_data: Dict) -> None:
         """Update or create athlete profile"""
@@ -150,10 +566,12 @@ class Storage:
             'updated_at': datetime.now().isoformat(),
             'ref_code' : generate_user_identifier(athlete_data.get('firstname'), athlete_data.get('lastname'), athlete_data.get('id'))
         }).execute()
+        self._cache.invalidate(str(athlete_data['id']), 'athletes')
 
     def update_athlete_used_ref_code(self,athlete_id: str, used_ref_code: str) -> None:
         """Update or create athlete profile"""
         self.supabase.table('athletes').update({'used_ref_code': used_ref_code}).eq('athlete_id', athlete_id).execute()
+        self._cache.invalidate(athlete_id, 'athletes')
 
     def update_athlete_stats(self, athlete_id: str, stats: Dict) -> None:
         """Update athlete statistics with the new structure"""
@@ -188,26 +606,22 @@ class Storage:
                     'updated_at': datetime.now().isoformat()
                 })
 
-        # Update stats one by one to ensure proper upsert behavior
+        # Each (period, activity_type) appears once, so all rows fit in a single upsert
         if stats_to_update:
-            for stat in stats_to_update:
-                self.supabase.table('athlete_stats') \
-                    .upsert(stat, on_conflict='athlete_id,period,activity_type') \
-                    .execute()
+            self._upsert_rows('athlete_stats', stats_to_update, on_conflict='athlete_id,period,activity_type')
+            self._cache.invalidate(athlete_id, 'athlete_stats')
 
     def get_athlete_stats(self, athlete_id: str) -> Dict[str, Dict]:
         """Get athlete statistics organized by period and activity type"""
-        result = self.supabase.table('athlete_stats') \
-            .select('*') \
-            .eq('athlete_id', athlete_id) \
-            .execute()
+        return self._organize_stats(self._fetch_stats(athlete_id))
 
-        if not result.data:
+    def _organize_stats(self, rows: List[Dict]) -> Dict[str, Dict]:
+        """Organize athlete_stats rows by period and activity type"""
+        if not rows:
             return {}
 
-        # Organize stats by period and activity type
         organized_stats = {'all_time': {}, 'ytd': {}}
-        for stat in result.data:
+        for stat in rows:
             period = stat['period']
             activity_type = stat['activity_type']
             organized_stats[period][activity_type] = {
@@ -242,20 +656,26 @@ class Storage:
                 token_data,
                 on_conflict='athlete_id'
             ).execute()
+            self._cache.invalidate(athlete_id, 'strava_tokens')
 
         except Exception as e:
             print(f"Error saving tokens: {str(e)}")
 
-    def get_strava_tokens(self, athlete_id: str) -> Optional[Dict]:
-        """Get Strava tokens for an athlete"""
+    def get_strava_tokens(self, athlete_id: str, cached: bool = True) -> Optional[Dict]:
+        """Get Strava tokens for an athlete, read from the database rather than the cache when cached is False"""
         try:
-            result = self.supabase.table('strava_tokens') \
-                .select('*') \
-                .eq('athlete_id', athlete_id) \
-                .execute()
-
-            if result.data:
-                token_data = result.data[0]
+            if not cached:
+                self._cache.invalidate(athlete_id, 'strava_tokens')
+            rows = self._cache.get_or_load(
+                ('strava_tokens', athlete_id),
+                lambda: self.supabase.table('strava_tokens')
+                    .select('*')
+                    .eq('athlete_id', athlete_id)
+                    .execute().data or []
+            )
+
+            if rows:
+                token_data = rows[0]
                 print(f"Retrieved tokens for athlete {athlete_id}")
                 print(f"Expires at: {token_data.get('expires_at')}")
                 return token_data
@@ -270,3 +690,124 @@ class Storage:
     def update_user_credits(self, athlete_id: str, credits: int, used_credits: int) -> None:
         """Update the credits and used_credits for a specific user"""
         self.supabase.table('athletes').update({'credits': credits, 'used_credits': used_credits}).eq('athlete_id', athlete_id).execute()
+        self._cache.invalidate(athlete_id, 'athletes')
+
+    def reserve_credit(self, athlete_id: str) -> Optional[int]:
+        """
+        Take one credit from an athlete in a single server-side statement (see migrations/0004_credit_functions.sql).
+
+        Returns:
+            int: The credits left, or None if the athlete had none (nothing is changed then).
+        """
+        rows = self.supabase.rpc('reserve_credit', {'p_athlete_id': athlete_id}).execute().data or []
+        self._cache.invalidate(athlete_id, 'athletes')
+        return rows[0]['credits'] if rows else None
+
+    def has_credits(self, athlete_id: str) -> bool:
+        """Whether an athlete has at least one credit left, read from the database rather than the cache"""
+        rows = self.supabase.table('athletes') \
+            .select('credits') \
+            .eq('athlete_id', athlete_id) \
+            .execute().data or []
+        return bool(rows) and (rows[0].get('credits') or 0) > 0
+
+    def refund_credit(self, athlete_id: str) -> Optional[int]:
+        """Give back a credit taken by reserve_credit, returns the new balance (None for an unknown athlete)"""
+        rows = self.supabase.rpc('refund_credit', {'p_athlete_id': athlete_id}).execute().data or []
+        self._cache.invalidate(athlete_id, 'athletes')
+        return rows[0]['credits'] if rows else None
+
+    def get_sync_cursor(self, athlete_id: str) -> Optional[int]:
+        """Get the start time (epoch seconds) of the latest activity already ingested"""
+        result = self.supabase.table('activity_sync') \
+            .select('last_start_date') \
+            .eq('athlete_id', athlete_id) \
+            .execute()
+        return result.data[0]['last_start_date'] if result.data else None
+
+    def get_history_cursor(self, athlete_id: str) -> Optional[int]:
+        """Get the start time (epoch seconds) before which the athlete's history is still to be ingested, None once complete"""
+        result = self.supabase.table('activity_sync') \
+            .select('history_before') \
+            .eq('athlete_id', athlete_id) \
+            .execute()
+        return result.data[0]['history_before'] if result.data else None
+
+    def save_history_cursor(self, athlete_id: str, history_before: Optional[int]) -> None:
+        """Store how far back the history backfill got (None when it reached the first activity), after save_sync_cursor"""
+        self.supabase.table('activity_sync') \
+            .update({
+                'history_before': int(history_before) if history_before is not None else None,
+                'updated_at': datetime.now().isoformat()
+            }) \
+            .eq('athlete_id', athlete_id) \
+            .execute()
+
+    def save_sync_cursor(self, athlete_id: str, last_start_date: int) -> None:
+        """Store the activity sync high-water mark for an athlete"""
+        self.supabase.table('activity_sync').upsert(
+            {
+                'athlete_id': athlete_id,
+                'last_start_date': int(last_start_date),
+                'updated_at': datetime.now().isoformat()
+            },
+            on_conflict='athlete_id'
+        ).execute()
+
+    def save_coaching_job(self, job: Dict) -> None:
+        """Persist the state of a coaching job (one row per athlete and activity)"""
+        self.supabase.table('coaching_jobs').upsert(
+            {
+                'athlete_id': job['athlete_id'],
+                'activity_id': job['activity_id'],
+                'status': job['status'],
+                'error': job.get('error'),
+                'created_at': job['created_at'],
+                'updated_at': datetime.now().isoformat()
+            },
+            on_conflict='athlete_id,activity_id'
+        ).execute()
+
+    def claim_coaching_job(self, athlete_id: str, activity_id: str, stale_after: float) -> Optional[Dict]:
+        """
+        Atomically create or take over the coaching job of an activity (migrations/0003_claim_coaching_job.sql).
+
+        Args:
+            athlete_id (str): The athlete.
+            activity_id (str): The activity to analyse.
+            stale_after (float): Seconds after which a queued or running job is considered abandoned.
+
+        Returns:
+            dict: The claimed job row, or None if the job is queued, running or done elsewhere.
+        """
+        now = datetime.now()
+        rows = self.supabase.rpc('claim_coaching_job', {
+            'p_athlete_id': athlete_id,
+            'p_activity_id': str(activity_id),
+            'p_now': now.isoformat(),
+            'p_stale_before': (now - timedelta(seconds=stale_after)).isoformat()
+        }).execute().data or []
+        return rows[0] if rows else None
+
+    def get_coaching_job(self, athlete_id: str, activity_id: str) -> Optional[Dict]:
+        """Get the persisted state of a coaching job"""
+        result = self.supabase.table('coaching_jobs') \
+            .select('*') \
+            .eq('athlete_id', athlete_id) \
+            .eq('activity_id', activity_id) \
+            .execute()
+        return result.data[0] if result.data else None
+
+
+_storage: Optional[Storage] = None
+_storage_lock = threading.Lock()
+
+
+def get_storage() -> Storage:
+    """Return the process-wide Storage, so every module and session shares one pooled Supabase client"""
+    global _storage
+    if _storage is None:
+        with _storage_lock:
+            if _storage is None:
+                _storage = Storage()
+    return _storage
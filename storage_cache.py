@@ -0,0 +1,91 @@
+import copy
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Hashable, Optional
+
+# Seconds a cached read stays valid, per Supabase table
+CACHE_TTLS = {
+    'user_preferences': 600,
+    'athletes': 300,
+    'athlete_stats': 900,
+    'activities': 120,
+    'strava_tokens': 300,
+    'training_load': 300,
+    'activity_rollups': 300,
+}
+DEFAULT_TTL = 60
+CACHE_MAX_ENTRIES = 1024
+
+
+class ReadCache:
+    """
+    Bounded in-process LRU cache for Storage reads with per-table TTLs.
+
+    Keys are tuples starting with (table, athlete_id) so writers can invalidate every
+    cached read of a table for one athlete. Values are deep-copied on the way in and
+    out, callers can mutate what they get back without corrupting the cache.
+    """
+
+    def __init__(self, ttls: Optional[Dict[str, int]] = None, max_entries: int = CACHE_MAX_ENTRIES):
+        self.ttls = dict(CACHE_TTLS if ttls is None else ttls)
+        self.max_entries = max_entries
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+        self._table_counters: Dict[str, Dict[str, int]] = {}
+        # Bumped on invalidation so a load that raced with a write is not cached
+        self._generations: Dict[tuple, int] = {}
+
+    def _count(self, table: str, counter: str) -> None:
+        self._counters[counter] += 1
+        table_counters = self._table_counters.setdefault(table, {'hits': 0, 'misses': 0})
+        table_counters[counter] += 1
+
+    def get_or_load(self, key: tuple, loader: Callable):
+        """Return the cached value for key, calling loader on a miss or after the table TTL"""
+        table = key[0]
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > now:
+                self._entries.move_to_end(key)
+                self._count(table, 'hits')
+                return copy.deepcopy(entry[1])
+            self._count(table, 'misses')
+            generation = self._generations.get(key[:2], 0)
+
+        # Load outside the lock so slow queries do not serialize unrelated reads
+        value = loader()
+        with self._lock:
+            if self._generations.get(key[:2], 0) != generation:
+                return value
+            self._entries[key] = (now + self.ttls.get(table, DEFAULT_TTL), copy.deepcopy(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters['evictions'] += 1
+        return value
+
+    def invalidate(self, athlete_id: Hashable, *tables: str) -> None:
+        """Drop every cached read of the given tables for an athlete"""
+        with self._lock:
+            for table in tables:
+                self._generations[(table, athlete_id)] = self._generations.get((table, athlete_id), 0) + 1
+            stale = [key for key in self._entries if key[0] in tables and key[1] == athlete_id]
+            for key in stale:
+                del self._entries[key]
+            self._counters['invalidations'] += len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Hit/miss counters overall and per table, plus the current size"""
+        with self._lock:
+            return {
+                **self._counters,
+                'size': len(self._entries),
+                'tables': copy.deepcopy(self._table_counters)
+            }
@@ -1,23 +1,27 @@
-import requests
+import threading
 import urllib.parse
-import time
 import streamlit as st
-from storage import Storage
-
-storage = Storage()
-
-CLIENT_ID = st.secrets["strava_client_id"]
-CLIENT_SECRET = st.secrets["strava_client_secret"]
+from storage import get_storage
+from strava_client import get_client, PRIORITY_INTERACTIVE
+from token_cache import TokenCache
 
 # REDIRECT_URI = "http://localhost:8501"
 REDIRECT_URI = "https://wildstride.streamlit.app/"
 
+# Largest page size accepted by /athlete/activities
+STRAVA_MAX_PER_PAGE = 200
+
 def remove_character(text: str, char_to_remove: str) -> str:
     return text.replace(char_to_remove, "")
 
+def get_client_credentials() -> tuple:
+    """Strava application client ID and secret, read from the secrets when first needed"""
+    return st.secrets["strava_client_id"], st.secrets["strava_client_secret"]
+
 def get_strava_auth_url():
+    client_id, _ = get_client_credentials()
     params = {
-        "client_id": CLIENT_ID,
+        "client_id": client_id,
         "redirect_uri": REDIRECT_URI,
         "response_type": "code",
         "approval_prompt": "auto",
@@ -28,87 +32,119 @@ def get_strava_auth_url():
 @st.cache_data
 def get_token(code):
     """Exchange authorization code for access token"""
-    response = requests.post(
+    client_id, client_secret = get_client_credentials()
+    response = get_client().post(
         "https://www.strava.com/oauth/token",
         data={
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
+            "client_id": client_id,
+            "client_secret": client_secret,
             "code": code,
             "grant_type": "authorization_code"
         }
     )
     return response.json()
 
-@st.cache_data
-def get_activities(access_token):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get("https://www.strava.com/api/v3/athlete/activities", headers=headers)
+def get_activities(access_token, after=None, page=1, per_page=STRAVA_MAX_PER_PAGE, priority=PRIORITY_INTERACTIVE, before=None):
+    """
+    List the athlete's activities, optionally only those started after or before an epoch timestamp.
+
+    Strava returns them oldest first when `after` is set, newest first otherwise.
+    """
+    params = {"page": page, "per_page": per_page}
+    if after is not None:
+        params["after"] = int(after)
+    if before is not None:
+        params["before"] = int(before)
+    response = get_client().get("athlete/activities", access_token=access_token, params=params, priority=priority)
+    return response.json()
+
+def fetch_activity_details(access_token, activity_id, priority=PRIORITY_INTERACTIVE):
+    """Get the full payload of an activity, without Streamlit caching (safe to call from worker threads)"""
+    response = get_client().get(f"activities/{activity_id}", access_token=access_token, params={"include_all_efforts": "true"}, priority=priority)
     return response.json()
 
+def activity_exists(access_token, activity_id, priority=PRIORITY_INTERACTIVE):
+    """Whether Strava still has an activity: False only on a 404, None when the answer tells nothing (revoked token, errors)"""
+    response = get_client().get(f"activities/{activity_id}", access_token=access_token, priority=priority)
+    if response.status_code == 404:
+        return False
+    return True if response.ok else None
+
 @st.cache_data
-def get_activity_details(access_token, activity_id):
-    headers = {"Authorization": f"Bearer {access_token}"}
-    url=f"https://www.strava.com/api/v3/activities/{activity_id}?include_all_efforts=true"
-    response = requests.get(url, headers=headers)
+def get_activity_details(access_token, activity_id, priority=PRIORITY_INTERACTIVE):
+    return fetch_activity_details(access_token, activity_id, priority=priority)
+
+def fetch_activity_streams(access_token, activity_id, keys=None, priority=PRIORITY_INTERACTIVE):
+    """Get the sample streams of an activity keyed by type (not Streamlit-cached, they are cached on disk, see activity_streams)"""
+    if not keys:
+        # activity_streams loads numpy, only import it once streams are actually requested
+        from activity_streams import STREAM_TYPES
+        keys = STREAM_TYPES
+    response = get_client().get(
+        f"activities/{activity_id}/streams",
+        access_token=access_token,
+        params={"keys": ",".join(keys), "key_by_type": "true"},
+        priority=priority
+    )
     return response.json()
 
 @st.cache_data
 def get_athlete_details(access_token):
     """Get detailed information about the authenticated athlete"""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get("https://www.strava.com/api/v3/athlete", headers=headers)
+    response = get_client().get("athlete", access_token=access_token)
     return response.json()
 
 @st.cache_data
 def get_athlete_stats(access_token, athlete_id):
     """Get statistics about the authenticated athlete"""
-    headers = {"Authorization": f"Bearer {access_token}"}
-    response = requests.get(f"https://www.strava.com/api/v3/athletes/{athlete_id}/stats", headers=headers)
+    response = get_client().get(f"athletes/{athlete_id}/stats", access_token=access_token)
     return response.json()
 
 def refresh_token(refresh_token: str) -> dict:
     """Refresh the Strava access token"""
     print(f"Refreshing token...")
-    response = requests.post(
+    client_id, client_secret = get_client_credentials()
+    response = get_client().post(
         "https://www.strava.com/oauth/token",
         data={
-            "client_id": CLIENT_ID,
-            "client_secret": CLIENT_SECRET,
+            "client_id": client_id,
+            "client_secret": client_secret,
             "refresh_token": refresh_token,
             "grant_type": "refresh_token"
         }
     )
     return response.json()
 
-@st.cache_data
+_token_cache = None
+_token_cache_lock = threading.Lock()
+
+def get_token_cache() -> TokenCache:
+    """Return the process-wide token cache, built (with the storage client) on first use"""
+    global _token_cache
+    if _token_cache is None:
+        with _token_cache_lock:
+            if _token_cache is None:
+                storage = get_storage()
+                # TokenCache keeps the tokens in memory and reloads them only before a refresh, which must
+                # see tokens rotated by other processes
+                _token_cache = TokenCache(lambda athlete_id: storage.get_strava_tokens(athlete_id, cached=False),
+                                          refresh_token, storage.save_strava_tokens)
+    return _token_cache
+
+def store_tokens(athlete_id: str, tokens: dict) -> None:
+    """Persist tokens from the OAuth code exchange unless newer ones are already cached"""
+    get_token_cache().put(athlete_id, tokens)
+
 def get_valid_token(athlete_id: str = None) -> tuple:
     """Get a valid Strava access token, refreshing if necessary"""
     if not athlete_id:
         return None, None
 
-    # Try to get stored tokens
-    stored_tokens = storage.get_strava_tokens(athlete_id)
-    if not stored_tokens:
-        print("No stored tokens found")
-        return None, None
-
-    current_time = time.time()
-    expires_at = stored_tokens.get('expires_at')
-
-
-
-    # Check if token needs refresh (add 5 minute buffer)
-    if expires_at and expires_at < current_time + 300:
-        print("Token needs refresh")
-        # Refresh the token
-        new_tokens = refresh_token(stored_tokens['refresh_token'])
-        if 'access_token' in new_tokens:
-            print("Token refreshed successfully")
-            # Save new tokens
-            storage.save_strava_tokens(athlete_id, new_tokens)
-            return new_tokens['access_token'], athlete_id
-        print("Token refresh failed")
+    access_token = get_token_cache().get(athlete_id)
+    if not access_token:
         return None, None
+    return access_token, athlete_id
 
-    print("Using existing token")
-    return stored_tokens['access_token'], athlete_id
+def get_quota_usage() -> dict:
+    """Current Strava application quota usage as last reported by the API"""
+    return get_client().quota_usage()
@@ -0,0 +1,101 @@
+import asyncio
+from typing import Dict, Iterable
+from activities_parsing import extract_activity_summary, format_activity_for_prompt
+from strava_api import fetch_activity_streams
+from strava_client import get_client, StravaRateLimitError, PRIORITY_BACKGROUND
+
+# Number of activity detail requests in flight at once
+DEFAULT_CONCURRENCY = 8
+
+
+async def get_activity_details_async(access_token: str, activity_id, priority: int = PRIORITY_BACKGROUND) -> Dict:
+    """Fetch the full payload of an activity (splits, segment efforts) without blocking the event loop"""
+    # The pooled client and the scheduler are thread-safe, so requests run on the default executor
+    response = await asyncio.to_thread(
+        get_client().get,
+        f"activities/{activity_id}",
+        access_token=access_token,
+        params={"include_all_efforts": "true"},
+        priority=priority
+    )
+    return response.json()
+
+
+async def get_many_activity_details(access_token: str, activity_ids: Iterable, concurrency: int = DEFAULT_CONCURRENCY,
+                                    priority: int = PRIORITY_BACKGROUND) -> Dict[str, Dict]:
+    """
+    Fetch the full payloads of several activities in parallel.
+
+    Args:
+        access_token (str): The OAuth access token for the authenticated athlete.
+        activity_ids (Iterable): IDs of the activities to fetch.
+        concurrency (int): Maximum number of requests in flight.
+        priority (int): Scheduler priority, requests shed by the scheduler are skipped.
+
+    Returns:
+        dict: Activity payloads keyed by activity ID (as a string).
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(activity_id):
+        async with semaphore:
+            try:
+                return str(activity_id), await get_activity_details_async(access_token, activity_id, priority=priority)
+            except StravaRateLimitError as e:
+                print(f"Skipping details for activity {activity_id}: {e}")
+                return str(activity_id), None
+
+    results = await asyncio.gather(*(fetch(activity_id) for activity_id in activity_ids))
+    # Error payloads (not found, revoked token...) have no 'id'
+    return {activity_id: payload for activity_id, payload in results if payload and 'id' in payload}
+
+
+async def get_many_activity_streams(access_token: str, activity_ids: Iterable, concurrency: int = DEFAULT_CONCURRENCY,
+                                    priority: int = PRIORITY_BACKGROUND) -> Dict[str, Dict]:
+    """Fetch the sample streams of several activities in parallel, encoded for storage (see activity_streams.encode_streams)"""
+    # activity_streams loads numpy, only import it once streams are actually requested
+    from activity_streams import encode_streams, to_stream_arrays
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def fetch(activity_id):
+        async with semaphore:
+            try:
+                streams = await asyncio.to_thread(fetch_activity_streams, access_token, activity_id, priority=priority)
+            except StravaRateLimitError as e:
+                print(f"Skipping streams for activity {activity_id}: {e}")
+                return str(activity_id), None
+            # Error payloads are dicts without any stream, they give no arrays
+            arrays = to_stream_arrays(streams) if isinstance(streams, dict) else {}
+            return str(activity_id), encode_streams(arrays) if arrays else None
+
+    results = await asyncio.gather(*(fetch(activity_id) for activity_id in activity_ids))
+    return {activity_id: encoded for activity_id, encoded in results if encoded}
+
+
+async def backfill_activity_details_async(storage, access_token: str, athlete_id: str, activity_ids: Iterable,
+                                          concurrency: int = DEFAULT_CONCURRENCY, with_streams: bool = True) -> int:
+    """
+    Fetch, summarize and store the full payloads of several activities, returns how many were stored.
+
+    With `with_streams`, the sample streams of the activities whose payload was stored are
+    fetched and stored too.
+    """
+    details = await get_many_activity_details(access_token, activity_ids, concurrency=concurrency)
+    if details:
+        storage.add_activities(athlete_id, [
+            (activity, format_activity_for_prompt(extract_activity_summary(activity)))
+            for activity in details.values()
+        ])
+    if details and with_streams:
+        streams = await get_many_activity_streams(access_token, list(details), concurrency=concurrency)
+        for activity_id, encoded in streams.items():
+            storage.save_activity_streams(athlete_id, activity_id, encoded)
+    return len(details)
+
+
+def backfill_activity_details(storage, access_token: str, athlete_id: str, activity_ids: Iterable,
+                              concurrency: int = DEFAULT_CONCURRENCY, with_streams: bool = True) -> int:
+    """Synchronous entry point for backfill_activity_details_async (Streamlit scripts have no event loop)"""
+    return asyncio.run(backfill_activity_details_async(storage, access_token, athlete_id, activity_ids, concurrency=concurrency,
+                                                       with_streams=with_streams))
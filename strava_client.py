@@ -0,0 +1,309 @@
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, Optional
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from tracing import endpoint_name, span
+
+STRAVA_API_URL = "https://www.strava.com/api/v3"
+
+# (connect, read) timeouts in seconds
+DEFAULT_TIMEOUT = (5, 30)
+MAX_RETRIES = 3
+# Methods that can be replayed after a server error without side effects
+IDEMPOTENT_METHODS = {"GET", "PUT", "DELETE"}
+
+# Request priorities: user-triggered calls (e.g. the Analyse button) go before backfills
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BACKGROUND = 1
+# Default time a request may sit in the queue before being shed, per priority
+MAX_QUEUE_WAIT = {PRIORITY_INTERACTIVE: 30.0, PRIORITY_BACKGROUND: 0.0}
+# Share of each window background requests may use, the rest is kept for interactive ones
+BACKGROUND_SHARE = 0.8
+# Strava defaults for an application: overall and read-only (GET) limits as (15min, daily)
+DEFAULT_LIMITS = {'overall': (200, 2000), 'read': (100, 1000)}
+
+
+class StravaRateLimitError(Exception):
+    """Raised when the Strava rate limit is exhausted for longer than we are willing to wait"""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class StravaBudgetExceeded(StravaRateLimitError):
+    """Raised when the scheduler sheds a request because the app-wide budget is spent"""
+
+
+def _parse_rate_header(value: Optional[str]) -> Optional[tuple]:
+    """Parse a '15min,daily' rate limit header into a tuple of ints"""
+    if not value:
+        return None
+    try:
+        short, daily = value.split(",")[:2]
+        return int(short), int(daily)
+    except ValueError:
+        return None
+
+
+def _seconds_until_window_reset(now: float) -> float:
+    """Strava's short window resets on the quarter hour (:00, :15, :30, :45)"""
+    return 900 - (now % 900)
+
+
+def _seconds_until_daily_reset(now: float) -> float:
+    """Strava's daily window resets at midnight UTC"""
+    return 86400 - (now % 86400)
+
+
+class RequestScheduler:
+    """
+    App-wide token buckets for the Strava 15-minute and daily quotas.
+
+    Buckets refill on Strava's own window boundaries and are kept in sync with the
+    usage Strava reports, so they also account for calls made by other workers.
+    Interactive requests may use the full budget and are served before any waiting
+    background request; background requests stop at BACKGROUND_SHARE of each window.
+    """
+
+    def __init__(self, limits: Optional[Dict[str, tuple]] = None, background_share: float = BACKGROUND_SHARE):
+        self.limits = dict(limits or DEFAULT_LIMITS)
+        self.background_share = background_share
+        self.used = {bucket: [0, 0] for bucket in self.limits}
+        self._window = (None, None)
+        self._waiting_interactive = 0
+        self._cond = threading.Condition()
+
+    def _roll_windows(self, now: float) -> None:
+        """Refill the buckets whose window has reset"""
+        short_window, daily_window = int(now // 900), int(now // 86400)
+        if short_window != self._window[0]:
+            for used in self.used.values():
+                used[0] = 0
+        if daily_window != self._window[1]:
+            for used in self.used.values():
+                used[1] = 0
+        self._window = (short_window, daily_window)
+
+    def _buckets(self, method: str) -> list:
+        return ['overall', 'read'] if method == "GET" else ['overall']
+
+    def _has_budget(self, buckets: list, priority: int) -> bool:
+        share = 1.0 if priority == PRIORITY_INTERACTIVE else self.background_share
+        for bucket in buckets:
+            for used, limit in zip(self.used[bucket], self.limits[bucket]):
+                if used >= int(limit * share):
+                    return False
+        return True
+
+    def _seconds_until_refill(self, buckets: list, priority: int, now: float) -> float:
+        share = 1.0 if priority == PRIORITY_INTERACTIVE else self.background_share
+        if any(self.used[bucket][1] >= int(self.limits[bucket][1] * share) for bucket in buckets):
+            return _seconds_until_daily_reset(now)
+        return _seconds_until_window_reset(now)
+
+    def acquire(self, method: str = "GET", priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None) -> None:
+        """
+        Take one request from the budget, queueing until the window refills if needed.
+
+        Raises:
+            StravaBudgetExceeded: If the budget does not refill within max_wait.
+        """
+        if max_wait is None:
+            max_wait = MAX_QUEUE_WAIT[priority]
+        buckets = self._buckets(method)
+        deadline = time.time() + max_wait
+        with self._cond:
+            if priority == PRIORITY_INTERACTIVE:
+                self._waiting_interactive += 1
+            try:
+                while True:
+                    now = time.time()
+                    self._roll_windows(now)
+                    # Background requests yield to any interactive request already waiting
+                    if self._has_budget(buckets, priority) and (priority == PRIORITY_INTERACTIVE or self._waiting_interactive == 0):
+                        for bucket in buckets:
+                            self.used[bucket][0] += 1
+                            self.used[bucket][1] += 1
+                        return
+                    refill_in = self._seconds_until_refill(buckets, priority, now)
+                    if now + refill_in > deadline:
+                        raise StravaBudgetExceeded(f"Strava request budget exhausted, retry in {refill_in:.0f}s", retry_after=refill_in)
+                    self._cond.wait(refill_in)
+            finally:
+                if priority == PRIORITY_INTERACTIVE:
+                    self._waiting_interactive -= 1
+                    self._cond.notify_all()
+
+    def observe(self, bucket: str, limit: tuple, usage: tuple) -> None:
+        """Align a bucket with the limits and usage reported by Strava"""
+        with self._cond:
+            self._roll_windows(time.time())
+            self.limits[bucket] = limit
+            self.used[bucket] = [max(local, remote) for local, remote in zip(self.used[bucket], usage)]
+
+    def mark_exhausted(self) -> None:
+        """Block the current short window after Strava answered 429"""
+        with self._cond:
+            self._roll_windows(time.time())
+            for bucket, used in self.used.items():
+                used[0] = max(used[0], self.limits[bucket][0])
+
+    def budget(self) -> Dict:
+        """Remaining requests per bucket as (15min, daily)"""
+        with self._cond:
+            self._roll_windows(time.time())
+            return {
+                bucket: tuple(max(limit - used, 0) for used, limit in zip(self.used[bucket], self.limits[bucket]))
+                for bucket in self.limits
+            }
+
+
+class StravaClient:
+    """Shared HTTP client for the Strava API with connection pooling, timeouts and rate-limit aware retries"""
+
+    def __init__(self, pool_size: int = 10, timeout=DEFAULT_TIMEOUT, max_retries: int = MAX_RETRIES,
+                 scheduler: Optional[RequestScheduler] = None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.scheduler = scheduler or RequestScheduler()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self._lock = threading.Lock()
+        self._usage = {
+            'limit_15min': None,
+            'usage_15min': None,
+            'limit_daily': None,
+            'usage_daily': None,
+            'read_limit_15min': None,
+            'read_usage_15min': None,
+            'read_limit_daily': None,
+            'read_usage_daily': None,
+            'updated_at': None
+        }
+
+    def _record_rate_limits(self, response: requests.Response) -> None:
+        """Keep the latest quota figures reported by Strava"""
+        headers = response.headers
+        values = {
+            '': (_parse_rate_header(headers.get("X-RateLimit-Limit")),
+                 _parse_rate_header(headers.get("X-RateLimit-Usage"))),
+            'read_': (_parse_rate_header(headers.get("X-ReadRateLimit-Limit")),
+                      _parse_rate_header(headers.get("X-ReadRateLimit-Usage")))
+        }
+        with self._lock:
+            for prefix, (limit, usage) in values.items():
+                if limit and usage:
+                    self._usage[f'{prefix}limit_15min'], self._usage[f'{prefix}limit_daily'] = limit
+                    self._usage[f'{prefix}usage_15min'], self._usage[f'{prefix}usage_daily'] = usage
+                    self._usage['updated_at'] = datetime.now(timezone.utc).isoformat()
+        for prefix, (limit, usage) in values.items():
+            if limit and usage:
+                self.scheduler.observe('read' if prefix else 'overall', limit, usage)
+
+    def quota_usage(self) -> Dict:
+        """Return the last known application quota usage reported by Strava and the scheduler's remaining budget"""
+        with self._lock:
+            usage = dict(self._usage)
+        usage['remaining'] = self.scheduler.budget()
+        return usage
+
+    def _backoff_delay(self, attempt: int) -> float:
+        """Exponential backoff with jitter for transient failures"""
+        return (2 ** attempt) * 0.5 + random.uniform(0, 0.5)
+
+    def request(self, method: str, url: str, access_token: Optional[str] = None,
+                priority: int = PRIORITY_INTERACTIVE, max_wait: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        Send a request to Strava through the scheduler, retrying on rate limiting and transient failures.
+
+        Args:
+            method (str): HTTP method.
+            url (str): Absolute URL or a path relative to the v3 API.
+            access_token (str, optional): OAuth token sent as a Bearer header.
+            priority (int): PRIORITY_INTERACTIVE or PRIORITY_BACKGROUND.
+            max_wait (float, optional): Longest time to queue for budget, defaults to MAX_QUEUE_WAIT.
+
+        Returns:
+            requests.Response: The final response (non-retryable errors are returned as is).
+
+        Raises:
+            StravaRateLimitError: If the budget is spent (StravaBudgetExceeded) or Strava keeps answering 429.
+        """
+        method = method.upper()
+        if not url.startswith("http"):
+            url = f"{STRAVA_API_URL}/{url.lstrip('/')}"
+        headers = dict(kwargs.pop("headers", None) or {})
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
+        kwargs.setdefault("timeout", self.timeout)
+
+        operation = f"{method} {endpoint_name(urlparse(url).path.removeprefix('/api/v3'))}"
+        with span('strava', operation, priority=priority) as tags:
+            response = self._send(method, url, headers, priority, max_wait, tags, **kwargs)
+            tags['status'] = response.status_code
+            return response
+
+    def _send(self, method: str, url: str, headers: Dict, priority: int, max_wait: Optional[float], tags: Dict,
+              **kwargs) -> requests.Response:
+        attempt = 0
+        tags['queued_ms'] = 0.0
+        while True:
+            tags['attempts'] = attempt + 1
+            queued_at = time.perf_counter()
+            self.scheduler.acquire(method, priority=priority, max_wait=max_wait)
+            tags['queued_ms'] += round((time.perf_counter() - queued_at) * 1000, 3)
+            try:
+                response = self.session.request(method, url, headers=headers, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if method not in IDEMPOTENT_METHODS or attempt >= self.max_retries:
+                    raise
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            self._record_rate_limits(response)
+
+            if response.status_code == 429:
+                # A rejected request had no effect, so it is safe to replay for any method once
+                # the scheduler has budget again (or to shed it if that takes too long)
+                self.scheduler.mark_exhausted()
+                if attempt >= self.max_retries:
+                    raise StravaRateLimitError("Strava rate limit exceeded", retry_after=_seconds_until_window_reset(time.time()))
+                attempt += 1
+                continue
+
+            if response.status_code >= 500 and method in IDEMPOTENT_METHODS and attempt < self.max_retries:
+                time.sleep(self._backoff_delay(attempt))
+                attempt += 1
+                continue
+
+            return response
+
+    def get(self, url: str, access_token: Optional[str] = None, **kwargs) -> requests.Response:
+        return self.request("GET", url, access_token=access_token, **kwargs)
+
+    def post(self, url: str, access_token: Optional[str] = None, **kwargs) -> requests.Response:
+        return self.request("POST", url, access_token=access_token, **kwargs)
+
+    def put(self, url: str, access_token: Optional[str] = None, **kwargs) -> requests.Response:
+        return self.request("PUT", url, access_token=access_token, **kwargs)
+
+
+_client: Optional[StravaClient] = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> StravaClient:
+    """Return the process-wide Strava client"""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = StravaClient()
+    return _client
@@ -1,13 +1,17 @@
+import functools
 import streamlit as st
 import requests
 import urllib.parse
 import time
-from activities_parsing import extract_activity_summary,format_activity_for_prompt, update_activity_by_id,post_activity_comment, generate_user_identifier
-from strava_api import get_token, get_athlete_details, get_athlete_stats, get_activities, get_valid_token,get_strava_auth_url, get_activity_details,remove_character
-from llm import generate_content
-from storage import Storage
-import pandas as pd
-import altair as alt
+from activities_parsing import generate_user_identifier
+from strava_api import get_token, get_athlete_details, get_athlete_stats, get_valid_token, store_tokens,get_strava_auth_url
+from strava_client import StravaRateLimitError
+from activity_sync import sync_activities
+from jobs import get_job_queue, JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED, JOB_POLL_INTERVAL
+from storage import get_storage, DASHBOARD_ROLLUP_WEEKS
+from training_load import current_form
+from activity_rollups import totals_by_sport, period_floor, PERIOD_MONTH, PERIOD_WEEK
+from tracing import configure as configure_tracing, current_trace_id, finish_trace, set_trace_athlete, start_trace, tracer
 
 st.set_page_config(
    page_title="WildStride - AI Coach",
@@ -16,8 +20,9 @@ st.set_page_config(
    initial_sidebar_state="expanded",
 )
 
-# Initialize storage
-storage = Storage()
+# Every outbound call of this run is tagged with the trace ID (and the athlete once logged in)
+start_trace(athlete_id=st.session_state.get('athlete_id'))
+configure_tracing(st.secrets.get("trace_log_path"))
 
 # Replace with your own Strava API credentials
 # CLIENT_ID = st.secrets["strava_client_id"]
@@ -38,12 +43,103 @@ if 'used_credits' not in st.session_state:
     st.session_state.used_credits = 0
 if 'is_coached' not in st.session_state:
     st.session_state.is_coached = {}
+# Number of activity history pages shown, increased by "Load more"
+if 'history_pages' not in st.session_state:
+    st.session_state.history_pages = 1
+# Coaching jobs that finished while their card was polling, by activity ID
+if 'finished_analyses' not in st.session_state:
+    st.session_state.finished_analyses = {}
 
 
-query_params = st.query_params
-code = query_params.get("code", None)
+def trace_fragment_reruns(operation: str):
+    """
+    Trace the reruns of a fragment as their own render.
 
-if code :
+    During a full run the fragment belongs to the page trace; a fragment-only rerun starts
+    with no open trace (finish_trace closes it), so it gets one named after the fragment.
+    """
+    def decorate(func):
+        @functools.wraps(func)
+        def run(*args, **kwargs):
+            if current_trace_id() is not None:
+                return func(*args, **kwargs)
+            start_trace(athlete_id=st.session_state.get('athlete_id'))
+            try:
+                return func(*args, **kwargs)
+            finally:
+                finish_trace('app', f"fragment {operation}")
+        return run
+    return decorate
+
+
+def show_coach_feedback(coach_feedback):
+    with st.popover("See my analysis"):
+        st.write(coach_feedback)
+
+
+def start_analysis(athlete_id, activity_id):
+    """Queue the coaching of an activity if the athlete has credits left, returns whether it was queued"""
+    storage = get_storage()
+    # Read at click time (cached), the credits and goals may have changed since the last full run
+    if storage.get_athlete_info(athlete_id).get('credits', 3) <= 0:
+        st.error("Not enough credits")
+        return False
+    # The analysis runs on the worker pool, the card polls its progress
+    get_job_queue().enqueue_analysis(athlete_id, activity_id, storage.get_user_preferences(athlete_id))
+    return True
+
+
+@st.fragment(run_every=JOB_POLL_INTERVAL)
+@trace_fragment_reruns('analysis_job')
+def show_analysis_job(athlete_id, activity_id):
+    """
+    Poll a coaching job and render its feedback as it is generated.
+
+    A finished job is rendered in place rather than by rerunning the page, which would redraw
+    every card and chart; the sidebar credits catch up on the next full run. It is kept in the
+    session so the polls that follow do not read the job again.
+    """
+    finished = st.session_state.finished_analyses.get(activity_id)
+    job = finished or get_job_queue().get_status(athlete_id, activity_id)
+    if job is None:
+        return
+    if job['status'] == JOB_QUEUED:
+        st.info("Analyse queued...")
+    elif job['status'] == JOB_RUNNING:
+        st.write(job.get('partial_text') or "Analyse in progress...")
+    elif job['status'] == JOB_FAILED:
+        st.session_state.finished_analyses[activity_id] = job
+        st.error(f"Analyse failed: {job['error']}")
+        if st.button('Retry', key=f"retry_{activity_id}"):
+            st.session_state.finished_analyses.pop(activity_id, None)
+            if start_analysis(athlete_id, activity_id):
+                st.info("Analyse queued...")
+    else:
+        st.session_state.finished_analyses[activity_id] = job
+        st.success("✅ Analysis ready")
+        show_coach_feedback(job['result'])
+
+
+def load_more_history():
+    st.session_state.history_pages += 1
+
+
+def show_trace_panel():
+    """Sidebar debug panel with the outbound calls of this run and the per-endpoint totals of the process"""
+    with st.sidebar.expander("🔍 Latency debug"):
+        spans = tracer.spans(current_trace_id())
+        st.caption(f"Trace {current_trace_id()}: {len(spans)} calls, {sum(span['duration_ms'] for span in spans):.0f} ms")
+        st.dataframe(
+            [{'service': span['service'], 'operation': span['operation'], 'ms': span['duration_ms'], 'error': span['error']}
+             for span in spans],
+            hide_index=True
+        )
+        st.caption("All runs of this process")
+        st.dataframe(tracer.summary(), hide_index=True)
+
+
+@st.fragment
+def show_help():
     if st.button("💡 How to use WildStride?"):
         st.write("WildStride is a platform that uses AI to help you become a better runner. It uses your Strava data to provide you with personalized coaching advice.")
         st.write("To use WildStride, you need to connect your Strava account to the app.")
@@ -54,7 +150,388 @@ if code :
         st.write("You can also gain credits by completing the onboarding process.")
 
 
+def show_stat_metrics(stats):
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Activities", f"{stats['total_activities']}",  border=True)
+    with col2:
+        st.metric("Distance", f"{stats['total_distance']/1000:.1f} km",  border=True)
+    with col3:
+        st.metric("Elevation", f"{stats['total_elevation']:.0f} m",  border=True)
+
+
+def get_athlete_profile(access_token, athlete_id):
+    """
+    Get the athlete details and stats from Strava.
+
+    When the Strava request budget is exhausted, the page degrades to the profile stored at a
+    previous login instead of failing.
+
+    Returns:
+        tuple: The athlete details, and the Strava stats (None when served from storage).
+    """
+    try:
+        return get_athlete_details(access_token), get_athlete_stats(access_token, athlete_id)
+    except StravaRateLimitError as e:
+        print(f"Showing the stored profile of athlete {athlete_id}: {e}")
+        athlete_info = get_storage().get_athlete_info(athlete_id)
+        athlete = {key: athlete_info.get(key) or '' for key in ('firstname', 'lastname', 'city', 'country')}
+        athlete['profile'] = athlete_info.get('profile_url')
+        return athlete, None
+
+
+@st.fragment
+@trace_fragment_reruns('profile')
+def show_profile_header(access_token, athlete_id):
+    """Athlete profile, year-to-date and all-time stats, and training load"""
+    storage = get_storage()
+    athlete, _ = get_athlete_profile(access_token, athlete_id)
+
+    # Display athlete profile
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        if athlete.get('profile'):
+            st.image(athlete['profile'], width=300)
+    with col2:
+        st.subheader(f"👋 Welcome, {athlete.get('firstname', '')} {athlete.get('lastname', '')}")
+        st.write(f"📍 {athlete.get('city', '')}, {athlete.get('country', '')}")
+
+        # Display athlete stats (stored at login)
+    stats = storage.get_athlete_stats(athlete_id)
+    if stats:
+        # Year-to-date Stats
+        st.subheader("📊 Your Year-to-Date Stats:")
+        ytd_stats = stats.get('ytd', {})
+
+        # Running stats
+        if 'run' in ytd_stats:
+            st.write("🏃‍♂️ Running:")
+            show_stat_metrics(ytd_stats['run'])
+
+        # Cycling stats
+        if 'ride' in ytd_stats:
+            st.write("🚴‍♂️ Cycling:")
+            show_stat_metrics(ytd_stats['ride'])
+
+        # All-time Stats in an expander
+        st.subheader("📈 View All-Time Stats")
+        all_time_stats = stats.get('all_time', {})
+
+            # Running all-time stats
+        if 'run' in all_time_stats:
+            st.write("🏃‍♂️ Running:")
+            show_stat_metrics(all_time_stats['run'])
+
+        # Cycling all-time stats
+        if 'ride' in all_time_stats:
+            st.write("🚴‍♂️ Cycling:")
+            show_stat_metrics(all_time_stats['ride'])
+
+    # Fitness/fatigue state maintained on ingest, only decayed to today here
+    form = current_form(storage.get_training_load(athlete_id))
+    if form:
+        st.subheader("🔋 Training Load")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.metric("Fitness (CTL)", f"{form['ctl']:.0f}", border=True)
+        with col2:
+            st.metric("Fatigue (ATL)", f"{form['atl']:.0f}", border=True)
+        with col3:
+            st.metric("Form (TSB)", f"{form['tsb']:+.0f}", border=True)
+
+
+@st.fragment
+@trace_fragment_reruns('account')
+def show_account(athlete_id, athlete):
+    """Sidebar credits and referral codes (call inside `with st.sidebar`)"""
+    storage = get_storage()
+    athletes_info = storage.get_athlete_info(athlete_id)
+
+    # Display available credits in the sidebar
+    credits = athletes_info.get('credits', 3)
+    used_credits = athletes_info.get('used_credits', 0)
+
+    #define state
+    st.session_state.credits = credits
+    st.session_state.used_credits = used_credits
+
+    sidebar_img = "https://i.imgur.com/dUXI1Tp.jpeg"
+    st.image(sidebar_img, use_container_width=True)
+    st.subheader("💳 Available Credits")
+    def_color = "green" if credits > 0 else "red"
+    st.write(f":{def_color}-background[You have {st.session_state.credits} credits available.]")
+    st.write(f":blue-background[You have used {st.session_state.used_credits} credits so far!]")
+
+    # Add message about gaining new credits
+    st.info("To gain new credits and to progress with AI coach, contact us at contact.wildstride@gmail.com or recommend the app to a friend to get free credits.")
+    print(f"athlete infos >>> : {athletes_info}")
+    used_ref_code = athletes_info.get('used_ref_code', 'empty')
+
+    if used_ref_code == 'empty':
+        ref_code_input = st.text_input('Type a friend referral code')
+        if 'ref_code_submitted' not in st.session_state:
+            st.session_state.ref_code_submitted = False
+        if not st.session_state.ref_code_submitted:
+            if st.button('Submit Code'):
+                if ref_code_input:
+                    storage.update_athlete_used_ref_code(athlete_id=athlete_id, used_ref_code=ref_code_input)
+                    st.session_state.ref_code_submitted = True
+                    st.success('Referral code submitted successfully!')
+                    st.write(f':green-background[Referral Code Used: {ref_code_input}]')
+    else:
+        st.write(f':green-background[Referral Code Used: {used_ref_code}]')
+
+    st.write(f":green-background[Your referral code is :  {generate_user_identifier(athlete.get('firstname'), athlete.get('lastname'), athlete.get('id'))}]")
+
+
+@st.fragment
+@trace_fragment_reruns('goals')
+def show_goals_form(athlete_id):
+    """Sidebar training goals form (call inside `with st.sidebar`), each input only reruns this form"""
+    storage = get_storage()
+    preferences = storage.get_user_preferences(athlete_id)
+
+    if 'sport_type' not in st.session_state:
+        st.session_state.sport_type = preferences.get('sport_type', 'Run')
+    if 'target_distance' not in st.session_state:
+        st.session_state.target_distance = preferences.get('target_distance', 100)
+    if 'target_elevation' not in st.session_state:
+        st.session_state.target_elevation = preferences.get('target_elevation', 50)
+    if 'hours' not in st.session_state:
+        st.session_state.hours = preferences.get('target_time_hours', 1)
+    if 'minutes' not in st.session_state:
+        st.session_state.minutes = preferences.get('target_time_minutes', 0)
+    if 'seconds' not in st.session_state:
+        st.session_state.seconds = preferences.get('target_time_seconds', 0)
+    if 'target_date' not in st.session_state:
+        st.session_state.target_date = preferences.get('target_date', None)
+
+    # User preferences section in the sidebar
+    st.subheader("🎯 Your Training Goals")
+
+    goal_wording = ""
+    if(len(preferences) == 0):
+        goal_wording = "Set my goal!"
+        st.subheader("Set your objective below!")
+        st.subheader("Our AI coach will help you achieve your goals.")
+    else :
+        st.subheader("✅ Your objective is setted")
+        goal_wording = "Update my goal!"
+    # Allow user to choose sport type
+    st.session_state.sport_type = st.selectbox(
+        "Select Sport Type",
+        ["Run", "Trail", "Bike"],
+        index=["Run", "Trail", "Bike"].index(st.session_state.sport_type)
+    )
+
+    # Allow user to set new goals
+    st.session_state.target_distance = st.number_input(
+        "Target Race Distance (km)",
+        value=st.session_state.target_distance,
+        min_value=1
+    )
+    st.session_state.target_elevation = st.number_input(
+        "Target Race Elevation (m)",
+        value=st.session_state.target_elevation,
+        min_value=0
+    )
+
+    # Add target time inputs
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.session_state.hours = st.number_input(
+            "Hours",
+            value=st.session_state.hours,
+            min_value=0,
+            max_value=24
+        )
+    with col2:
+        st.session_state.minutes = st.number_input(
+            "Minutes",
+            value=st.session_state.minutes,
+            min_value=0,
+            max_value=59
+        )
+    with col3:
+        st.session_state.seconds = st.number_input(
+            "Seconds",
+            value=st.session_state.seconds,
+            min_value=0,
+            max_value=59
+        )
+
+    # Calculate target pace
+    if st.session_state.target_distance > 0:
+        equivalent_distance_from_elevation = st.session_state.target_elevation / 100.0
+
+        # Adjust total distance
+        adjusted_distance = st.session_state.target_distance + equivalent_distance_from_elevation
+
+        total_seconds = (st.session_state.hours * 3600) + (st.session_state.minutes * 60) + st.session_state.seconds
+        pace_seconds_per_km = total_seconds / adjusted_distance
+        pace_minutes = int(pace_seconds_per_km // 60)
+        pace_seconds = int(pace_seconds_per_km % 60)
+
+    st.session_state.target_date = st.date_input(
+        "Target Race Date",
+        value=st.session_state.target_date
+    )
+
+    if st.button(goal_wording):
+        with st.spinner("Loading..."):
+            time.sleep(2)
+        storage.update_user_preferences(athlete_id, {
+            'sport_type': st.session_state.sport_type,
+            'target_distance': st.session_state.target_distance,
+            'target_elevation': st.session_state.target_elevation,
+            'target_date': st.session_state.target_date.isoformat() if st.session_state.target_date else None,
+            'target_time_hours': st.session_state.hours,
+            'target_time_minutes': st.session_state.minutes,
+            'target_time_seconds': st.session_state.seconds
+        })
+        st.success("✅ Goals saved!")
+
+
+@st.fragment
+@trace_fragment_reruns('activity_card')
+def show_activity_card(athlete_id, past_activity):
+    """One activity of the history, an "Analyse!" click only reruns this card"""
+    activity_id = str(past_activity['activity_id'])
+    activity_type = past_activity.get('sport_type', 'Unknown')
+    if activity_type == 'Run':
+        color = 'green'
+    elif activity_type == 'TrailRun':
+        color = 'blue'
+    elif activity_type == 'Swim':
+        color = 'cyan'
+    elif activity_type == 'HighIntensityIntervalTraining':
+        activity_type = 'HIIT'
+        color = 'red'
+    elif activity_type == 'Tennis':
+        color = 'gray'
+    else:
+        color = 'purple'
+    st.markdown(
+        f"""
+        <div style='
+            display: inline-block;
+            background-color: white;
+            color: {color};
+            padding: 5px 10px;
+            border-radius: 15px;
+            font-weight: bold;
+        '>
+            {activity_type}
+        </div>
+        """,
+        unsafe_allow_html=True
+    )
+    st.write(f"**{past_activity['name']}** - {past_activity['start_date_local'][:10]}")
+    st.write(f"Distance: {past_activity['distance']/1000:.2f} km")
+    st.write(f"Duration: {past_activity['moving_time']/60:.0f} min")
+    st.write(f"Elevation: {past_activity['total_elevation_gain']:.0f} m")
+    if past_activity['is_coached'] == False:
+        st.write(":red-background[You have not yet received a coaching for this activity!]")
+        # Coaching job of this activity running (or finished) in this process
+        job = get_job_queue().get_status(athlete_id, activity_id, include_persisted=False)
+        if job and job['status'] in (JOB_QUEUED, JOB_RUNNING):
+            show_analysis_job(athlete_id, activity_id)
+        elif job and job['status'] == JOB_DONE:
+            show_coach_feedback(job['result'])
+        else:
+            if job and job['status'] == JOB_FAILED:
+                st.error(f"Analyse failed: {job['error']}")
+            if st.button('Analyse!', key=f"analyze_{activity_id}"):
+                st.session_state.finished_analyses.pop(activity_id, None)
+                if start_analysis(athlete_id, activity_id):
+                    show_analysis_job(athlete_id, activity_id)
+    else :
+        show_coach_feedback(past_activity['coach_feedback'])
+
+    st.markdown("---")  # Add a horizontal line for separation
+
+
+@st.fragment
+@trace_fragment_reruns('history')
+def show_activity_history(athlete_id):
+    """Activity cards, "Load more activities" only reruns the history"""
+    storage = get_storage()
+    history, next_cursor = storage.get_activities_page(athlete_id)
+    # Older pages requested with "Load more" (cached reads), the first paint only renders the first page
+    for _ in range(st.session_state.history_pages - 1):
+        if next_cursor is None:
+            break
+        page, next_cursor = storage.get_activities_page(athlete_id, cursor=next_cursor)
+        history = history + page
+
+    # Display activities in columns
+    cols = st.columns(4, border=True)
+    for index, past_activity in enumerate(history):
+        with cols[index % 4]:
+            show_activity_card(athlete_id, past_activity)
+
+    if next_cursor is not None:
+        st.button("Load more activities", on_click=load_more_history)
+
+
+@st.fragment
+@trace_fragment_reruns('charts')
+def show_activity_charts(athlete_id):
+    """Activity type repartition and weekly evolution charts"""
+    # pandas and altair take ~0.5 s to import, only dashboards with charts load them
+    import altair as alt
+    import pandas as pd
+
+    storage = get_storage()
+    # Charts read the materialized rollups, so they cover the full history at a fixed row count
+    monthly_rollups = storage.get_activity_rollups(athlete_id, PERIOD_MONTH)
+    if monthly_rollups:
+        st.subheader("Activity Type Repartition")
+        activity_type_counts = pd.DataFrame(
+            [(sport_type, totals['count']) for sport_type, totals in totals_by_sport(monthly_rollups).items()],
+            columns=['Activity Type', 'Count']
+        )
+        pie_chart = alt.Chart(activity_type_counts).mark_arc().encode(
+            theta=alt.Theta(field="Count", type="quantitative"),
+            color=alt.Color(field="Activity Type", type="nominal"),
+            tooltip=['Activity Type', 'Count']
+        )
+        st.altair_chart(pie_chart, use_container_width=True)
+
+    weekly_rollups = storage.get_activity_rollups(athlete_id, PERIOD_WEEK, period_floor(PERIOD_WEEK, DASHBOARD_ROLLUP_WEEKS))
+    if weekly_rollups:
+        # Evolution of Distance, Duration, and Elevation
+        st.subheader("Evolution of Distance, Duration, and Elevation")
+        df = pd.DataFrame(weekly_rollups).groupby('period_start', as_index=False)[['distance', 'moving_time', 'elevation_gain']].sum()
+        df['Distance (km)'] = df['distance'] / 1000
+        df['Duration (h)'] = df['moving_time'] / 3600
+        df['Elevation (m)'] = df['elevation_gain']
+
+        # One row per metric with its own scale, elevation would flatten the other lines
+        long_df = df.melt(id_vars='period_start', value_vars=['Distance (km)', 'Duration (h)', 'Elevation (m)'],
+                          var_name='Metric', value_name='Value')
+        line_chart = alt.Chart(long_df).mark_line(point=True).encode(
+            x=alt.X('period_start:T', title='Week'),
+            y='Value:Q',
+            color='Metric:N',
+            tooltip=['period_start:T', 'Metric:N', 'Value:Q']
+        ).properties(height=150).facet(
+            row='Metric:N'
+        ).resolve_scale(y='independent')
+        st.altair_chart(line_chart, use_container_width=True)
+
+
+query_params = st.query_params
+code = query_params.get("code", None)
+
+if code :
+    show_help()
+
+
 if code:
+    # Storage (and its database client) is only built once someone logs in, the landing page does not need it
+    storage = get_storage()
+
     # Initial token exchange
     token_data = get_token(code)
     access_token = token_data.get("access_token")
@@ -62,239 +539,51 @@ if code:
 
 
     if (access_token and athlete_id)  or (st.session_state.athlete_id is not None and st.session_state.access_token is not None):
-        # Store tokens
-        storage.save_strava_tokens(athlete_id, token_data)
+        # Store tokens (only once, reruns reuse the cached exchange result)
+        store_tokens(athlete_id, token_data)
         st.session_state.athlete_id = athlete_id
         st.session_state.access_token = access_token
+        set_trace_athlete(athlete_id)
         st.success("✅ Logged in to Strava!")
 
         # Get athlete details and stats
-        athlete = get_athlete_details(access_token)
-        athlete_stats = get_athlete_stats(access_token, athlete_id)
+        athlete, athlete_stats = get_athlete_profile(access_token, athlete_id)
 
-        # Update athlete data only if not already updated
-        if not st.session_state.athlete_updated:
+        # Update athlete data only if not already updated (and not while Strava is out of budget)
+        if not st.session_state.athlete_updated and athlete_stats is not None:
             storage.update_athlete(athlete)
             storage.update_athlete_stats(athlete_id, athlete_stats)
             st.session_state.athlete_updated = True
 
-        # Display athlete profile
-        col1, col2 = st.columns([1, 3])
-        with col1:
-            if athlete.get('profile'):
-                st.image(athlete['profile'], width=300)
-        with col2:
-            st.subheader(f"👋 Welcome, {athlete.get('firstname', '')} {athlete.get('lastname', '')}")
-            st.write(f"📍 {athlete.get('city', '')}, {athlete.get('country', '')}")
-
-            # Display athlete stats
-        if athlete_stats:
-            # Year-to-date Stats
-            st.subheader("📊 Your Year-to-Date Stats:")
-            ytd_stats = storage.get_athlete_stats(athlete_id).get('ytd', {})
-
-            # Running stats
-            if 'run' in ytd_stats:
-                st.write("🏃‍♂️ Running:")
-                run_stats = ytd_stats['run']
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Activities", f"{run_stats['total_activities']}",  border=True)
-                with col2:
-                    st.metric("Distance", f"{run_stats['total_distance']/1000:.1f} km",  border=True)
-                with col3:
-                    st.metric("Elevation", f"{run_stats['total_elevation']:.0f} m",  border=True)
-
-            # Cycling stats
-            if 'ride' in ytd_stats:
-                st.write("🚴‍♂️ Cycling:")
-                ride_stats = ytd_stats['ride']
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Activities", f"{ride_stats['total_activities']}",  border=True)
-                with col2:
-                    st.metric("Distance", f"{ride_stats['total_distance']/1000:.1f} km",  border=True)
-                with col3:
-                    st.metric("Elevation", f"{ride_stats['total_elevation']:.0f} m",  border=True)
-
-            # All-time Stats in an expander
-            st.subheader("📈 View All-Time Stats")
-            all_time_stats = storage.get_athlete_stats(athlete_id).get('all_time', {})
-
-                # Running all-time stats
-            if 'run' in all_time_stats:
-                st.write("🏃‍♂️ Running:")
-                run_stats = all_time_stats['run']
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Activities", f"{run_stats['total_activities']}",  border=True)
-                with col2:
-                    st.metric("Distance", f"{run_stats['total_distance']/1000:.1f} km",  border=True)
-                with col3:
-                    st.metric("Elevation", f"{run_stats['total_elevation']:.0f} m",  border=True)
-
-            # Cycling all-time stats
-            if 'ride' in all_time_stats:
-                st.write("🚴‍♂️ Cycling:")
-                ride_stats = all_time_stats['ride']
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.metric("Activities", f"{ride_stats['total_activities']}",  border=True)
-                with col2:
-                    st.metric("Distance", f"{ride_stats['total_distance']/1000:.1f} km",  border=True)
-                with col3:
-                    st.metric("Elevation", f"{ride_stats['total_elevation']:.0f} m",  border=True)
+        # Ingest new activities before reading, so the snapshot below includes them
+        sync_token, _ = get_valid_token(athlete_id)
+        if sync_token:
+            # Only activities newer than the stored cursor are fetched and ingested
+            sync_activities(storage, sync_token, athlete_id)
+
+        # Everything the page renders from Supabase in one parallel round trip. This warms the read
+        # cache the fragments below read their own section from, on this run and on their own reruns
+        # (widget interactions inside a fragment only rerun that fragment, not the sync above).
+        dashboard = storage.load_dashboard(athlete_id)
+
+        show_profile_header(access_token, athlete_id)
 
         # Get or initialize user data
-        user_data = storage.get_user_data(athlete_id) or {}
-        preferences = user_data.get('preferences', {})
-        athletes_info = user_data.get('athletes_info', {})
-
-        # Display available credits in the sidebar
-        credits = athletes_info.get('credits', 3)
-        used_credits = athletes_info.get('used_credits', 0)
-
-        #define state
-        st.session_state.credits = credits
-        st.session_state.used_credits = used_credits
-
-        sidebar_img = "https://i.imgur.com/dUXI1Tp.jpeg"
-        st.sidebar.image(sidebar_img, use_container_width=True)
-        st.sidebar.subheader("💳 Available Credits")
-        def_color = "green" if credits > 0 else "red"
-        st.sidebar.write(f":{def_color}-background[You have {st.session_state.credits} credits available.]")
-        st.sidebar.write(f":blue-background[You have used {st.session_state.used_credits} credits so far!]")
-
-        # Add message about gaining new credits
-        st.sidebar.info("To gain new credits and to progress with AI coach, contact us at contact.wildstride@gmail.com or recommend the app to a friend to get free credits.")
-        print(f"athlete infos >>> : {athletes_info}")
-        used_ref_code = athletes_info.get('used_ref_code', 'empty')
-
-        if used_ref_code == 'empty':
-            ref_code_input = st.sidebar.text_input('Type a friend referral code')
-            if 'ref_code_submitted' not in st.session_state:
-                st.session_state.ref_code_submitted = False
-            if not st.session_state.ref_code_submitted:
-                if st.sidebar.button('Submit Code'):
-                    if ref_code_input:
-                        storage.update_athlete_used_ref_code(athlete_id=athlete_id, used_ref_code=ref_code_input)
-                        st.session_state.ref_code_submitted = True
-                        st.sidebar.success('Referral code submitted successfully!')
-                        st.sidebar.write(f':green-background[Referral Code Used: {ref_code_input}]')
-        else:
-            st.sidebar.write(f':green-background[Referral Code Used: {used_ref_code}]')
+        preferences = dashboard['preferences']
+        credits = dashboard['athletes_info'].get('credits', 3)
 
-        st.sidebar.write(f":green-background[Your referral code is :  {generate_user_identifier(athlete.get('firstname'), athlete.get('lastname'), athlete.get('id'))}]", border=True)
+        with st.sidebar:
+            show_account(athlete_id, athlete)
         # Ensure token is valid before updating goals
         access_token, athlete_id = get_valid_token(athlete_id)
 
         if access_token and athlete_id:
-    # Query user preferences from the database
-            user_data = storage.get_user_data(athlete_id) or {}
+    # User preferences come from the dashboard snapshot
             if preferences not in st.session_state:
-                 st.session_state.preferences = user_data.get('preferences', {})
-
-            # User preferences section in the sidebar
-
-            if 'sport_type' not in st.session_state:
-                st.session_state.sport_type = preferences.get('sport_type', 'Run')
-            if 'target_distance' not in st.session_state:
-                st.session_state.target_distance = preferences.get('target_distance', 100)
-            if 'target_elevation' not in st.session_state:
-                st.session_state.target_elevation = preferences.get('target_elevation', 50)
-            if 'hours' not in st.session_state:
-                st.session_state.hours = preferences.get('target_time_hours', 1)
-            if 'minutes' not in st.session_state:
-                st.session_state.minutes = preferences.get('target_time_minutes', 0)
-            if 'seconds' not in st.session_state:
-                st.session_state.seconds = preferences.get('target_time_seconds', 0)
-            if 'target_date' not in st.session_state:
-                st.session_state.target_date = preferences.get('target_date', None)
-
-            # User preferences section in the sidebar
-            st.sidebar.subheader("🎯 Your Training Goals")
-
-            goal_wording = ""
-            if(len(st.session_state.preferences) == 0):
-                goal_wording = "Set my goal!"
-                st.sidebar.subheader("Set your objective below!")
-                st.sidebar.subheader("Our AI coach will help you achieve your goals.")
-            else :
-                st.sidebar.subheader("✅ Your objective is setted")
-                goal_wording = "Update my goal!"
-            # Allow user to choose sport type
-            st.session_state.sport_type = st.sidebar.selectbox(
-                "Select Sport Type",
-                ["Run", "Trail", "Bike"],
-                index=["Run", "Trail", "Bike"].index(st.session_state.sport_type)
-            )
-
-            # Allow user to set new goals
-            st.session_state.target_distance = st.sidebar.number_input(
-                "Target Race Distance (km)",
-                value=st.session_state.target_distance,
-                min_value=1
-            )
-            st.session_state.target_elevation = st.sidebar.number_input(
-                "Target Race Elevation (m)",
-                value=st.session_state.target_elevation,
-                min_value=0
-            )
-
-            # Add target time inputs
-            col1, col2, col3 = st.sidebar.columns(3)
-            with col1:
-                st.session_state.hours = st.number_input(
-                    "Hours",
-                    value=st.session_state.hours,
-                    min_value=0,
-                    max_value=24
-                )
-            with col2:
-                st.session_state.minutes = st.number_input(
-                    "Minutes",
-                    value=st.session_state.minutes,
-                    min_value=0,
-                    max_value=59
-                )
-            with col3:
-                st.session_state.seconds = st.number_input(
-                    "Seconds",
-                    value=st.session_state.seconds,
-                    min_value=0,
-                    max_value=59
-                )
-
-            # Calculate target pace
-            if st.session_state.target_distance > 0:
-                equivalent_distance_from_elevation = st.session_state.target_elevation / 100.0
-
-                # Adjust total distance
-                adjusted_distance = st.session_state.target_distance + equivalent_distance_from_elevation
-
-                total_seconds = (st.session_state.hours * 3600) + (st.session_state.minutes * 60) + st.session_state.seconds
-                pace_seconds_per_km = total_seconds / adjusted_distance
-                pace_minutes = int(pace_seconds_per_km // 60)
-                pace_seconds = int(pace_seconds_per_km % 60)
-
-            st.session_state.target_date = st.sidebar.date_input(
-                "Target Race Date",
-                value=st.session_state.target_date
-            )
-
-            if st.sidebar.button(goal_wording):
-                with st.spinner("Loading..."):
-                    time.sleep(2)
-                storage.update_user_preferences(athlete_id, {
-                    'sport_type': st.session_state.sport_type,
-                    'target_distance': st.session_state.target_distance,
-                    'target_elevation': st.session_state.target_elevation,
-                    'target_date': st.session_state.target_date.isoformat() if st.session_state.target_date else None,
-                    'target_time_hours': st.session_state.hours,
-                    'target_time_minutes': st.session_state.minutes,
-                    'target_time_seconds': st.session_state.seconds
-                })
-                st.sidebar.success("✅ Goals saved!")
+                 st.session_state.preferences = dashboard['preferences']
+
+            with st.sidebar:
+                show_goals_form(athlete_id)
         else:
             st.error("❌ Failed to retrieve access token 1.")
 
@@ -308,125 +597,9 @@ if code:
 
         # Show activity history
         st.subheader("📊 Activity History")
-        activities = get_activities(access_token)
-        history_activities = storage.get_user_activities(athlete_id)
-
-        stored_activity_ids = {activity['activity_id'] for activity in history_activities}
-
-# Iterate over retrieved activities
-        for activity in activities:
-            activity_id = str(activity['id'])  # Ensure activity_id is a string
-            if activity_id not in stored_activity_ids:
-                # New activity, add to the database
-                summary = extract_activity_summary(activity)
-                str_summary = format_activity_for_prompt(summary)
-                storage.add_activity(athlete_id, activity, str_summary)
-            else:
-                # Existing activity, update if necessary
-                # You can add logic here to update the activity if needed
-                pass
-        history = storage.get_user_activities(athlete_id)
-        if  history:
-            # Convert history to a DataFrame for easier manipulation
-            df = pd.DataFrame(history)
-
-            # Display activities in columns
-            cols = st.columns(4, border=True)
-            for index, past_activity in enumerate(history):
-                with cols[index % 4]:
-                    activity_type = past_activity.get('sport_type', 'Unknown')
-                    if activity_type == 'Run':
-                        color = 'green'
-                    elif activity_type == 'TrailRun':
-                        color = 'blue'
-                    elif activity_type == 'Swim':
-                        color = 'cyan'
-                    elif activity_type == 'HighIntensityIntervalTraining':
-                        activity_type = 'HIIT'
-                        color = 'red'
-                    elif activity_type == 'Tennis':
-                        color = 'gray'
-                    else:
-                        color = 'purple'
-                    st.markdown(
-                        f"""
-                        <div style='
-                            display: inline-block;
-                            background-color: white;
-                            color: {color};
-                            padding: 5px 10px;
-                            border-radius: 15px;
-                            font-weight: bold;
-                        '>
-                            {activity_type}
-                        </div>
-                        """,
-                        unsafe_allow_html=True
-                    )
-                    st.write(f"**{past_activity['name']}** - {past_activity['start_date_local'][:10]}")
-                    st.write(f"Distance: {past_activity['distance']/1000:.2f} km")
-                    st.write(f"Duration: {past_activity['moving_time']/60:.0f} min")
-                    st.write(f"Elevation: {past_activity['total_elevation_gain']:.0f} m")
-                    # storage.add_activity(athlete_id, activity_detail,str_summary)
-                    if past_activity['is_coached'] == False:
-                        st.write(":red-background[You have not yet received a coaching for this activity!]")
-                        if st.button('Analyse!', key=f"analyze_{index}"):
-                            if credits > 0:
-                                #storage.update_activity_coaching(athlete_id, past_activity['id'], True)
-                                activity_detail = get_activity_details(access_token, past_activity['activity_id'])
-                                summary = extract_activity_summary(activity_detail)
-                                str_summary = format_activity_for_prompt(summary)
-
-                                print(f"str_summary : {str_summary}")
-                                coach_feedback = generate_content(input_text=str_summary,athlete_id=athlete_id,prompt=str(preferences),activity_id=past_activity['activity_id'])
-                                with st.spinner("Analyse in progress...",show_time=True):
-                                    time.sleep(3)
-                                coach_feedback = remove_character(coach_feedback,'###')
-                                coach_feedback = remove_character(coach_feedback,'**')
-                                st.session_state.credits -=1
-                                st.session_state.used_credits += 1
-                                st.session_state.is_coached = True
-                                update_activity_by_id(access_token=access_token,activity_id=past_activity['activity_id'],description=coach_feedback + " \n\n\n 💪Powered by WildStride💪")
-                                st.success(f"Analyse done!")
-                                with st.popover("See my analysis"):
-                                    st.write(coach_feedback)
-
-                            else:
-                                st.error("Not enough credits")
-                    else :
-                        with st.popover("See my analysis"):
-                            st.write(past_activity['coach_feedback'])
-
-                    st.markdown("---")  # Add a horizontal line for separation
-
-            st.subheader("Activity Type Repartition")
-            activity_type_counts = df['sport_type'].value_counts().reset_index()
-            activity_type_counts.columns = ['Activity Type', 'Count']
-            pie_chart = alt.Chart(activity_type_counts).mark_arc().encode(
-                theta=alt.Theta(field="Count", type="quantitative"),
-                color=alt.Color(field="Activity Type", type="nominal"),
-                tooltip=['Activity Type', 'Count']
-            )
-            st.altair_chart(pie_chart, use_container_width=True)
-
-            # Evolution of Distance, Duration, and Elevation
-            st.subheader("Evolution of Distance, Duration, and Elevation")
-            df['start_date_local'] = pd.to_datetime(df['start_date_local'])
-            df = df.sort_values('start_date_local')
-            df['Distance (m)'] = df['distance'] / 100
-            df['Duration (min)'] = df['moving_time'] / 60
-            df['Elevation (m)'] = df['total_elevation_gain']
-
-            line_chart = alt.Chart(df).transform_fold(
-                ['Distance (m)', 'Duration (min)', 'Elevation (m)'],
-                as_=['Metric', 'Value']
-            ).mark_line().encode(
-                x='date:T',
-                y='Value:Q',
-                color='Metric:N',
-                tooltip=['date:T', 'Metric:N', 'Value:Q']
-            )
-            st.altair_chart(line_chart, use_container_width=True)
+        if dashboard['activities']:
+            show_activity_history(athlete_id)
+            show_activity_charts(athlete_id)
 
         else:
             st.error("❌ Failed to retrieve access token 2.")
@@ -495,3 +668,10 @@ else:
     st.markdown(button_html, unsafe_allow_html=True)
     st.write("Made with ❤️ by Jettz, engineering runner")
     st.write("Contact us at contact.wildstride@gmail.com")
+
+
+if st.secrets.get("trace_debug_panel", False) or st.query_params.get("debug") == "1":
+    show_trace_panel()
+finish_trace()
+if st.secrets.get("trace_prometheus_path"):
+    tracer.write_prometheus(st.secrets["trace_prometheus_path"])
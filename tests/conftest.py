@@ -0,0 +1,33 @@
+import os
+import sys
+import tempfile
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark_fakes import FakeStravaAdapter, install_fake_strava, use_offline_secrets
+
+# st.secrets is read on first use, point it at the offline (SQLite) values before any app module does
+use_offline_secrets(tempfile.mkdtemp(prefix="wildstride-tests-"))
+
+
+@pytest.fixture
+def sqlite_client(tmp_path):
+    from sqlite_backend import SQLiteClient
+
+    client = SQLiteClient(str(tmp_path / "wildstride.sqlite3"))
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def storage(sqlite_client):
+    from storage import Storage
+
+    return Storage(sqlite_client)
+
+
+@pytest.fixture
+def fake_strava():
+    """Route the shared Strava client to a fresh FakeStravaAdapter"""
+    return install_fake_strava(FakeStravaAdapter(activity_count=30))
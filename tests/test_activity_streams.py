@@ -0,0 +1,45 @@
+import os
+import numpy as np
+from activity_streams import StreamCache
+
+
+def arrays(samples=1000):
+    return {'time': np.arange(samples, dtype=np.int32), 'heartrate': np.full(samples, 150, dtype=np.int16)}
+
+
+def test_cache_round_trips_streams(tmp_path):
+    cache = StreamCache(str(tmp_path))
+    cache.put('1', 10, arrays())
+
+    streams = cache.get('1', 10)
+    assert sorted(streams.keys()) == ['heartrate', 'time']
+    assert np.array_equal(streams['time'], arrays()['time'])
+    assert cache.get('1', 11) is None
+
+
+def test_cache_evicts_least_recently_used_activities(tmp_path):
+    cache = StreamCache(str(tmp_path))
+    cache.put('1', 1, arrays())
+    cache.max_bytes = 3 * cache.size()
+    cache.put('1', 2, arrays())
+    cache.put('1', 3, arrays())
+    cache.get('1', 1)
+    cache.put('1', 4, arrays())
+
+    assert cache.get('1', 2) is None
+    assert all(cache.get('1', activity_id) is not None for activity_id in (1, 3, 4))
+    assert cache.size() <= cache.max_bytes
+
+
+def test_cache_size_survives_a_restart(tmp_path):
+    first = StreamCache(str(tmp_path))
+    for activity_id in range(3):
+        first.put('1', activity_id, arrays())
+    os.utime(os.path.join(str(tmp_path), '1', '0'), (1, 1))
+
+    restarted = StreamCache(str(tmp_path), max_bytes=first.size())
+    restarted.put('2', 0, arrays())
+
+    assert restarted.get('1', 0) is None
+    assert restarted.get('2', 0) is not None
+    assert restarted.size() <= restarted.max_bytes
@@ -0,0 +1,64 @@
+import pytest
+import strava_client
+from activity_sync import sync_activities
+from strava_client import RequestScheduler
+
+ATHLETE_ID = 7
+
+
+@pytest.fixture
+def busy_scheduler(monkeypatch, fake_strava):
+    """App-wide budget past the background share: only interactive requests are served"""
+    scheduler = RequestScheduler(limits={'overall': (100, 1000), 'read': (100, 1000)})
+    for bucket in ('overall', 'read'):
+        scheduler.observe(bucket, (100, 1000), (90, 90))
+    # The fake reports a large quota, keep the local one
+    monkeypatch.setattr(scheduler, 'observe', lambda *args: None)
+    monkeypatch.setattr(strava_client.get_client(), 'scheduler', scheduler)
+    return scheduler
+
+
+def stored_ids(storage, athlete_id):
+    rows = storage.supabase.table('activities').select('activity_id').eq('athlete_id', athlete_id).execute().data
+    return {row['activity_id'] for row in rows}
+
+
+def test_first_sync_fetches_the_newest_page_when_the_budget_is_low(storage, fake_strava, busy_scheduler):
+    ingested = sync_activities(storage, f"token-{ATHLETE_ID}", str(ATHLETE_ID), per_page=10, detail_count=0)
+
+    # Page 1 is interactive, the older (background) pages are shed until the budget refills
+    newest = fake_strava.athlete_activities(ATHLETE_ID)[-10:]
+    assert ingested == 10
+    assert stored_ids(storage, str(ATHLETE_ID)) == {str(activity['id']) for activity in newest}
+    assert storage.get_sync_cursor(str(ATHLETE_ID)) is not None
+    assert storage.get_history_cursor(str(ATHLETE_ID)) is not None
+
+
+def test_history_is_backfilled_backwards_across_syncs(storage, fake_strava):
+    athlete_id = str(ATHLETE_ID)
+    assert sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, per_page=10, max_pages=2, detail_count=0) == 20
+    assert sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, per_page=10, detail_count=0) == 10
+
+    assert stored_ids(storage, athlete_id) == {str(activity['id']) for activity in fake_strava.athlete_activities(ATHLETE_ID)}
+    assert storage.get_history_cursor(athlete_id) is None
+    assert sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, per_page=10, detail_count=0) == 0
+
+
+def test_interrupted_first_sync_backfills_details_later(storage, fake_strava):
+    athlete_id = str(ATHLETE_ID)
+    # The first sync stopped before fetching any detail
+    sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, detail_count=0)
+    assert len(storage.get_activity_ids_without_details(athlete_id, 5)) == 5
+
+    assert sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, detail_count=5) == 0
+    assert storage.get_activity_ids_without_details(athlete_id, 5) == []
+    assert len(storage.get_activity_ids_without_details(athlete_id, 30)) == 25
+
+
+def test_sync_stores_the_streams_of_the_most_recent_activities(storage, fake_strava):
+    athlete_id = str(ATHLETE_ID)
+    sync_activities(storage, f"token-{ATHLETE_ID}", athlete_id, detail_count=3)
+
+    activities = fake_strava.athlete_activities(ATHLETE_ID)
+    assert storage.get_activity_streams(athlete_id, activities[-1]['id'])['sample_count'] > 0
+    assert storage.get_activity_streams(athlete_id, activities[-4]['id']) is None
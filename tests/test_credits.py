@@ -0,0 +1,64 @@
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import llm
+from llm_cache import ResponseCache
+
+
+@pytest.fixture
+def athlete(storage):
+    storage.update_athlete({'id': 12, 'firstname': 'Ada', 'lastname': 'Runner'})
+    storage.update_user_credits('12', credits=3, used_credits=0)
+    return '12'
+
+
+def test_reserve_until_no_credit_is_left(storage, athlete):
+    assert [storage.reserve_credit(athlete) for _ in range(4)] == [2, 1, 0, None]
+    info = storage.get_athlete_info(athlete)
+    assert (info['credits'], info['used_credits']) == (0, 3)
+    assert not storage.has_credits(athlete)
+
+
+def test_refund_gives_the_credit_back(storage, athlete):
+    storage.reserve_credit(athlete)
+    assert storage.refund_credit(athlete) == 3
+    assert storage.get_athlete_info(athlete)['used_credits'] == 0
+    assert storage.refund_credit('unknown') is None
+
+
+def test_concurrent_reservations_never_overspend(storage, athlete):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(lambda _: storage.reserve_credit(athlete), range(10)))
+
+    assert sorted(r for r in results if r is not None) == [0, 1, 2]
+    assert storage.get_athlete_info(athlete)['credits'] == 0
+
+
+@pytest.fixture
+def cached_llm(monkeypatch, tmp_path, storage):
+    """Serve every prompt from a response cache holding one answer, the OpenAI client must not be used"""
+    cache = ResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    cache.put('key', 'cached feedback')
+    monkeypatch.setattr(llm, 'get_storage', lambda: storage)
+    monkeypatch.setattr(llm, 'get_response_cache', lambda: cache)
+    monkeypatch.setattr(llm, 'response_cache_key', lambda *args: 'key')
+    monkeypatch.setattr(llm, 'get_openai_client', lambda: pytest.fail("the cache should answer"))
+
+
+def generate(athlete_id, charge_on_cache_hit):
+    return llm.generate_content('activity data', athlete_id, 'goal', 'a', charge_on_cache_hit=charge_on_cache_hit)
+
+
+def test_free_cache_hit_keeps_the_credits(storage, athlete, cached_llm):
+    assert generate(athlete, charge_on_cache_hit=False) == 'cached feedback'
+    assert storage.get_athlete_info(athlete)['credits'] == 3
+
+
+def test_free_cache_hit_still_needs_a_credit(storage, athlete, cached_llm):
+    storage.update_user_credits(athlete, credits=0, used_credits=3)
+    with pytest.raises(ValueError):
+        generate(athlete, charge_on_cache_hit=False)
+
+
+def test_charged_cache_hit_takes_a_credit(storage, athlete, cached_llm):
+    generate(athlete, charge_on_cache_hit=True)
+    assert storage.get_athlete_info(athlete)['credits'] == 2
@@ -0,0 +1,84 @@
+import threading
+from datetime import datetime, timedelta
+import pytest
+import jobs
+from jobs import JOB_DONE, JOB_FAILED, JOB_QUEUED, JOB_RUNNING, JobQueue
+
+
+@pytest.fixture
+def runs(monkeypatch):
+    """Replace the analysis with one that only records its run and finishes"""
+    started = []
+    finished = threading.Event()
+
+    def analyze(self, job, preferences):
+        started.append((job['athlete_id'], job['activity_id']))
+        self._update(job, status=JOB_DONE, result='feedback')
+        finished.set()
+
+    monkeypatch.setattr(JobQueue, '_analyze', analyze)
+    return started, finished
+
+
+def test_claim_is_exclusive_until_the_job_fails(storage):
+    assert storage.claim_coaching_job('1', 'a', stale_after=900)['status'] == JOB_QUEUED
+    assert storage.claim_coaching_job('1', 'a', stale_after=900) is None
+
+    job = storage.get_coaching_job('1', 'a')
+    storage.save_coaching_job(dict(job, status=JOB_FAILED, error='boom'))
+    assert storage.claim_coaching_job('1', 'a', stale_after=900)['error'] is None
+
+    storage.save_coaching_job(dict(job, status=JOB_DONE))
+    assert storage.claim_coaching_job('1', 'a', stale_after=900) is None
+
+
+def test_abandoned_running_job_can_be_claimed(storage):
+    long_ago = (datetime.now() - timedelta(hours=1)).isoformat()
+    storage.supabase.table('coaching_jobs').upsert({
+        'athlete_id': '1', 'activity_id': 'a', 'status': JOB_RUNNING, 'created_at': long_ago, 'updated_at': long_ago
+    }).execute()
+
+    assert storage.claim_coaching_job('1', 'a', stale_after=3600 * 2) is None
+    assert storage.claim_coaching_job('1', 'a', stale_after=60) is not None
+
+
+def test_a_second_process_does_not_rerun_a_job(storage, runs):
+    started, finished = runs
+    first, second = JobQueue(storage), JobQueue(storage)
+
+    first.enqueue_analysis('1', 'a', {})
+    assert finished.wait(5)
+    job = second.enqueue_analysis('1', 'a', {})
+
+    assert job['status'] == JOB_DONE
+    assert started == [('1', 'a')]
+
+
+def test_concurrent_enqueues_run_the_job_once(storage, runs):
+    started, _ = runs
+    queues = [JobQueue(storage) for _ in range(4)]
+    threads = [threading.Thread(target=queue.enqueue_analysis, args=('1', 'a', {})) for queue in queues]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for queue in queues:
+        queue._executor.shutdown(wait=True)
+
+    assert started == [('1', 'a')]
+
+
+def test_finished_jobs_are_evicted_after_the_ttl(storage, runs, monkeypatch):
+    _, finished = runs
+    queue = JobQueue(storage, finished_ttl=60)
+    queue.enqueue_analysis('1', 'a', {})
+    assert finished.wait(5)
+    assert queue.get_status('1', 'a', include_persisted=False)['status'] == JOB_DONE
+
+    now = jobs.time.monotonic()
+    monkeypatch.setattr(jobs.time, 'monotonic', lambda: now + 61)
+    queue.enqueue_analysis('1', 'b', {})
+    queue._executor.shutdown(wait=True)
+
+    assert queue.get_status('1', 'a', include_persisted=False) is None
+    assert queue.get_status('1', 'a')['status'] == JOB_DONE
@@ -0,0 +1,104 @@
+from types import SimpleNamespace
+import pytest
+import llm
+from benchmark_fakes import FakeOpenAI
+from llm_cache import ResponseCache
+
+
+class FailingOpenAI(FakeOpenAI):
+    """Streams a few fragments, then the connection drops"""
+
+    def _stream(self, text, usage):
+        yield SimpleNamespace(type="response.output_text.delta", delta="Pacing ")
+        yield SimpleNamespace(type="response.output_text.delta", delta="was ")
+        raise ConnectionError("stream interrupted")
+
+
+@pytest.fixture
+def athlete(storage):
+    storage.update_athlete({'id': 12, 'firstname': 'Ada', 'lastname': 'Runner'})
+    storage.update_user_credits('12', credits=3, used_credits=0)
+    return '12'
+
+
+@pytest.fixture
+def cache(monkeypatch, tmp_path, storage):
+    cache = ResponseCache(str(tmp_path / "llm_cache.sqlite3"))
+    monkeypatch.setattr(llm, 'get_storage', lambda: storage)
+    monkeypatch.setattr(llm, 'get_response_cache', lambda: cache)
+    return cache
+
+
+def use_openai(monkeypatch, fake):
+    monkeypatch.setattr(llm, 'get_openai_client', lambda: fake)
+    return fake
+
+
+def stream(athlete_id, **kwargs):
+    return llm.generate_content_stream('activity data', athlete_id, 'goal', 'a', **kwargs)
+
+
+def credits(storage, athlete_id):
+    return storage.get_athlete_info(athlete_id)['credits']
+
+
+def coach_feedback(storage, athlete_id):
+    rows = storage.supabase.table('activities').select('coach_feedback').eq('athlete_id', athlete_id).execute().data
+    return rows[0]['coach_feedback'] if rows else None
+
+
+def test_completed_stream_is_charged_cached_and_stored(monkeypatch, storage, athlete, cache):
+    use_openai(monkeypatch, FakeOpenAI(words=5))
+
+    text = "".join(stream(athlete))
+
+    assert text == "word0 word1 word2 word3 word4 "
+    assert credits(storage, athlete) == 2
+    assert coach_feedback(storage, athlete) == text
+    assert cache.stats()['size'] == 1
+
+
+def test_failure_mid_stream_refunds_the_credit(monkeypatch, storage, athlete, cache):
+    use_openai(monkeypatch, FailingOpenAI())
+    received = []
+
+    with pytest.raises(ConnectionError):
+        for fragment in stream(athlete):
+            received.append(fragment)
+
+    assert received == ["Pacing ", "was "]
+    assert credits(storage, athlete) == 3
+    assert coach_feedback(storage, athlete) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_abandoned_stream_stays_charged_and_stores_nothing(monkeypatch, storage, athlete, cache):
+    use_openai(monkeypatch, FakeOpenAI(words=5))
+
+    fragments = stream(athlete)
+    next(fragments)
+    fragments.close()
+
+    assert credits(storage, athlete) == 2
+    assert coach_feedback(storage, athlete) is None
+    assert cache.stats()['size'] == 0
+
+
+def test_cache_hit_is_free_unless_configured(monkeypatch, storage, athlete, cache):
+    fake = use_openai(monkeypatch, FakeOpenAI(words=5))
+    first = "".join(stream(athlete))
+
+    assert list(stream(athlete, charge_on_cache_hit=False)) == [first]
+    assert credits(storage, athlete) == 2
+    assert list(stream(athlete, charge_on_cache_hit=True)) == [first]
+    assert credits(storage, athlete) == 1
+    assert fake.calls == 1
+
+
+def test_cache_hit_without_credits_is_refused(monkeypatch, storage, athlete, cache):
+    use_openai(monkeypatch, FakeOpenAI(words=5))
+    "".join(stream(athlete))
+    storage.update_user_credits(athlete, credits=0, used_credits=3)
+
+    with pytest.raises(ValueError):
+        next(stream(athlete, charge_on_cache_hit=False))
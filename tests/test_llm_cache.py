@@ -0,0 +1,62 @@
+from types import SimpleNamespace
+import pytest
+import llm_cache
+from llm_cache import ResponseCache, response_cache_key
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResponseCache(str(tmp_path / "llm_cache.sqlite3"), max_entries=3, ttl=3600)
+
+
+def test_key_covers_every_input_of_the_model():
+    key = response_cache_key('gpt-4o', 1.0, 'coach', 'run')
+    assert key == response_cache_key('gpt-4o', 1.0, 'coach', 'run')
+    assert len({
+        key,
+        response_cache_key('gpt-4o-mini', 1.0, 'coach', 'run'),
+        response_cache_key('gpt-4o', 0.5, 'coach', 'run'),
+        response_cache_key('gpt-4o', 1.0, 'coach!', 'run'),
+        response_cache_key('gpt-4o', 1.0, 'coach', 'ride')
+    }) == 5
+
+
+def test_hits_and_misses_are_counted(cache):
+    assert cache.get('a') is None
+    cache.put('a', 'feedback', model='gpt-4o')
+
+    assert cache.get('a') == 'feedback'
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'size': 1}
+
+
+def test_entries_expire_after_the_ttl(monkeypatch, cache):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache, 'time', SimpleNamespace(time=lambda: now[0]))
+    cache.put('a', 'feedback')
+
+    now[0] += 3599
+    assert cache.get('a') == 'feedback'
+    now[0] += 1
+    assert cache.get('a') is None
+    assert cache.stats()['size'] == 0
+
+
+def test_least_recently_used_entries_are_evicted(monkeypatch, cache):
+    now = [1_000_000.0]
+    monkeypatch.setattr(llm_cache, 'time', SimpleNamespace(time=lambda: now[0]))
+    for key in ('a', 'b', 'c'):
+        now[0] += 1
+        cache.put(key, key.upper())
+    now[0] += 1
+    cache.get('a')
+    now[0] += 1
+    cache.put('d', 'D')
+
+    assert [cache.get(key) for key in ('a', 'b', 'c', 'd')] == ['A', None, 'C', 'D']
+
+
+def test_responses_survive_a_restart(tmp_path):
+    path = str(tmp_path / "llm_cache.sqlite3")
+    ResponseCache(path).put('a', 'feedback')
+
+    assert ResponseCache(path).get('a') == 'feedback'
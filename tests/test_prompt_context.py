@@ -0,0 +1,58 @@
+from prompt_context import activity_digest, build_history_context, compact_summary, estimate_tokens
+
+
+def stored_rows(count):
+    """Stored activity rows, newest first, each with a long summary"""
+    return [
+        {
+            'activity_id': str(i),
+            'start_date_local': f"2024-05-{28 - i:02d}T08:00:00",
+            'sport_type': 'Run',
+            'distance': 10000.0 + i,
+            'moving_time': 3000,
+            'total_elevation_gain': 120.0,
+            'average_speed': 3.3,
+            'average_heartrate': 150.0,
+            'summary': f"🏃 **Activity Name:** Run {i}\n\n" + "📊 **Splits:** 5:03 min/km\n" * 20
+        }
+        for i in range(count)
+    ]
+
+
+def test_history_fits_the_token_budget():
+    for budget in (0, 40, 150, 600, 5000):
+        text, tokens = build_history_context(stored_rows(10), token_budget=budget)
+        assert tokens <= budget
+        assert estimate_tokens(text) <= tokens
+
+
+def test_summaries_are_used_while_they_fit():
+    rows = stored_rows(3)
+    text, _ = build_history_context(rows, token_budget=10000)
+
+    assert text == "\n\n".join(compact_summary(row['summary']) for row in rows)
+
+
+def test_digests_replace_summaries_that_do_not_fit():
+    rows = stored_rows(10)
+    text, _ = build_history_context(rows, token_budget=350)
+
+    assert compact_summary(rows[0]['summary']) in text
+    assert text.endswith(activity_digest(rows[-1]))
+    assert all(f"Run {i}\n" not in text for i in range(5, 10))
+
+
+def test_oldest_activities_are_dropped_first():
+    rows = stored_rows(10)
+    digest_tokens = estimate_tokens(activity_digest(rows[0])) + 1
+    text, _ = build_history_context(rows, token_budget=4 * digest_tokens)
+
+    assert text.split("\n\n") == [activity_digest(row) for row in rows[:4]]
+
+
+def test_analysed_activity_and_overflow_are_left_out():
+    rows = stored_rows(12)
+    text, _ = build_history_context(rows, token_budget=10000, max_activities=3, exclude_activity_id=0)
+
+    assert text == "\n\n".join(compact_summary(row['summary']) for row in rows[1:4])
+    assert build_history_context([], token_budget=100) == ("", 0)
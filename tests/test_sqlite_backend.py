@@ -0,0 +1,188 @@
+import threading
+import time
+import pytest
+from postgrest.exceptions import APIError
+from sqlite_backend import ReplicaClient, SQLiteClient
+from storage import Storage
+
+
+def activity_row(athlete_id, activity_id, start_date_local, **fields):
+    return {'athlete_id': athlete_id, 'activity_id': activity_id, 'start_date_local': start_date_local, **fields}
+
+
+def test_upsert_returns_rows_and_updates_on_conflict(sqlite_client):
+    table = sqlite_client.table('activities')
+    table.upsert(activity_row('1', 'a', '2024-01-01', name='Old'), on_conflict='athlete_id,activity_id').execute()
+    response = sqlite_client.table('activities') \
+        .upsert(activity_row('1', 'a', '2024-01-01', name='New', is_coached=True), on_conflict='athlete_id,activity_id') \
+        .execute()
+
+    assert response.data[0]['name'] == 'New'
+    rows = sqlite_client.table('activities').select('*').eq('athlete_id', '1').execute().data
+    assert [(row['name'], row['is_coached']) for row in rows] == [('New', True)]
+
+
+def test_json_columns_round_trip(sqlite_client):
+    preferences = {'sport_type': 'Trail', 'target_distance': 42}
+    sqlite_client.table('user_preferences').upsert({'athlete_id': '1', 'preferences': preferences}).execute()
+
+    assert sqlite_client.table('user_preferences').select('preferences').eq('athlete_id', '1').execute().data == [
+        {'preferences': preferences}
+    ]
+
+
+def test_filters_order_and_range(sqlite_client):
+    sqlite_client.table('activities').upsert([
+        activity_row('1', str(index), f'2024-01-{index + 1:02d}', distance=float(index)) for index in range(10)
+    ]).execute()
+
+    rows = sqlite_client.table('activities').select('activity_id') \
+        .eq('athlete_id', '1').in_('activity_id', ['2', '5', '7']).gte('distance', 5) \
+        .order('start_date_local', desc=True).execute().data
+    assert [row['activity_id'] for row in rows] == ['7', '5']
+
+    page = sqlite_client.table('activities').select('activity_id').eq('athlete_id', '1') \
+        .order('start_date_local').range(3, 5).execute().data
+    assert [row['activity_id'] for row in page] == ['3', '4', '5']
+
+
+def test_or_filter_with_nested_and(sqlite_client):
+    sqlite_client.table('activities').upsert([
+        activity_row('1', 'a', '2024-01-01'), activity_row('1', 'b', '2024-01-02'), activity_row('1', 'c', '2024-01-02')
+    ]).execute()
+
+    rows = sqlite_client.table('activities').select('activity_id').eq('athlete_id', '1') \
+        .or_('start_date_local.lt."2024-01-02",and(start_date_local.eq."2024-01-02",activity_id.lt."c")') \
+        .order('activity_id').execute().data
+    assert [row['activity_id'] for row in rows] == ['a', 'b']
+
+
+def test_unknown_columns_and_tables_raise_api_errors(sqlite_client):
+    with pytest.raises(APIError):
+        sqlite_client.table('activities').select('nope').execute()
+    with pytest.raises(APIError):
+        sqlite_client.table('nope')
+
+
+def test_replace_rows_is_never_seen_half_done(tmp_path):
+    path = str(tmp_path / "replica.sqlite3")
+    writer, reader = SQLiteClient(path), SQLiteClient(path)
+    rows = [activity_row('1', str(index), '2024-01-01') for index in range(200)]
+    writer.replace_rows('activities', '1', rows)
+    counts = []
+    done = threading.Event()
+
+    def read():
+        while not done.is_set():
+            counts.append(len(reader.table('activities').select('activity_id').eq('athlete_id', '1').execute().data))
+
+    thread = threading.Thread(target=read)
+    thread.start()
+    for _ in range(30):
+        writer.replace_rows('activities', '1', rows)
+    done.set()
+    thread.join()
+
+    assert counts and min(counts) == len(rows)
+
+
+@pytest.fixture
+def replicated(tmp_path):
+    primary = SQLiteClient(str(tmp_path / "primary.sqlite3"))
+    replica = SQLiteClient(str(tmp_path / "replica.sqlite3"))
+    return primary, replica, Storage(ReplicaClient(primary, replica))
+
+
+def test_replica_serves_reads_and_mirrors_writes(replicated):
+    primary, replica, storage = replicated
+    storage.update_user_preferences('1', {'sport_type': 'Run'})
+    assert storage.get_user_preferences('1') == {'sport_type': 'Run'}
+
+    # Reads come from the replica until it is stale, so a change made behind its back is not seen
+    primary.table('user_preferences').update({'preferences': {'sport_type': 'Bike'}}).eq('athlete_id', '1').execute()
+    storage._cache.clear()
+    assert storage.get_user_preferences('1') == {'sport_type': 'Run'}
+
+
+def test_replica_reads_rollups_changed_by_rpc(replicated):
+    from benchmark_fakes import synthetic_activities
+
+    _, _, storage = replicated
+    activities = synthetic_activities(10)
+    storage.add_activities('1', [(activity, 'summary') for activity in activities[:5]])
+    assert sum(row['count'] for row in storage.get_activity_rollups('1', 'month')) == 5
+
+    storage.add_activities('1', [(activity, 'summary') for activity in activities[5:]])
+    assert sum(row['count'] for row in storage.get_activity_rollups('1', 'month')) == 10
+
+
+def test_streams_are_not_replicated(replicated):
+    primary, replica, storage = replicated
+    streams = {'stream_types': ['time'], 'sample_count': 2, 'data': b'\x00blob'}
+    for activity_id in ('a', 'b', 'c'):
+        storage.save_activity_streams('1', activity_id, streams)
+
+    assert storage.get_activity_streams('1', 'b') == streams
+    assert replica.table('activity_streams').select('activity_id').execute().data == []
+
+
+def test_streams_are_stored_as_bytes(sqlite_client, storage):
+    import numpy as np
+    from activity_streams import decode_streams, encode_streams
+
+    arrays = {'time': np.arange(100, dtype=np.int32), 'heartrate': np.full(100, 150, dtype=np.int16)}
+    encoded = encode_streams(arrays)
+    storage.save_activity_streams('1', 'a', encoded)
+
+    stored = sqlite_client._conn.execute("SELECT typeof(data) AS type, length(data) AS size FROM activity_streams").fetchone()
+    assert (stored['type'], stored['size']) == ('blob', len(encoded['data']))
+    decoded = decode_streams(storage.get_activity_streams('1', 'a'))
+    assert all(np.array_equal(decoded[name], arrays[name]) for name in arrays)
+
+
+def test_streams_travel_as_base64(monkeypatch, sqlite_client, storage):
+    sent = []
+    rpc = sqlite_client.rpc
+    monkeypatch.setattr(sqlite_client, 'rpc', lambda name, params=None, **kwargs: sent.append(params) or rpc(name, params))
+    blob = bytes(range(256)) * 12
+    storage.save_activity_streams('1', 'a', {'stream_types': ['time'], 'sample_count': 3, 'data': blob})
+
+    assert len(sent[0]['p_data']) == 4 * len(blob) // 3
+    assert storage.get_activity_streams('1', 'a')['data'] == blob
+
+
+def test_hydration_pages_through_every_row(monkeypatch, replicated):
+    import sqlite_backend
+
+    primary, replica, storage = replicated
+    monkeypatch.setattr(sqlite_backend, 'REPLICA_PAGE_SIZE', 3)
+    primary.table('activities').insert([
+        activity_row('1', str(activity_id), f"2024-01-{activity_id % 3 + 1:02d}") for activity_id in range(10)
+    ]).execute()
+
+    storage.supabase.hydrate('activities', '1')
+
+    rows = replica.table('activities').select('activity_id').eq('athlete_id', '1').execute().data
+    assert sorted(row['activity_id'] for row in rows) == [str(activity_id) for activity_id in range(10)]
+
+
+def test_concurrent_reads_share_one_pull(monkeypatch, replicated):
+    primary, replica, storage = replicated
+    primary.table('activities').insert([activity_row('1', 'a', '2024-01-01')]).execute()
+    pulls = []
+    table = primary.table
+
+    def counting_table(name):
+        pulls.append(name)
+        time.sleep(0.05)
+        return table(name)
+
+    monkeypatch.setattr(primary, 'table', counting_table)
+    client = storage.supabase
+    threads = [threading.Thread(target=client.hydrate, args=('activities', '1')) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert pulls == ['activities']
@@ -0,0 +1,112 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+import storage as storage_module
+from sqlite_backend import SQLiteClient
+
+
+def test_get_storage_builds_one_client_per_process(monkeypatch, tmp_path):
+    built = []
+
+    def create_backend_client(backend=None):
+        built.append(backend)
+        time.sleep(0.05)
+        return SQLiteClient(str(tmp_path / "shared.sqlite3"))
+
+    monkeypatch.setattr(storage_module, '_storage', None)
+    monkeypatch.setattr(storage_module, 'create_backend_client', create_backend_client)
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        instances = list(pool.map(lambda _: storage_module.get_storage(), range(16)))
+
+    assert len(built) == 1
+    assert all(instance is instances[0] for instance in instances)
+    instances[0].supabase.close()
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        storage_module.create_backend_client('postgres')
+
+
+def add_synthetic_activities(storage, athlete_id, count):
+    from benchmark_fakes import synthetic_activities
+
+    activities = synthetic_activities(count)
+    storage.add_activities(athlete_id, [(activity, f"summary {activity['id']}") for activity in activities])
+    return activities
+
+
+def test_load_dashboard_returns_every_section(storage):
+    storage.update_user_preferences('1', {'goal': '50k'})
+    storage.update_athlete_stats('1', {'all_run_totals': {'count': 3, 'distance': 30000.0, 'elevation_gain': 900.0}})
+    add_synthetic_activities(storage, '1', 25)
+
+    dashboard = storage.load_dashboard('1', activity_limit=10)
+
+    assert dashboard['preferences'] == {'goal': '50k'}
+    assert dashboard['stats']['all_time']['run']['total_activities'] == 3
+    dates = [activity['start_date_local'] for activity in dashboard['activities']]
+    assert len(dates) == 10 and dates == sorted(dates, reverse=True)
+    assert dashboard['activities_cursor'] is not None
+    assert dashboard['training_load'] is not None
+    assert dashboard['monthly_rollups']
+
+
+def test_load_dashboard_of_a_new_athlete_is_empty(storage):
+    dashboard = storage.load_dashboard('new')
+
+    assert dashboard['preferences'] == {} and dashboard['athletes_info'] == {} and dashboard['stats'] == {}
+    assert dashboard['activities'] == [] and dashboard['activities_cursor'] is None
+    assert dashboard['training_load'] is None
+
+
+def test_load_dashboard_builds_missing_rollups(sqlite_client, storage):
+    from storage import Storage
+
+    add_synthetic_activities(storage, '1', 5)
+    expected = storage.load_dashboard('1')['monthly_rollups']
+    assert expected
+    sqlite_client.table('activity_rollups').delete().eq('athlete_id', '1').execute()
+
+    assert Storage(sqlite_client).load_dashboard('1')['monthly_rollups'] == expected
+
+
+def insert_activities(sqlite_client, athlete_id, keys):
+    sqlite_client.table('activities').insert([
+        {'athlete_id': athlete_id, 'activity_id': activity_id, 'start_date_local': start_date_local}
+        for start_date_local, activity_id in keys
+    ]).execute()
+
+
+def walk_pages(storage, athlete_id, page_size, between_pages=None):
+    keys, cursor = [], None
+    while True:
+        rows, cursor = storage.get_activities_page(athlete_id, page_size, cursor)
+        keys.extend((row['start_date_local'], row['activity_id']) for row in rows)
+        if cursor is None:
+            return keys
+        if between_pages:
+            between_pages()
+
+
+def test_keyset_pages_cover_every_activity_once_with_ties(sqlite_client, storage):
+    # Several activities share a start date, the activity_id breaks the tie
+    keys = [(f"2024-01-{day:02d}T08:00:00Z", f"{day}{n}") for day in range(1, 8) for n in range(3)]
+    insert_activities(sqlite_client, '1', keys)
+
+    assert walk_pages(storage, '1', page_size=4) == sorted(keys, reverse=True)
+    assert walk_pages(storage, '1', page_size=len(keys)) == sorted(keys, reverse=True)
+
+
+def test_keyset_pages_stay_consistent_when_activities_are_added(sqlite_client, storage):
+    keys = [(f"2024-01-{day:02d}T08:00:00Z", str(day)) for day in range(1, 11)]
+    insert_activities(sqlite_client, '1', keys)
+    added = iter(f"2024-02-{day:02d}T08:00:00Z" for day in range(1, 10))
+
+    def add_newer_activity():
+        start_date_local = next(added)
+        insert_activities(sqlite_client, '1', [(start_date_local, start_date_local)])
+        storage._cache.invalidate('1', 'activities')
+
+    # A newer activity does not shift the following pages, unlike OFFSET paging
+    assert walk_pages(storage, '1', page_size=3, between_pages=add_newer_activity) == sorted(keys, reverse=True)
@@ -0,0 +1,71 @@
+import threading
+from storage_cache import ReadCache
+
+
+def test_hits_are_copies_until_the_table_is_invalidated():
+    cache = ReadCache()
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{'goal': '50k'}]
+
+    first = cache.get_or_load(('user_preferences', '1'), load)
+    first[0]['goal'] = 'mutated'
+    assert cache.get_or_load(('user_preferences', '1'), load) == [{'goal': '50k'}]
+    assert len(loads) == 1
+
+    cache.invalidate('2', 'user_preferences')
+    cache.invalidate('1', 'activities')
+    cache.get_or_load(('user_preferences', '1'), load)
+    assert len(loads) == 1
+
+    cache.invalidate('1', 'user_preferences')
+    cache.get_or_load(('user_preferences', '1'), load)
+    assert len(loads) == 2
+
+
+def test_expired_entries_are_reloaded():
+    cache = ReadCache(ttls={'activities': 0})
+    values = iter([['old'], ['new']])
+
+    assert cache.get_or_load(('activities', '1'), lambda: next(values)) == ['old']
+    assert cache.get_or_load(('activities', '1'), lambda: next(values)) == ['new']
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ReadCache(max_entries=2)
+    for athlete_id in ('1', '2'):
+        cache.get_or_load(('athletes', athlete_id), lambda: [athlete_id])
+    cache.get_or_load(('athletes', '1'), lambda: ['reloaded'])
+    cache.get_or_load(('athletes', '3'), lambda: ['3'])
+
+    assert cache.get_or_load(('athletes', '1'), lambda: ['reloaded']) == ['1']
+    assert cache.get_or_load(('athletes', '2'), lambda: ['reloaded']) == ['reloaded']
+
+
+def test_load_racing_with_a_write_is_not_cached():
+    cache = ReadCache()
+    loading, written = threading.Event(), threading.Event()
+
+    def slow_load():
+        loading.set()
+        written.wait(5)
+        return ['before write']
+
+    reader = threading.Thread(target=cache.get_or_load, args=(('activities', '1'), slow_load))
+    reader.start()
+    loading.wait(5)
+    cache.invalidate('1', 'activities')
+    written.set()
+    reader.join()
+
+    assert cache.get_or_load(('activities', '1'), lambda: ['after write']) == ['after write']
+
+
+def test_storage_writes_invalidate_cached_reads(storage):
+    storage.update_user_preferences('1', {'goal': '50k'})
+    assert storage.get_user_preferences('1') == {'goal': '50k'}
+
+    storage.update_user_preferences('1', {'goal': '100k'})
+    assert storage.get_user_preferences('1') == {'goal': '100k'}
@@ -0,0 +1,24 @@
+import asyncio
+from strava_async import backfill_activity_details, get_many_activity_details
+
+ATHLETE_ID = 3
+
+
+def test_details_are_keyed_by_id_and_missing_activities_skipped(fake_strava):
+    activity_ids = [activity['id'] for activity in fake_strava.athlete_activities(ATHLETE_ID)[:5]] + [ATHLETE_ID * 100000 + 999]
+    details = asyncio.run(get_many_activity_details(f"token-{ATHLETE_ID}", activity_ids, concurrency=2))
+
+    assert sorted(details) == sorted(str(activity_id) for activity_id in activity_ids[:5])
+    assert all('segment_efforts' in payload for payload in details.values())
+
+
+def test_backfill_stores_detailed_summaries(storage, fake_strava):
+    activities = fake_strava.athlete_activities(ATHLETE_ID)[:4]
+    stored = backfill_activity_details(storage, f"token-{ATHLETE_ID}", str(ATHLETE_ID), [activity['id'] for activity in activities],
+                                       with_streams=False)
+
+    assert stored == 4
+    rows = storage.get_user_activities(str(ATHLETE_ID))
+    assert len(rows) == 4
+    assert all(row['has_details'] and 'Splits' in row['summary'] for row in rows)
+    assert storage.get_training_load(str(ATHLETE_ID)) is not None
@@ -0,0 +1,209 @@
+import pytest
+import requests
+import strava_client
+from strava_client import (DEFAULT_TIMEOUT, PRIORITY_BACKGROUND, PRIORITY_INTERACTIVE, RequestScheduler, StravaBudgetExceeded,
+                           StravaClient, StravaRateLimitError)
+
+# Five minutes into a quarter hour, far from both window resets
+START = 900 * 100000 + 300
+
+
+class FakeClock:
+    """Stands in for the time module: sleeping, and waiting on the scheduler, only move the clock forward"""
+
+    def __init__(self, now: float = START):
+        self.now = now
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeCondition:
+    """Single-threaded Condition whose waits run out their timeout on the fake clock"""
+
+    def __init__(self, clock: FakeClock):
+        self.clock = clock
+        self.waits = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def wait(self, timeout):
+        self.waits.append(timeout)
+        self.clock.now += timeout
+
+    def notify_all(self):
+        pass
+
+
+class FakeSession:
+    """Replays scripted outcomes: a status code, or an exception to raise"""
+
+    def __init__(self, *outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = []
+
+    def request(self, method, url, headers=None, **kwargs):
+        self.calls.append((method, url, kwargs))
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        response = requests.Response()
+        response.status_code = outcome
+        response.headers.update({'X-RateLimit-Limit': '200,2000', 'X-RateLimit-Usage': f'{len(self.calls)},{len(self.calls)}'})
+        return response
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(strava_client, 'time', clock)
+    return clock
+
+
+def make_scheduler(clock, limits=None):
+    scheduler = RequestScheduler(limits or {'overall': (100, 1000), 'read': (100, 1000)})
+    scheduler._cond = FakeCondition(clock)
+    # Start in the current windows, so usage seeded by a test is not reset by the first acquire
+    scheduler.budget()
+    return scheduler
+
+
+def make_client(clock, *outcomes, limits=None):
+    client = StravaClient(scheduler=make_scheduler(clock, limits))
+    client.session = FakeSession(*outcomes)
+    return client
+
+
+def test_idempotent_requests_are_retried_with_backoff(clock):
+    client = make_client(clock, 502, 503, 200)
+
+    assert client.get('athlete', access_token='t').status_code == 200
+    assert len(client.session.calls) == 3
+    assert 0.5 <= clock.sleeps[0] <= 1.0 and 1.0 <= clock.sleeps[1] <= 1.5
+
+
+def test_server_errors_are_returned_after_the_last_retry(clock):
+    client = make_client(clock, *[500] * 4)
+
+    assert client.get('athlete').status_code == 500
+    assert len(client.session.calls) == client.max_retries + 1
+
+
+def test_posts_are_not_replayed_after_a_server_error(clock):
+    client = make_client(clock, 500)
+
+    assert client.post('activities/1/comments', data={'text': 'hi'}).status_code == 500
+    assert len(client.session.calls) == 1 and clock.sleeps == []
+
+
+def test_timeouts_are_sent_and_retried_for_reads_only(clock):
+    client = make_client(clock, requests.Timeout(), 200)
+    assert client.get('athlete').status_code == 200
+    assert [kwargs['timeout'] for _, _, kwargs in client.session.calls] == [DEFAULT_TIMEOUT] * 2
+
+    client = make_client(clock, requests.Timeout())
+    with pytest.raises(requests.Timeout):
+        client.post('activities/1/comments')
+
+    client = make_client(clock, *[requests.ConnectionError()] * 4)
+    with pytest.raises(requests.ConnectionError):
+        client.get('athlete')
+    assert len(client.session.calls) == client.max_retries + 1
+
+
+def test_429_blocks_the_window_and_sheds_the_retry(clock):
+    client = make_client(clock, 429)
+
+    with pytest.raises(StravaBudgetExceeded) as raised:
+        client.get('athlete')
+    assert raised.value.retry_after == pytest.approx(600)
+    assert client.scheduler.budget()['overall'][0] == 0
+    assert len(client.session.calls) == 1
+
+
+def test_429_next_to_the_window_reset_waits_and_retries(clock):
+    clock.now = START + 590
+    client = make_client(clock, 429, 200)
+
+    assert client.get('athlete').status_code == 200
+    assert client.scheduler._cond.waits == [pytest.approx(10)]
+    assert len(client.session.calls) == 2
+
+
+def test_repeated_429_raise_a_rate_limit_error(clock):
+    client = make_client(clock, *[429] * 4)
+    client.scheduler.acquire = lambda *args, **kwargs: None
+
+    with pytest.raises(StravaRateLimitError):
+        client.get('athlete')
+    assert len(client.session.calls) == client.max_retries + 1
+
+
+def test_reported_usage_is_applied_to_the_budget(clock):
+    client = make_client(clock, 200)
+    client.get('athlete')
+
+    assert client.quota_usage()['usage_15min'] == 1
+    assert client.scheduler.limits['overall'] == (200, 2000)
+    assert client.scheduler.budget()['overall'] == (199, 1999)
+
+
+def test_background_requests_stop_at_their_share(clock):
+    scheduler = make_scheduler(clock)
+    scheduler.used['read'] = [80, 80]
+
+    with pytest.raises(StravaBudgetExceeded):
+        scheduler.acquire('GET', priority=PRIORITY_BACKGROUND)
+    scheduler.acquire('GET', priority=PRIORITY_INTERACTIVE)
+    scheduler.acquire('POST', priority=PRIORITY_BACKGROUND)
+    assert scheduler.used['read'] == [81, 81]
+    assert scheduler._cond.waits == []
+
+
+def test_interactive_requests_queue_until_the_window_refills(clock):
+    scheduler = make_scheduler(clock)
+    scheduler.used['overall'] = [100, 100]
+
+    clock.now = START + 500
+    with pytest.raises(StravaBudgetExceeded):
+        scheduler.acquire('POST', priority=PRIORITY_INTERACTIVE)
+
+    clock.now = START + 590
+    scheduler.acquire('POST', priority=PRIORITY_INTERACTIVE)
+    assert scheduler._cond.waits == [pytest.approx(10)]
+    assert scheduler.used['overall'] == [1, 101]
+
+    scheduler.used['overall'] = [100, 100]
+    with pytest.raises(StravaBudgetExceeded):
+        scheduler.acquire('POST', priority=PRIORITY_BACKGROUND, max_wait=60)
+
+
+def test_background_requests_yield_to_waiting_interactive_ones(clock):
+    scheduler = make_scheduler(clock)
+    scheduler._waiting_interactive = 1
+
+    with pytest.raises(StravaBudgetExceeded):
+        scheduler.acquire('GET', priority=PRIORITY_BACKGROUND)
+    scheduler.acquire('GET', priority=PRIORITY_INTERACTIVE)
+    assert scheduler.used['read'] == [1, 1]
+
+
+def test_daily_exhaustion_waits_for_midnight(clock):
+    scheduler = make_scheduler(clock)
+    scheduler.used['read'] = [0, 1000]
+
+    with pytest.raises(StravaBudgetExceeded) as raised:
+        scheduler.acquire('GET', priority=PRIORITY_INTERACTIVE)
+    assert raised.value.retry_after == pytest.approx(86400 - START % 86400)
@@ -0,0 +1,138 @@
+import os
+import pytest
+from streamlit.testing.v1 import AppTest
+from streamlit.runtime.scriptrunner import RerunData
+from streamlit.testing.v1 import local_script_runner
+from streamlit.testing.v1.local_script_runner import LocalScriptRunner
+from benchmark_fakes import FakeStravaAdapter, install_fake_openai, install_fake_strava, offline_secrets
+from jobs import JOB_DONE, JOB_QUEUED, JOB_RUNNING
+from strava_client import StravaBudgetExceeded
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "streamlit_app.py")
+ATHLETE_ID = 77
+
+
+@pytest.fixture
+def app(monkeypatch, tmp_path, storage):
+    """The app logged in as a fake athlete, on its own database and response cache"""
+    import llm
+    import storage as storage_module
+    from llm_cache import ResponseCache
+
+    monkeypatch.setattr(storage_module, '_storage', storage)
+    monkeypatch.setattr(llm, 'response_cache', ResponseCache(str(tmp_path / "llm_responses.sqlite3")))
+    install_fake_strava(FakeStravaAdapter(activity_count=30))
+    install_fake_openai()
+
+    app = AppTest.from_file(APP_PATH, default_timeout=60)
+    for key, value in offline_secrets(str(tmp_path)).items():
+        app.secrets[key] = value
+    app.query_params["code"] = f"code-{ATHLETE_ID}"
+    return app
+
+
+def texts(elements):
+    return [element.value for element in elements]
+
+
+def test_profile_falls_back_to_storage_when_strava_is_out_of_budget(monkeypatch, app):
+    import strava_api
+
+    app.run()
+    assert not app.exception
+    assert any('Welcome, Bench Runner' in text for text in texts(app.subheader))
+
+    def out_of_budget(*args, **kwargs):
+        raise StravaBudgetExceeded("Strava request budget exhausted", retry_after=60)
+
+    monkeypatch.setattr(strava_api, 'get_athlete_details', out_of_budget)
+    monkeypatch.setattr(strava_api, 'get_athlete_stats', out_of_budget)
+    app.run()
+
+    assert not app.exception
+    assert any('Welcome, Bench Runner' in text for text in texts(app.subheader))
+    assert any('Year-to-Date' in text for text in texts(app.subheader))
+
+
+class ScriptedJobQueue:
+    """Job queue whose job states are set by the test instead of a worker"""
+
+    def __init__(self):
+        self.jobs = {}
+        self.status_reads = 0
+
+    def enqueue_analysis(self, athlete_id, activity_id, preferences):
+        self.jobs[activity_id] = {'status': JOB_QUEUED, 'partial_text': '', 'result': None, 'error': None}
+        return dict(self.jobs[activity_id])
+
+    def get_status(self, athlete_id, activity_id, include_persisted=True):
+        self.status_reads += 1
+        job = self.jobs.get(activity_id)
+        return dict(job) if job else None
+
+
+class FragmentReruns:
+    """Replays the run_every fragments of the last full run on their own, like the browser timer does"""
+
+    def __init__(self, monkeypatch):
+        self.fragment_ids = []
+        self._replaying = False
+        run = LocalScriptRunner.run
+
+        def record_run(runner, *args, **kwargs):
+            tree = run(runner, *args, **kwargs)
+            if not self._replaying:
+                self.fragment_ids = [msg.auto_rerun.fragment_id for msg in runner.forward_msgs()
+                                     if msg.WhichOneof('type') == 'auto_rerun']
+            return tree
+
+        def rerun_data(**kwargs):
+            # Every request of a replay, the runner's initial one included, targets the fragments only
+            if self._replaying:
+                kwargs.update(fragment_id_queue=list(self.fragment_ids), is_auto_rerun=True)
+            return RerunData(**kwargs)
+
+        monkeypatch.setattr(LocalScriptRunner, 'run', record_run)
+        monkeypatch.setattr(local_script_runner, 'RerunData', rerun_data)
+
+    def run(self, app):
+        assert self.fragment_ids, "no fragment polls"
+        self._replaying = True
+        try:
+            return app.run()
+        finally:
+            self._replaying = False
+
+
+def test_analysis_job_updates_in_place_on_fragment_reruns(monkeypatch, app):
+    import jobs
+    from tracing import tracer
+
+    queue = ScriptedJobQueue()
+    monkeypatch.setattr(jobs, 'get_job_queue', lambda: queue)
+    reruns = FragmentReruns(monkeypatch)
+    app.run()
+    button = next(button for button in app.button if button.key and button.key.startswith('analyze_'))
+    activity_id = button.key.removeprefix('analyze_')
+    button.click().run()
+    assert not app.exception
+    assert 'Analyse queued...' in texts(app.info)
+
+    queue.jobs[activity_id].update(status=JOB_RUNNING, partial_text='Pacing was even')
+    reruns.run(app)
+    assert not app.exception
+    assert 'Pacing was even' in texts(app.markdown)
+    # Only the poll ran, not the page
+    assert not any('Welcome' in text for text in texts(app.subheader))
+
+    queue.jobs[activity_id].update(status=JOB_DONE, result='Great negative split')
+    reruns.run(app)
+    assert not app.exception
+    assert 'Analysis ready' in texts(app.success)
+    assert not any('Welcome' in text for text in texts(app.subheader))
+
+    reads = queue.status_reads
+    reruns.run(app)
+    assert 'Analysis ready' in texts(app.success)
+    assert queue.status_reads == reads
+    assert any(row['operation'] == 'fragment analysis_job' and row['count'] >= 3 for row in tracer.summary())
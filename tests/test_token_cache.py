@@ -0,0 +1,106 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from token_cache import TokenCache
+
+
+class FakeTokenStore:
+    """In-memory load/refresh/save callbacks counting the refreshes"""
+
+    def __init__(self, expires_in: int):
+        self.saved = {'1': {'access_token': 'old', 'refresh_token': 'r0', 'expires_at': int(time.time()) + expires_in}}
+        self.refreshes = 0
+        self._lock = threading.Lock()
+
+    def load(self, athlete_id):
+        return self.saved.get(athlete_id)
+
+    def refresh(self, refresh_token):
+        with self._lock:
+            self.refreshes += 1
+            count = self.refreshes
+        time.sleep(0.05)
+        return {'access_token': f'new-{count}', 'refresh_token': f'r{count}', 'expires_at': int(time.time()) + 6 * 3600}
+
+    def save(self, athlete_id, tokens):
+        self.saved[athlete_id] = tokens
+
+    def cache(self) -> TokenCache:
+        return TokenCache(self.load, self.refresh, self.save)
+
+
+def test_valid_tokens_are_loaded_once_and_not_refreshed():
+    store = FakeTokenStore(expires_in=3600)
+    cache = store.cache()
+
+    assert cache.get('1') == 'old'
+    store.saved.clear()
+    assert cache.get('1') == 'old'
+    assert store.refreshes == 0
+    assert cache.get('2') is None
+
+
+def test_concurrent_callers_share_a_single_refresh():
+    store = FakeTokenStore(expires_in=60)
+    cache = store.cache()
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        tokens = list(pool.map(lambda _: cache.get('1'), range(16)))
+
+    assert tokens == ['new-1'] * 16
+    assert store.refreshes == 1
+    assert store.saved['1']['access_token'] == 'new-1'
+
+
+def test_put_keeps_the_most_recent_tokens():
+    store = FakeTokenStore(expires_in=3600)
+    cache = store.cache()
+    cache.get('1')
+
+    stale = {'access_token': 'stale', 'refresh_token': 'x', 'expires_at': int(time.time())}
+    assert not cache.put('1', stale)
+    assert cache.get('1') == 'old'
+
+    fresh = {'access_token': 'fresh', 'refresh_token': 'y', 'expires_at': int(time.time()) + 7200}
+    assert cache.put('1', fresh)
+    assert cache.get('1') == 'fresh' and store.saved['1'] is fresh
+
+
+def test_failed_refresh_drops_the_entry():
+    store = FakeTokenStore(expires_in=60)
+    store.refresh = lambda refresh_token: {'message': 'Bad Request'}
+    cache = store.cache()
+
+    assert cache.get('1') is None
+    assert store.saved['1']['access_token'] == 'old'
+
+
+def test_tokens_refreshed_by_another_process_are_reused():
+    store = FakeTokenStore(expires_in=60)
+    cache = store.cache()
+    cache.refresh_buffer = 0
+    assert cache.get('1') == 'old'
+
+    # The webhook process refreshed the tokens meanwhile, spending r0
+    store.saved['1'] = {'access_token': 'webhook', 'refresh_token': 'r9', 'expires_at': int(time.time()) + 6 * 3600}
+    cache.refresh_buffer = 300
+
+    assert cache.get('1') == 'webhook'
+    assert store.refreshes == 0
+
+
+def test_refresh_uses_the_stored_refresh_token():
+    store = FakeTokenStore(expires_in=60)
+    used = []
+    refresh = store.refresh
+    store.refresh = lambda refresh_token: used.append(refresh_token) or refresh(refresh_token)
+    cache = store.cache()
+    cache.refresh_buffer = 0
+    assert cache.get('1') == 'old'
+
+    # Rotated elsewhere, but about to expire as well
+    store.saved['1'] = {'access_token': 'webhook', 'refresh_token': 'r9', 'expires_at': int(time.time()) + 60}
+    cache.refresh_buffer = 300
+
+    assert cache.get('1') == 'new-1'
+    assert used == ['r9']
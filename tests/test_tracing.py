@@ -0,0 +1,100 @@
+import json
+import os
+import pytest
+import tracing
+from tracing import (TracedClient, Tracer, configure, current_trace_id, endpoint_name, finish_trace, span, start_trace,
+                     trace_context)
+
+
+@pytest.fixture
+def tracer(monkeypatch):
+    """A fresh process-wide tracer, so spans of other tests do not leak in"""
+    tracer = Tracer()
+    monkeypatch.setattr(tracing, 'tracer', tracer)
+    return tracer
+
+
+def test_spans_are_tagged_with_the_current_trace(tracer):
+    with trace_context(athlete_id='7') as trace_id:
+        with span('strava', 'GET /athlete', priority='interactive') as tags:
+            tags['status'] = 200
+    with span('strava', 'GET /athlete'):
+        pass
+
+    traced = tracer.spans(trace_id)
+    assert len(traced) == 1
+    assert traced[0]['athlete_id'] == '7'
+    assert (traced[0]['priority'], traced[0]['status'], traced[0]['error']) == ('interactive', 200, None)
+    assert tracer.spans()[-1]['trace_id'] is None
+    assert current_trace_id() is None
+
+
+def test_failed_spans_record_the_error_and_reraise(tracer):
+    with pytest.raises(TimeoutError):
+        with span('openai', 'responses.create'):
+            raise TimeoutError()
+
+    assert tracer.spans()[0]['error'] == 'TimeoutError'
+    assert [(row['operation'], row['count'], row['errors']) for row in tracer.summary()] == [('responses.create', 1, 1)]
+
+
+def test_a_trace_is_recorded_once_when_finished(tracer):
+    trace_id = start_trace(athlete_id='7')
+    recorded = finish_trace('app', 'render')
+
+    assert (recorded['trace_id'], recorded['operation']) == (trace_id, 'render')
+    assert finish_trace('app', 'render') is None
+    assert [row['count'] for row in tracer.summary()] == [1]
+
+
+def test_prometheus_histograms_are_cumulative(tracer):
+    tracer.record('strava', 'GET /athlete', 0.003)
+    tracer.record('strava', 'GET /athlete', 0.02)
+    tracer.record('strava', 'GET /athlete', 40.0, error='Timeout')
+    lines = tracer.prometheus_text().splitlines()
+
+    labels = 'service="strava",operation="GET /athlete"'
+    metric = 'wildstride_outbound_call_duration_seconds'
+    assert f'{metric}_bucket{{{labels},le="0.005"}} 1' in lines
+    assert f'{metric}_bucket{{{labels},le="0.025"}} 2' in lines
+    assert f'{metric}_bucket{{{labels},le="30.0"}} 2' in lines
+    assert f'{metric}_bucket{{{labels},le="+Inf"}} 3' in lines
+    assert f'{metric}_sum{{{labels}}} 40.023000' in lines
+    assert f'{metric}_count{{{labels}}} 3' in lines
+    assert f'wildstride_outbound_call_errors_total{{{labels}}} 1' in lines
+
+
+def test_prometheus_file_is_replaced_whole(tracer, tmp_path):
+    path = tmp_path / "textfile" / "wildstride.prom"
+    tracer.record('supabase', 'select activities', 0.01)
+    tracer.write_prometheus(str(path))
+    tracer.record('supabase', 'select activities', 0.01)
+    tracer.write_prometheus(str(path))
+
+    assert path.read_text() == tracer.prometheus_text()
+    assert os.listdir(path.parent) == ["wildstride.prom"]
+
+
+def test_spans_are_appended_to_the_json_lines_log(tracer, tmp_path):
+    log_path = tmp_path / "logs" / "spans.jsonl"
+    configure(str(log_path))
+    with trace_context(athlete_id='7') as trace_id:
+        with span('strava', endpoint_name('/activities/123/streams')):
+            pass
+        tracer.record('openai', 'responses.create', 1.5, error='APIError')
+
+    logged = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [(row['service'], row['operation'], row['error']) for row in logged] == [
+        ('strava', '/activities/{id}/streams', None), ('openai', 'responses.create', 'APIError')]
+    assert {row['trace_id'] for row in logged} == {trace_id}
+    assert logged[1]['duration_ms'] == 1500.0
+
+
+def test_traced_client_times_each_query(tracer, sqlite_client):
+    client = TracedClient(sqlite_client)
+    client.table('activities').select('*').eq('athlete_id', '7').execute()
+    client.rpc('get_activity_streams', {'p_athlete_id': '7', 'p_activity_id': '1'}).execute()
+
+    assert [(row['service'], row['operation'], row['count']) for row in tracer.summary()] == [
+        ('supabase', 'rpc get_activity_streams', 1), ('supabase', 'select activities', 1)]
+    assert tracer.spans()[0]['rows'] == 0
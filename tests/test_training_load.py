@@ -0,0 +1,127 @@
+import threading
+from datetime import date
+import pytest
+import training_load
+from benchmark_fakes import synthetic_activities
+from sqlite_backend import SQLiteClient
+from storage import Storage
+
+
+def day(iso_date):
+    return date.fromisoformat(iso_date).toordinal()
+
+
+def stored_rows(storage, athlete_id):
+    return storage._scan_activities(athlete_id, ['start_date_local', 'suffer_score', 'moving_time', 'average_heartrate'])
+
+
+def assert_same_state(state, expected):
+    assert state['last_day'] == expected['last_day']
+    assert state['ctl'] == pytest.approx(expected['ctl'], rel=1e-9)
+    assert state['atl'] == pytest.approx(expected['atl'], rel=1e-9)
+
+
+def test_activity_load_falls_back_from_suffer_score_to_heart_rate_to_duration():
+    assert training_load.activity_load({'suffer_score': 42, 'moving_time': 3600}) == 42.0
+    assert training_load.activity_load({'moving_time': 3600, 'average_heartrate': 150}) > 0
+    assert training_load.activity_load({'moving_time': 600}) == 10 * training_load.DEFAULT_LOAD_PER_MINUTE
+
+
+def daily_state(loads, start=None):
+    """Reference fitness/fatigue: every day from the first load on, value = prev * (1 - 1/T) + load / T"""
+    start = start or {'ctl': 0.0, 'atl': 0.0, 'last_day': min(load_day for load_day, _ in loads)}
+    first_day = min([start['last_day']] + [load_day for load_day, _ in loads])
+    last_day = max([start['last_day']] + [load_day for load_day, _ in loads])
+    by_day = {}
+    for load_day, load in loads:
+        by_day[load_day] = by_day.get(load_day, 0.0) + load
+    ctl = atl = 0.0
+    for current in range(first_day, last_day + 1):
+        ctl = ctl * (1 - 1 / training_load.CTL_DAYS) + by_day.get(current, 0.0) / training_load.CTL_DAYS
+        atl = atl * (1 - 1 / training_load.ATL_DAYS) + by_day.get(current, 0.0) / training_load.ATL_DAYS
+        if current == start['last_day']:
+            ctl, atl = ctl + start['ctl'], atl + start['atl']
+    return {'ctl': ctl, 'atl': atl, 'last_day': last_day}
+
+
+def test_compute_state_matches_the_daily_recurrence():
+    activities = synthetic_activities(50)
+    loads = training_load.activity_loads(activities)
+
+    assert_same_state(training_load.compute_state(activities), daily_state(loads))
+
+
+def test_applied_delta_matches_the_daily_recurrence(storage):
+    base = {'ctl': 40.0, 'atl': 55.0, 'last_day': day('2024-05-10')}
+    storage.save_training_load('1', base)
+    # A later activity, a late one (before last_day) and a removal
+    loads = [(day('2024-05-14'), 80.0), (day('2024-05-02'), 30.0), (day('2024-05-08'), -20.0)]
+
+    expected = daily_state(loads, start=base)
+    assert_same_state(storage.apply_training_load('1', loads), expected)
+    assert_same_state(storage.get_training_load('1'), expected)
+
+
+def test_apply_without_stored_state_changes_nothing(storage):
+    assert storage.apply_training_load('1', [(day('2024-05-14'), 80.0)]) is None
+    assert storage.get_training_load('1') is None
+
+
+def test_incremental_ingest_and_delete_match_a_full_recompute(storage):
+    activities = synthetic_activities(60)
+    for start in range(0, len(activities), 15):
+        storage.add_activities('1', [(activity, 'summary') for activity in activities[start:start + 15]])
+    # Re-ingest with a different effort and delete a few
+    storage.add_activities('1', [(dict(activities[3], suffer_score=999), 'summary')])
+    for activity in activities[10:13]:
+        storage.delete_activity('1', activity['id'])
+
+    assert_same_state(storage.get_training_load('1'), training_load.compute_state(stored_rows(storage, '1')))
+
+
+def test_concurrent_writers_do_not_lose_updates(tmp_path):
+    # Two Storage instances on their own connections stand for the app and the webhook processes
+    path = str(tmp_path / "shared.sqlite3")
+    app, webhook = Storage(SQLiteClient(path)), Storage(SQLiteClient(path))
+    activities = synthetic_activities(81)
+    app.add_activities('1', [(activities[0], 'summary')])
+    # Both hold a cached copy of the state they are about to change
+    app.get_training_load('1')
+    webhook.get_training_load('1')
+
+    def ingest(storage, batch):
+        for activity in batch:
+            storage.add_activities('1', [(activity, 'summary')])
+
+    writers = [threading.Thread(target=ingest, args=(app, activities[1::2])),
+               threading.Thread(target=ingest, args=(webhook, activities[2::2]))]
+    for writer in writers:
+        writer.start()
+    for writer in writers:
+        writer.join()
+
+    reader = Storage(SQLiteClient(path))
+    assert len(stored_rows(reader, '1')) == len(activities)
+    assert_same_state(reader.get_training_load('1'), training_load.compute_state(activities))
+
+
+def test_concurrent_ingests_of_the_same_activities_count_them_once(tmp_path):
+    path = str(tmp_path / "shared.sqlite3")
+    writers = [Storage(SQLiteClient(path)) for _ in range(4)]
+    activities = synthetic_activities(6)
+    writers[0].add_activities('1', [(activities[0], 'summary')])
+    start = threading.Barrier(len(writers))
+
+    def ingest(storage, effort):
+        start.wait(5)
+        for _ in range(10):
+            storage.add_activities('1', [(dict(activity, suffer_score=effort), 'summary') for activity in activities[1:]])
+
+    threads = [threading.Thread(target=ingest, args=(storage, 50 + 10 * n)) for n, storage in enumerate(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    reader = Storage(SQLiteClient(path))
+    assert_same_state(reader.get_training_load('1'), training_load.compute_state(stored_rows(reader, '1')))
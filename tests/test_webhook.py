@@ -0,0 +1,152 @@
+import threading
+import requests
+import pytest
+import webhook
+from activity_streams import decode_streams
+from strava_client import StravaRateLimitError
+
+
+@pytest.fixture
+def logged_in(monkeypatch):
+    # FakeStravaAdapter reads the athlete from tokens shaped "token-<athlete_id>"
+    monkeypatch.setattr(webhook, 'get_valid_token', lambda athlete_id: (f"token-{athlete_id}", athlete_id))
+
+
+def delete_event(owner_id, object_id):
+    return {'object_type': 'activity', 'aspect_type': 'delete', 'owner_id': owner_id, 'object_id': object_id,
+            'subscription_id': 5}
+
+
+def activity_event(aspect_type, owner_id, object_id):
+    return dict(delete_event(owner_id, object_id), aspect_type=aspect_type)
+
+
+def stored_activity(storage, athlete_id, activity_id):
+    rows = (storage.supabase.table('activities').select('*')
+            .eq('athlete_id', athlete_id).eq('activity_id', str(activity_id)).execute().data)
+    return rows[0] if rows else None
+
+
+def test_create_ingests_the_activity_and_its_streams(storage, fake_strava, logged_in):
+    activity = fake_strava.athlete_activities(77)[0]
+
+    assert webhook.handle_event(activity_event('create', 77, activity['id']), storage=storage) == 'upserted'
+    assert fake_strava.requests == 2
+    assert activity['name'] in stored_activity(storage, '77', activity['id'])['summary']
+    streams = decode_streams(storage.get_activity_streams('77', activity['id']))
+    assert set(streams) == {'time', 'distance', 'heartrate', 'altitude', 'velocity_smooth', 'cadence'}
+    assert len(streams['time']) == activity['moving_time']
+
+
+def test_update_refreshes_the_activity_without_refetching_streams(storage, fake_strava, logged_in):
+    activity = fake_strava.athlete_activities(77)[0]
+    webhook.handle_event(activity_event('create', 77, activity['id']), storage=storage)
+    stored_streams = storage.get_activity_streams('77', activity['id'])
+    activity['name'] = 'Renamed run'
+
+    assert webhook.handle_event(activity_event('update', 77, activity['id']), storage=storage) == 'upserted'
+    assert fake_strava.requests == 3
+    assert stored_activity(storage, '77', activity['id'])['name'] == 'Renamed run'
+    assert storage.get_activity_streams('77', activity['id']) == stored_streams
+
+
+def test_create_is_stored_without_streams_when_rate_limited(storage, fake_strava, logged_in, monkeypatch):
+    def rate_limited(*args, **kwargs):
+        raise StravaRateLimitError("Strava rate limit exhausted", retry_after=600)
+
+    monkeypatch.setattr(webhook, 'fetch_activity_streams', rate_limited)
+    activity = fake_strava.athlete_activities(77)[0]
+
+    assert webhook.handle_event(activity_event('create', 77, activity['id']), storage=storage) == 'upserted'
+    assert stored_activity(storage, '77', activity['id']) is not None
+    assert storage.get_activity_streams('77', activity['id']) is None
+
+
+def test_create_of_an_unknown_activity_stores_nothing(storage, fake_strava, logged_in):
+    assert webhook.handle_event(activity_event('create', 77, 7799999), storage=storage) == 'fetch_failed'
+    assert storage.get_existing_activity_ids('77', [7799999]) == set()
+
+
+def test_create_without_token_fetches_nothing(storage, fake_strava, monkeypatch):
+    monkeypatch.setattr(webhook, 'get_valid_token', lambda athlete_id: (None, None))
+    activity = fake_strava.athlete_activities(77)[0]
+
+    assert webhook.handle_event(activity_event('create', 77, activity['id']), storage=storage) == 'no_token'
+    assert fake_strava.requests == 0
+    assert stored_activity(storage, '77', activity['id']) is None
+
+
+def test_delete_is_ignored_while_strava_still_has_the_activity(storage, fake_strava, logged_in):
+    activity = fake_strava.athlete_activities(77)[0]
+    storage.add_activity('77', activity, 'summary')
+
+    assert webhook.handle_event(delete_event(77, activity['id']), storage=storage) == 'delete_unconfirmed'
+    assert storage.get_existing_activity_ids('77', [activity['id']]) == {str(activity['id'])}
+
+
+def test_delete_applies_once_strava_answers_404(storage, fake_strava, logged_in):
+    activity = dict(fake_strava.athlete_activities(77)[0], id=7799999)
+    storage.add_activity('77', activity, 'summary')
+
+    assert webhook.handle_event(delete_event(77, activity['id']), storage=storage) == 'deleted'
+    assert storage.get_existing_activity_ids('77', [activity['id']]) == set()
+
+
+def test_delete_without_token_is_not_applied(storage, fake_strava, monkeypatch):
+    monkeypatch.setattr(webhook, 'get_valid_token', lambda athlete_id: (None, None))
+    activity = dict(fake_strava.athlete_activities(77)[0], id=7799999)
+    storage.add_activity('77', activity, 'summary')
+
+    assert webhook.handle_event(delete_event(77, activity['id']), storage=storage) == 'no_token'
+    assert storage.get_existing_activity_ids('77', [activity['id']]) == {'7799999'}
+
+
+@pytest.fixture
+def server(monkeypatch):
+    handled = []
+    done = threading.Event()
+
+    def record(event, storage=None):
+        handled.append(event)
+        done.set()
+        return 'recorded'
+
+    monkeypatch.setattr(webhook, 'handle_event', record)
+    server = webhook.make_server('127.0.0.1', 0, verify_token='secret-token', subscription_id=5)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}{webhook.WEBHOOK_PATH}", handled, done
+    server.shutdown()
+    server.server_close()
+
+
+def test_events_of_another_subscription_are_rejected(server):
+    url, handled, done = server
+    response = requests.post(url, json=delete_event(77, 1) | {'subscription_id': 6}, timeout=5)
+
+    assert response.status_code == 403
+    assert not done.wait(0.2)
+    assert handled == []
+
+
+def test_events_of_the_subscription_are_processed(server):
+    url, handled, done = server
+    response = requests.post(url, json=delete_event(77, 1), timeout=5)
+
+    assert response.status_code == 200
+    assert done.wait(5)
+    assert handled[0]['object_id'] == 1
+
+
+def test_validation_requires_the_verify_token(server):
+    url = server[0]
+    params = {'hub.mode': 'subscribe', 'hub.challenge': 'abc'}
+
+    assert requests.get(url, params=params | {'hub.verify_token': 'wildstride'}, timeout=5).status_code == 403
+    response = requests.get(url, params=params | {'hub.verify_token': 'secret-token'}, timeout=5)
+    assert response.json() == {'hub.challenge': 'abc'}
+
+
+def test_verify_token_has_no_default():
+    with pytest.raises(KeyError):
+        webhook.get_verify_token()
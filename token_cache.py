@@ -0,0 +1,100 @@
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+# Refresh tokens this many seconds before they actually expire
+TOKEN_REFRESH_BUFFER = 300
+
+
+class TokenCache:
+    """
+    Per-athlete Strava token cache with expiry-based TTL and single-flight refresh.
+
+    Entries stay valid until their stored `expires_at` (minus the refresh buffer). When an
+    entry expires, only one caller per athlete reloads the stored tokens, refreshes them if
+    they are still expired and persists the new ones; concurrent callers wait on the same
+    lock and reuse the result.
+    """
+
+    def __init__(self, load: Callable[[str], Optional[Dict]], refresh: Callable[[str], Dict],
+                 save: Callable[[str, Dict], None], refresh_buffer: int = TOKEN_REFRESH_BUFFER):
+        self._load = load
+        self._refresh = refresh
+        self._save = save
+        self.refresh_buffer = refresh_buffer
+        self._entries: Dict[str, Dict] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._guard = threading.Lock()
+
+    def _lock_for(self, athlete_id: str) -> threading.Lock:
+        with self._guard:
+            return self._locks.setdefault(athlete_id, threading.Lock())
+
+    def _needs_refresh(self, tokens: Dict) -> bool:
+        expires_at = tokens.get('expires_at')
+        return bool(expires_at) and int(expires_at) < time.time() + self.refresh_buffer
+
+    def _entry(self, tokens: Dict) -> Dict:
+        return {
+            'access_token': tokens.get('access_token'),
+            'refresh_token': tokens.get('refresh_token'),
+            'expires_at': int(tokens.get('expires_at') or 0)
+        }
+
+    def get(self, athlete_id: str) -> Optional[str]:
+        """Return a valid access token for the athlete, refreshing it at most once across concurrent callers"""
+        entry = self._entries.get(athlete_id)
+        if entry and not self._needs_refresh(entry):
+            return entry['access_token']
+
+        with self._lock_for(athlete_id):
+            # Another caller may have loaded or refreshed the tokens while we waited
+            entry = self._entries.get(athlete_id)
+            if entry and not self._needs_refresh(entry):
+                return entry['access_token']
+
+            # Re-read the stored tokens: another process (the webhook, another app instance) may have
+            # refreshed them already, and Strava rotates the refresh token, so ours may be spent
+            stored_tokens = self._load(athlete_id)
+            if stored_tokens:
+                entry = self._entry(stored_tokens)
+            elif entry is None:
+                print("No stored tokens found")
+                return None
+            if not self._needs_refresh(entry):
+                self._entries[athlete_id] = entry
+                return entry['access_token']
+
+            print("Token needs refresh")
+            new_tokens = self._refresh(entry['refresh_token'])
+            if 'access_token' not in new_tokens:
+                print("Token refresh failed")
+                self._entries.pop(athlete_id, None)
+                return None
+
+            print("Token refreshed successfully")
+            self._save(athlete_id, new_tokens)
+            self._entries[athlete_id] = self._entry(new_tokens)
+            return new_tokens['access_token']
+
+    def put(self, athlete_id: str, tokens: Dict) -> bool:
+        """
+        Store freshly issued tokens (e.g. from the OAuth code exchange) and persist them.
+
+        Returns:
+            bool: False if the cache already holds tokens that are at least as recent, in which case nothing is saved.
+        """
+        entry = self._entry(tokens)
+        if not entry['access_token']:
+            return False
+        with self._lock_for(athlete_id):
+            current = self._entries.get(athlete_id)
+            if current and current['expires_at'] >= entry['expires_at']:
+                return False
+            self._save(athlete_id, tokens)
+            self._entries[athlete_id] = entry
+            return True
+
+    def invalidate(self, athlete_id: str) -> None:
+        """Drop the cached tokens so the next get reloads them from storage"""
+        self._entries.pop(athlete_id, None)
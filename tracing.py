@@ -0,0 +1,244 @@
+import contextvars
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+# Upper bounds (seconds) of the latency histogram buckets, +Inf is implicit
+HISTOGRAM_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+# Spans kept in memory for the debug panel
+RECENT_SPANS = 2000
+
+# Trace of the current render, job or webhook event: {'trace_id', 'athlete_id', 'started_at'}
+_current_trace: contextvars.ContextVar = contextvars.ContextVar('wildstride_trace', default=None)
+
+
+class Histogram:
+    """Cumulative latency histogram in the Prometheus layout"""
+
+    def __init__(self):
+        self.bucket_counts = [0] * len(HISTOGRAM_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.errors = 0
+
+    def observe(self, seconds: float, error: bool = False) -> None:
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[index] += 1
+                break
+        self.count += 1
+        self.total += seconds
+        if error:
+            self.errors += 1
+
+    def cumulative(self) -> List[int]:
+        counts, running = [], 0
+        for count in self.bucket_counts:
+            running += count
+            counts.append(running)
+        return counts
+
+
+class Tracer:
+    """
+    Process-wide registry of outbound call timings.
+
+    Every span updates the histogram of its (service, operation) and is kept in a bounded
+    buffer; when a log path is set, spans are also appended to a JSON-lines file.
+    """
+
+    def __init__(self, log_path: Optional[str] = None):
+        self.log_path = log_path
+        self.histograms: Dict[tuple, Histogram] = {}
+        self.recent = deque(maxlen=RECENT_SPANS)
+        self._lock = threading.Lock()
+
+    def record(self, service: str, operation: str, seconds: float, error: Optional[str] = None, **tags) -> Dict:
+        trace = _current_trace.get() or {}
+        span = {
+            'ts': time.time(),
+            'trace_id': trace.get('trace_id'),
+            'athlete_id': trace.get('athlete_id'),
+            'service': service,
+            'operation': operation,
+            'duration_ms': round(seconds * 1000, 3),
+            'error': error,
+            **tags
+        }
+        with self._lock:
+            histogram = self.histograms.setdefault((service, operation), Histogram())
+            histogram.observe(seconds, error=error is not None)
+            self.recent.append(span)
+            if self.log_path:
+                with open(self.log_path, 'a') as f:
+                    f.write(json.dumps(span, default=str) + '\n')
+        return span
+
+    def spans(self, trace_id: Optional[str] = None) -> List[Dict]:
+        with self._lock:
+            return [span for span in self.recent if trace_id is None or span['trace_id'] == trace_id]
+
+    def prometheus_text(self) -> str:
+        """Histograms in the Prometheus text exposition format"""
+        metric = 'wildstride_outbound_call_duration_seconds'
+        lines = [f'# HELP {metric} Latency of outbound calls by service and operation',
+                 f'# TYPE {metric} histogram']
+        errors = ['# HELP wildstride_outbound_call_errors_total Outbound calls that raised',
+                  '# TYPE wildstride_outbound_call_errors_total counter']
+        with self._lock:
+            for (service, operation), histogram in sorted(self.histograms.items()):
+                labels = f'service="{service}",operation="{operation}"'
+                for bound, count in zip(HISTOGRAM_BUCKETS, histogram.cumulative()):
+                    lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {count}')
+                lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+                lines.append(f'{metric}_sum{{{labels}}} {histogram.total:.6f}')
+                lines.append(f'{metric}_count{{{labels}}} {histogram.count}')
+                errors.append(f'wildstride_outbound_call_errors_total{{{labels}}} {histogram.errors}')
+        return '\n'.join(lines + errors) + '\n'
+
+    def write_prometheus(self, path: str) -> None:
+        """Write the histograms for a node_exporter textfile collector (atomic replace)"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(tmp_path, path)
+
+    def summary(self) -> List[Dict]:
+        """Count, mean and error count per (service, operation)"""
+        with self._lock:
+            return [
+                {'service': service, 'operation': operation, 'count': h.count,
+                 'mean_ms': round(h.total / h.count * 1000, 1) if h.count else 0.0, 'errors': h.errors}
+                for (service, operation), h in sorted(self.histograms.items())
+            ]
+
+
+tracer = Tracer()
+
+
+def configure(log_path: Optional[str] = None) -> None:
+    """Enable the JSON-lines span log"""
+    if log_path:
+        directory = os.path.dirname(log_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    tracer.log_path = log_path
+
+
+def endpoint_name(path: str) -> str:
+    """Collapse IDs out of a URL path so calls to the same endpoint share a histogram"""
+    return re.sub(r'/\d+(?=/|$)', '/{id}', path)
+
+
+def start_trace(athlete_id: Optional[str] = None, trace_id: Optional[str] = None) -> str:
+    """Start a trace for the current render, job or event, returns its id"""
+    trace_id = trace_id or uuid.uuid4().hex[:12]
+    _current_trace.set({'trace_id': trace_id, 'athlete_id': athlete_id, 'started_at': time.perf_counter()})
+    return trace_id
+
+
+def set_trace_athlete(athlete_id: Optional[str]) -> None:
+    """Tag the rest of the current trace with the athlete, once the login resolved it"""
+    trace = _current_trace.get()
+    if trace is not None:
+        _current_trace.set(dict(trace, athlete_id=athlete_id))
+
+
+def current_trace_id() -> Optional[str]:
+    trace = _current_trace.get()
+    return trace['trace_id'] if trace else None
+
+
+def finish_trace(service: str = 'app', operation: str = 'render') -> Optional[Dict]:
+    """Record the duration of the current trace as one span and close it"""
+    trace = _current_trace.get()
+    if trace is None:
+        return None
+    span = tracer.record(service, operation, time.perf_counter() - trace['started_at'])
+    _current_trace.set(None)
+    return span
+
+
+@contextmanager
+def trace_context(athlete_id: Optional[str] = None, trace_id: Optional[str] = None) -> Iterator[str]:
+    """Run a block under its own trace (worker threads are reused, so the previous trace is restored)"""
+    token = _current_trace.set({'trace_id': trace_id or uuid.uuid4().hex[:12], 'athlete_id': athlete_id,
+                                'started_at': time.perf_counter()})
+    try:
+        yield _current_trace.get()['trace_id']
+    finally:
+        _current_trace.reset(token)
+
+
+@contextmanager
+def span(service: str, operation: str, **tags) -> Iterator[Dict]:
+    """
+    Time a block as one outbound call.
+
+    The yielded dict can be filled with extra tags while the block runs.
+    """
+    extra = dict(tags)
+    start = time.perf_counter()
+    try:
+        yield extra
+    except BaseException as e:
+        tracer.record(service, operation, time.perf_counter() - start, error=type(e).__name__, **extra)
+        raise
+    tracer.record(service, operation, time.perf_counter() - start, **extra)
+
+
+class _TracedQuery:
+    """Proxy of a supabase-py request builder timing its execute() call"""
+
+    OPERATIONS = ('select', 'insert', 'upsert', 'update', 'delete')
+
+    def __init__(self, builder, table: str, operation: str = 'select'):
+        self._builder = builder
+        self._table = table
+        self._operation = operation
+
+    def __getattr__(self, name: str):
+        attribute = getattr(self._builder, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            result = attribute(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return _TracedQuery(result, self._table, name if name in self.OPERATIONS else self._operation)
+            return result
+        return call
+
+    def execute(self):
+        with span('supabase', f"{self._operation} {self._table}") as tags:
+            response = self._builder.execute()
+            tags['rows'] = len(response.data) if isinstance(getattr(response, 'data', None), list) else None
+            return response
+
+
+class TracedClient:
+    """Wraps a supabase-like client so every query execute() is recorded as a span"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def __getattr__(self, name: str):
+        return getattr(self._client, name)
+
+    def table(self, name: str) -> _TracedQuery:
+        return _TracedQuery(self._client.table(name), name)
+
+    def from_(self, name: str) -> _TracedQuery:
+        return self.table(name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None, **kwargs) -> _TracedQuery:
+        return _TracedQuery(self._client.rpc(name, params or {}, **kwargs), name, 'rpc')
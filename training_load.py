@@ -0,0 +1,126 @@
+import math
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Time constants (days) of the fitness and fatigue exponentially weighted averages
+CTL_DAYS = 42
+ATL_DAYS = 7
+# Heart rate bounds used for the TRIMP estimate when Strava has no suffer_score
+REST_HEARTRATE = 60
+MAX_HEARTRATE = 190
+# Load per minute assumed when an activity has neither suffer_score nor heart rate
+DEFAULT_LOAD_PER_MINUTE = 1.0
+
+
+def activity_load(activity: Dict) -> float:
+    """
+    Training load of a stored activity row.
+
+    Uses Strava's suffer_score when present, otherwise Banister's TRIMP from
+    moving_time and average_heartrate, otherwise a flat rate per minute.
+    """
+    if activity.get('suffer_score') is not None:
+        return float(activity['suffer_score'])
+    minutes = (activity.get('moving_time') or 0) / 60
+    heartrate = activity.get('average_heartrate')
+    if heartrate:
+        reserve = min(max((heartrate - REST_HEARTRATE) / (MAX_HEARTRATE - REST_HEARTRATE), 0.0), 1.0)
+        return minutes * reserve * 0.64 * math.exp(1.92 * reserve)
+    return minutes * DEFAULT_LOAD_PER_MINUTE
+
+
+def activity_day(activity: Dict) -> int:
+    """Local calendar day of an activity as a date ordinal"""
+    return datetime.fromisoformat(activity['start_date_local'][:10]).toordinal()
+
+
+def _decay(days: int, time_constant: int) -> float:
+    return (1 - 1 / time_constant) ** days
+
+
+def empty_state() -> Dict:
+    return {'ctl': 0.0, 'atl': 0.0, 'last_day': None}
+
+
+def activity_loads(activities: Iterable[Dict], sign: int = 1) -> List[Tuple[int, float]]:
+    """(day, load) of activity rows, sign=-1 gives the loads to take back when they are deleted or replaced"""
+    return [(activity_day(activity), sign * activity_load(activity)) for activity in activities]
+
+
+def load_delta(loads: List[Tuple[int, float]]) -> Dict:
+    """
+    Combine (day, load) changes into one increment of the stored state.
+
+    Loads are decayed to the latest day of the batch, so the database applies the whole
+    batch in one statement whatever state it holds (see migrations/0001_apply_training_load.sql):
+    with last = max(last_day, day), ctl = ctl * decay(last - last_day) + delta_ctl * decay(last - day).
+    Each day's value is prev * (1 - 1/T) + load / T, which is linear in the loads, so this is the
+    same as folding every change in turn, late ones (before last_day) included.
+
+    Returns:
+        dict: The parameters of the apply_training_load function.
+    """
+    day = max(load_day for load_day, _ in loads)
+    return {
+        'p_day': date.fromordinal(day).isoformat(),
+        'p_ctl': sum(load / CTL_DAYS * _decay(day - load_day, CTL_DAYS) for load_day, load in loads),
+        'p_atl': sum(load / ATL_DAYS * _decay(day - load_day, ATL_DAYS) for load_day, load in loads),
+        'p_ctl_decay': _decay(1, CTL_DAYS),
+        'p_atl_decay': _decay(1, ATL_DAYS)
+    }
+
+
+def compute_state(activities: Iterable[Dict]) -> Dict:
+    """Recompute the state from every stored activity at once (backfills and repairs)"""
+    import numpy as np
+
+    activities = list(activities)
+    if not activities:
+        return empty_state()
+    days = np.fromiter((activity_day(a) for a in activities), dtype=np.int64, count=len(activities))
+    loads = np.fromiter((activity_load(a) for a in activities), dtype=np.float64, count=len(activities))
+    last_day = int(days.max())
+    age = last_day - days
+    return {
+        'ctl': float(np.dot(loads, _decay(age, CTL_DAYS))) / CTL_DAYS,
+        'atl': float(np.dot(loads, _decay(age, ATL_DAYS))) / ATL_DAYS,
+        'last_day': last_day
+    }
+
+
+def current_form(state: Optional[Dict], today: Optional[date] = None) -> Optional[Dict]:
+    """Fitness (CTL), fatigue (ATL) and form (TSB) decayed to today"""
+    if not state or state.get('last_day') is None:
+        return None
+    today = (today or date.today()).toordinal()
+    rest_days = max(today - state['last_day'], 0)
+    # The stored values may dip below zero while concurrent increments are applied, or by rounding
+    ctl = max(state['ctl'] * _decay(rest_days, CTL_DAYS), 0.0)
+    atl = max(state['atl'] * _decay(rest_days, ATL_DAYS), 0.0)
+    return {'ctl': round(ctl, 1), 'atl': round(atl, 1), 'tsb': round(ctl - atl, 1), 'rest_days': rest_days}
+
+
+def format_form_for_prompt(state: Optional[Dict]) -> str:
+    form = current_form(state)
+    if form is None:
+        return ""
+    return (f"Fitness (CTL, 42 days): {form['ctl']} | Fatigue (ATL, 7 days): {form['atl']} | "
+            f"Form (TSB): {form['tsb']} | Days since last activity: {form['rest_days']}")
+
+
+def state_to_row(athlete_id: str, state: Dict) -> Dict:
+    return {
+        'athlete_id': athlete_id,
+        'ctl': state['ctl'],
+        'atl': state['atl'],
+        'last_day': date.fromordinal(state['last_day']).isoformat() if state['last_day'] is not None else None,
+        'updated_at': datetime.now().isoformat()
+    }
+
+
+def row_to_state(row: Dict) -> Dict:
+    return {
+        'ctl': float(row['ctl'] or 0),
+        'atl': float(row['atl'] or 0),
+        'last_day': date.fromisoformat(row['last_day']).toordinal() if row.get('last_day') else None
+    }
@@ -0,0 +1,224 @@
+"""
+Strava push subscription receiver.
+
+Run the receiver:        python webhook.py serve --port 8000
+Register it on Strava:   python webhook.py subscribe --callback-url https://example.com/webhook
+Send a local fake event: python webhook.py send create --owner-id 123 --object-id 456
+
+Requires the strava_webhook_verify_token secret, and strava_webhook_subscription_id (the ID
+printed by `subscribe`) to serve: events are not signed, the receiver only accepts those
+carrying its own subscription ID and confirms deletes with Strava before applying them.
+"""
+import argparse
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+from urllib.parse import parse_qs, urlparse
+import streamlit as st
+from activities_parsing import extract_activity_summary, format_activity_for_prompt
+from activity_streams import encode_streams, stream_cache, to_stream_arrays
+from storage import get_storage
+from strava_api import activity_exists, fetch_activity_details, fetch_activity_streams, get_client_credentials, get_token_cache, get_valid_token
+from strava_client import get_client, StravaRateLimitError, PRIORITY_BACKGROUND
+from tracing import finish_trace, trace_context
+
+WEBHOOK_PATH = "/webhook"
+# Strava expects an answer within 2 seconds, events are processed on this pool
+MAX_EVENT_WORKERS = 4
+
+
+def get_verify_token() -> str:
+    """Token Strava echoes back when validating the subscription (required secret, no default)"""
+    return st.secrets["strava_webhook_verify_token"]
+
+
+def get_subscription_id() -> int:
+    """ID of the registered push subscription, events carrying any other ID are rejected"""
+    return int(st.secrets["strava_webhook_subscription_id"])
+
+
+def handle_event(event: Dict, storage=None) -> str:
+    """
+    Apply a Strava push event to storage.
+
+    Activity create/update events fetch the full payload, summarize it and upsert it
+    (with its compressed streams on create). Delete events remove the stored activity
+    once Strava confirms it is gone, since anyone can post an event to the receiver.
+
+    Returns:
+        str: What was done with the event (for logs and tests).
+    """
+    storage = storage or get_storage()
+    object_type = event.get('object_type')
+    aspect_type = event.get('aspect_type')
+    athlete_id = str(event.get('owner_id'))
+    object_id = event.get('object_id')
+
+    if object_type == 'athlete':
+        # Deauthorization: drop the cached tokens, stored data is left untouched
+        if event.get('updates', {}).get('authorized') == 'false':
+            get_token_cache().invalidate(athlete_id)
+            return 'deauthorized'
+        return 'ignored'
+
+    if object_type != 'activity':
+        return 'ignored'
+
+    if aspect_type == 'delete':
+        access_token, _ = get_valid_token(athlete_id)
+        if not access_token:
+            return 'no_token'
+        if activity_exists(access_token, object_id, priority=PRIORITY_BACKGROUND) is not False:
+            return 'delete_unconfirmed'
+        storage.delete_activity(athlete_id, object_id)
+        stream_cache.remove(athlete_id, object_id)
+        return 'deleted'
+
+    if aspect_type in ('create', 'update'):
+        access_token, _ = get_valid_token(athlete_id)
+        if not access_token:
+            return 'no_token'
+        activity = fetch_activity_details(access_token, object_id, priority=PRIORITY_BACKGROUND)
+        if 'id' not in activity:
+            print(f"Webhook could not fetch activity {object_id}: {activity}")
+            return 'fetch_failed'
+        str_summary = format_activity_for_prompt(extract_activity_summary(activity))
+        streams = None
+        if aspect_type == 'create':
+            # Samples do not change on update events (title, type, privacy), only fetch them once
+            try:
+                arrays = to_stream_arrays(fetch_activity_streams(access_token, object_id, priority=PRIORITY_BACKGROUND))
+                streams = encode_streams(arrays) if arrays else None
+            except StravaRateLimitError as e:
+                print(f"Webhook skipped streams of activity {object_id}: {e}")
+        storage.add_activity(athlete_id, activity, str_summary, streams=streams)
+        return 'upserted'
+
+    return 'ignored'
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    """HTTP handler for the Strava subscription validation (GET) and events (POST)"""
+
+    executor: ThreadPoolExecutor = None
+    verify_token: Optional[str] = None
+    subscription_id: Optional[int] = None
+
+    def _send_json(self, status: int, body: Dict) -> None:
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != WEBHOOK_PATH:
+            return self._send_json(404, {'error': 'not found'})
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        if self.verify_token and params.get('hub.mode') == 'subscribe' and params.get('hub.verify_token') == self.verify_token:
+            return self._send_json(200, {'hub.challenge': params.get('hub.challenge')})
+        return self._send_json(403, {'error': 'invalid verify token'})
+
+    def do_POST(self):
+        if urlparse(self.path).path != WEBHOOK_PATH:
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            event = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            return self._send_json(400, {'error': 'invalid JSON'})
+        if not isinstance(event, dict) or str(event.get('subscription_id')) != str(self.subscription_id):
+            return self._send_json(403, {'error': 'unknown subscription'})
+
+        # Acknowledge right away, Strava retries events that are not answered in time
+        self.executor.submit(self._process, event)
+        self._send_json(200, {'status': 'accepted'})
+
+    @staticmethod
+    def _process(event: Dict) -> None:
+        with trace_context(athlete_id=str(event.get('owner_id'))):
+            try:
+                result = handle_event(event)
+                print(f"Webhook {event.get('object_type')} {event.get('aspect_type')} {event.get('object_id')}: {result}")
+            except Exception as e:
+                print(f"Webhook event failed: {e}")
+            finally:
+                finish_trace('webhook', f"{event.get('object_type')} {event.get('aspect_type')}")
+
+
+def make_server(host: str = "0.0.0.0", port: int = 8000, verify_token: Optional[str] = None,
+                subscription_id: Optional[int] = None) -> ThreadingHTTPServer:
+    """Build the webhook HTTP server (call serve_forever on the result), defaults come from the secrets"""
+    handler = type('ConfiguredWebhookHandler', (WebhookHandler,), {
+        'executor': ThreadPoolExecutor(max_workers=MAX_EVENT_WORKERS, thread_name_prefix='webhook'),
+        'verify_token': verify_token or get_verify_token(),
+        'subscription_id': subscription_id if subscription_id is not None else get_subscription_id()
+    })
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def send_fake_event(aspect_type: str, owner_id: int, object_id: int, url: str = f"http://localhost:8000{WEBHOOK_PATH}",
+                    object_type: str = 'activity', updates: Optional[Dict] = None, subscription_id: Optional[int] = None) -> int:
+    """Post an event shaped like a Strava push notification to a local receiver, returns the HTTP status"""
+    event = {
+        'aspect_type': aspect_type,
+        'event_time': int(time.time()),
+        'object_id': object_id,
+        'object_type': object_type,
+        'owner_id': owner_id,
+        'subscription_id': subscription_id if subscription_id is not None else get_subscription_id(),
+        'updates': updates or {}
+    }
+    return get_client().session.post(url, json=event, timeout=5).status_code
+
+
+def create_subscription(callback_url: str) -> Dict:
+    """Register the webhook callback with Strava (one subscription per application)"""
+    client_id, client_secret = get_client_credentials()
+    response = get_client().post(
+        "push_subscriptions",
+        data={
+            "client_id": client_id,
+            "client_secret": client_secret,
+            "callback_url": callback_url,
+            "verify_token": get_verify_token()
+        }
+    )
+    return response.json()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Strava webhook receiver")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve = commands.add_parser("serve", help="run the receiver")
+    serve.add_argument("--host", default="0.0.0.0")
+    serve.add_argument("--port", type=int, default=8000)
+
+    subscribe = commands.add_parser("subscribe", help="register the callback URL with Strava")
+    subscribe.add_argument("--callback-url", required=True)
+
+    send = commands.add_parser("send", help="send a fake event to a local receiver")
+    send.add_argument("aspect_type", choices=["create", "update", "delete"])
+    send.add_argument("--owner-id", type=int, required=True)
+    send.add_argument("--object-id", type=int, required=True)
+    send.add_argument("--url", default=f"http://localhost:8000{WEBHOOK_PATH}")
+    send.add_argument("--subscription-id", type=int, default=None)
+
+    args = parser.parse_args()
+    if args.command == "serve":
+        server = make_server(args.host, args.port)
+        print(f"Listening for Strava events on {args.host}:{args.port}{WEBHOOK_PATH}")
+        server.serve_forever()
+    elif args.command == "subscribe":
+        subscription = create_subscription(args.callback_url)
+        print(subscription)
+        if 'id' in subscription:
+            print(f"Set strava_webhook_subscription_id = {subscription['id']} in the secrets before serving")
+    else:
+        print(send_fake_event(args.aspect_type, args.owner_id, args.object_id, url=args.url,
+                              subscription_id=args.subscription_id))